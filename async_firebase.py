@@ -0,0 +1,376 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""An asyncio Firebase CloudToolsResults API client"""
+
+import asyncio
+import time
+from typing import AsyncIterator
+
+from firebase import ONE_DAY, Fields, Paging, steps_needing_test_cases, test_case_results_from_details
+from lib.firebase_conn import USER_AGENT, FirebaseConn
+from lib.records import ExecutionDetails
+from lib.scheduler import RequestScheduler
+
+TOOLRESULTS_ENDPOINT = 'https://toolresults.googleapis.com/toolresults/v1beta3/'
+
+
+async def _collect(items: AsyncIterator) -> list:
+    return [item async for item in items]
+
+
+class AsyncFirebase:
+    """
+    Coroutine counterparts of the Firebase get_* calls over one shared aiohttp session,
+    with at most `concurrency` requests in flight. Like Firebase, requests draw from the
+    scheduler's quota and are retried on 429 and 5xx responses, honoring Retry-After.
+    Use as an async context manager.
+    """
+
+    def __init__(self, project_id: str, filter_by_name: str, concurrency: int = 64,
+                 endpoint: str = TOOLRESULTS_ENDPOINT, connection: FirebaseConn = None,
+                 anonymous: bool = False, scheduler: RequestScheduler = None) -> None:
+        self.projectId = project_id
+        self.filterByName = filter_by_name
+        self.concurrency = concurrency
+        self.endpoint = endpoint
+        self.connection = connection or FirebaseConn(project_id)
+        self.scheduler = scheduler or RequestScheduler()
+        self.anonymous = anonymous
+        self.session = None
+        self._credentials = None
+        self._semaphore = None
+        self._token_lock = None
+
+    async def __aenter__(self) -> 'AsyncFirebase':
+        import aiohttp
+
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._token_lock = asyncio.Lock()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            headers={'User-Agent': USER_AGENT},
+            raise_for_status=True
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.session.close()
+
+    async def _headers(self) -> dict:
+        """Bearer token headers; the (blocking) token refresh runs off the event loop, once for all requests.
+        The token is shared with the connection's synchronous transports"""
+        if self.anonymous:
+            return {}
+        async with self._token_lock:
+            if self._credentials is None:
+                self._credentials = self.connection.shared_credentials
+            if not self._credentials.valid:
+                from google.auth.transport.requests import Request
+                await asyncio.get_running_loop().run_in_executor(None, self._credentials.refresh, Request())
+        return {'Authorization': 'Bearer {}'.format(self._credentials.token)}
+
+    async def _get(self, path: str, **params) -> dict:
+        params = {key: str(value) for key, value in params.items() if value is not None}
+        return await self.scheduler.execute_async(self.projectId, lambda: self._attempt(path, params))
+
+    async def _attempt(self, path: str, params: dict) -> dict:
+        headers = await self._headers()
+        async with self._semaphore:
+            async with self.session.get(self.endpoint + path, params=params, headers=headers) as response:
+                return await response.json()
+
+    def _history_path(self, history_id: str) -> str:
+        return 'projects/{}/histories/{}'.format(self.projectId, history_id)
+
+    def _execution_path(self, history_id: str, execution_id: int) -> str:
+        return '{}/executions/{}'.format(self._history_path(history_id), execution_id)
+
+    async def get_histories(self, page_token: str = None, fields: str = None) -> dict:
+        """Get a page of histories sorted by modification time in descending order"""
+        return await self._get(
+            'projects/{}/histories'.format(self.projectId),
+            filterByName=self.filterByName,
+            pageSize=int(Paging.HISTORIES_PAGE_SIZE.value),
+            pageToken=page_token,
+            fields=fields
+        )
+
+    async def iter_histories(self, fields: str = None) -> AsyncIterator[dict]:
+        """Lazily yield every matching history, most recently modified first, following nextPageToken"""
+        page_token = None
+        while True:
+            histories = await self.get_histories(page_token, fields)
+            for history in histories.get('histories', []):
+                yield history
+            page_token = histories.get('nextPageToken')
+            if not page_token:
+                return
+
+    async def get_executions(self, history_id: str, page_token: str = None, fields: str = None) -> dict:
+        """Get a page of executions for a given history"""
+        return await self._get(
+            '{}/executions'.format(self._history_path(history_id)),
+            pageSize=int(Paging.EXECUTIONS_PAGE_SIZE.value),
+            pageToken=page_token,
+            fields=fields
+        )
+
+    async def iter_executions(self, history_id: str, fields: str = None) -> AsyncIterator[dict]:
+        """Lazily yield every execution for a given history, one page at a time, following nextPageToken"""
+        page_token = None
+        while True:
+            executions = await self.get_executions(history_id, page_token, fields)
+            for execution in executions.get('executions', []):
+                yield execution
+            page_token = executions.get('nextPageToken')
+            if not page_token:
+                return
+
+    async def get_execution(self, history_id: str, execution_id: int) -> dict:
+        """Get a single execution"""
+        return await self._get(self._execution_path(history_id, execution_id))
+
+    async def get_steps(self, history_id: str, execution_id: int, page_size: int, page_token: str = None,
+                        fields: str = None) -> dict:
+        """Get a list of steps for a given execution sorted by creation time in descending order"""
+        return await self._get(
+            '{}/steps'.format(self._execution_path(history_id, execution_id)),
+            pageSize=page_size,
+            pageToken=page_token,
+            fields=fields
+        )
+
+    async def get_step(self, history_id: str, execution_id: int, step_id: str) -> dict:
+        """Get a single step"""
+        return await self._get('{}/steps/{}'.format(self._execution_path(history_id, execution_id), step_id))
+
+    async def iter_steps(self, history_id: str, execution_id: int,
+                         page_size: int = Paging.STEPS_PAGE_SIZE.value, fields: str = None) -> AsyncIterator[dict]:
+        """Lazily yield every step of an execution, one page at a time, following nextPageToken"""
+        page_token = None
+        while True:
+            steps = await self.get_steps(history_id, execution_id, page_size, page_token, fields)
+            for step in steps.get('steps', []):
+                yield step
+            page_token = steps.get('nextPageToken')
+            if not page_token:
+                return
+
+    async def get_test_cases(self, history_id: str, execution_id: int, step_id: str, page_size: int,
+                             page_token: str = None, fields: str = None) -> dict:
+        """Get a page of test cases attached to a Step"""
+        return await self._get(
+            '{}/steps/{}/testCases'.format(self._execution_path(history_id, execution_id), step_id),
+            pageSize=page_size,
+            pageToken=page_token,
+            fields=fields
+        )
+
+    async def iter_test_cases(self, history_id: str, execution_id: int, step_id: str,
+                              page_size: int = Paging.CASES_PAGE_SIZE.value,
+                              fields: str = None) -> AsyncIterator[dict]:
+        """Lazily yield every test case of a step, one page at a time, following nextPageToken"""
+        page_token = None
+        while True:
+            test_cases = await self.get_test_cases(history_id, execution_id, step_id, page_size, page_token,
+                                                   fields)
+            for test_case in test_cases.get('testCases', []):
+                yield test_case
+            page_token = test_cases.get('nextPageToken')
+            if not page_token:
+                return
+
+    async def get_test_case(self, history_id: str, execution_id: int, step_id: str, test_case_id: str) -> dict:
+        """Get a single test case"""
+        return await self._get('{}/steps/{}/testCases/{}'.format(
+            self._execution_path(history_id, execution_id), step_id, test_case_id))
+
+    async def get_environments(self, history_id: str, execution_id: int, page_token: str = None,
+                               fields: str = None) -> dict:
+        """Get a page of the environments for a given execution"""
+        return await self._get(
+            '{}/environments'.format(self._execution_path(history_id, execution_id)),
+            pageToken=page_token,
+            fields=fields
+        )
+
+    async def iter_environments(self, history_id: str, execution_id: int,
+                                fields: str = None) -> AsyncIterator[dict]:
+        """Lazily yield every environment of an execution, following nextPageToken"""
+        page_token = None
+        while True:
+            environments = await self.get_environments(history_id, execution_id, page_token, fields)
+            for environment in environments.get('environments', []):
+                yield environment
+            page_token = environments.get('nextPageToken')
+            if not page_token:
+                return
+
+    async def get_environment(self, history_id: str, execution_id: int, environment_id: int) -> dict:
+        """Get a single environment"""
+        return await self._get('{}/environments/{}'.format(
+            self._execution_path(history_id, execution_id), environment_id))
+
+
+class AsyncFirebaseHelper:
+    """The FirebaseHelper reports as coroutines: every execution of a report is fetched concurrently"""
+
+    def __init__(self, project_id: str, filter_by_name: str, concurrency: int = 64,
+                 endpoint: str = TOOLRESULTS_ENDPOINT, connection: FirebaseConn = None,
+                 anonymous: bool = False, partial_responses: bool = True, all_histories: bool = False,
+                 scheduler: RequestScheduler = None) -> None:
+        self.firebase = AsyncFirebase(project_id, filter_by_name, concurrency, endpoint, connection, anonymous,
+                                      scheduler)
+        self.partial_responses = partial_responses
+        self.all_histories = all_histories
+
+    def fields(self, mask: Fields) -> str:
+        """The fields= mask to send, or None for full responses"""
+        return mask.value if self.partial_responses else None
+
+    async def __aenter__(self) -> 'AsyncFirebaseHelper':
+        await self.firebase.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.firebase.__aexit__(*exc)
+
+    async def get_histories(self, page_token: str = None) -> dict:
+        """Get a page of test histories"""
+        return await self.firebase.get_histories(page_token)
+
+    def iter_histories(self, fields: str = None) -> AsyncIterator[dict]:
+        """Lazily iterate over every test history across all pages"""
+        return self.firebase.iter_histories(fields)
+
+    async def history_ids(self) -> list:
+        """The histories the reports cover: the most recently modified one, or all of them in all_histories mode"""
+        history_ids = []
+        async for history in self.iter_histories(self.fields(Fields.HISTORIES)):
+            history_ids.append(history['historyId'])
+            if not self.all_histories:
+                break
+        if not history_ids:
+            raise ValueError('No history of {} matches {}'.format(self.firebase.projectId, self.firebase.filterByName))
+        return history_ids
+
+    async def get_executions(self, history_id: str, page_token: str) -> dict:
+        """Get a list of all test executions"""
+        return await self.firebase.get_executions(history_id, page_token)
+
+    def iter_executions(self, history_id: str, fields: str = None) -> AsyncIterator[dict]:
+        """Lazily iterate over every test execution across all pages"""
+        return self.firebase.iter_executions(history_id, fields=fields)
+
+    async def get_execution(self, history_id: str, execution_id: int) -> dict:
+        """Get a single execution"""
+        return await self.firebase.get_execution(history_id, execution_id)
+
+    async def get_steps(self, history_id: str, execution_id: int, page_size: int, page_token: str) -> dict:
+        """Get a list of all test steps"""
+        return await self.firebase.get_steps(history_id, execution_id, page_size, page_token)
+
+    async def get_step(self, history_id: str, execution_id: int, step_id: str) -> dict:
+        """Get a single step"""
+        return await self.firebase.get_step(history_id, execution_id, step_id)
+
+    def iter_steps(self, history_id: str, execution_id: int, fields: str = None) -> AsyncIterator[dict]:
+        """Lazily iterate over every step of an execution across all pages"""
+        return self.firebase.iter_steps(history_id, execution_id, fields=fields)
+
+    async def get_test_cases(self, history_id: str, execution_id: int, step_id: str, page_size: int,
+                             page_token: str = None) -> dict:
+        """Get a list of test cases attached to a Step"""
+        return await self.firebase.get_test_cases(history_id, execution_id, step_id, page_size, page_token)
+
+    def iter_test_cases(self, history_id: str, execution_id: int, step_id: str,
+                        fields: str = None) -> AsyncIterator[dict]:
+        """Lazily iterate over every test case of a step across all pages"""
+        return self.firebase.iter_test_cases(history_id, execution_id, step_id, fields=fields)
+
+    async def get_test_case(self, history_id: str, execution_id: int, step_id: str, test_case_id: str) -> dict:
+        """Get a single test case"""
+        return await self.firebase.get_test_case(history_id, execution_id, step_id, test_case_id)
+
+    async def get_environments(self, history_id: str, execution_id: int, page_token: str = None) -> dict:
+        """Get the environments for a given execution"""
+        return await self.firebase.get_environments(history_id, execution_id, page_token)
+
+    async def get_environment(self, history_id: str, execution_id: int, environment_id: int) -> dict:
+        """Get a single environment"""
+        return await self.firebase.get_environment(history_id, execution_id, environment_id)
+
+    def check_for_execution_state(self, execution: dict, state: str) -> bool:
+        """Check if an execution is in a complete immutable state"""
+        return ('state', state) in execution.items()
+
+    async def iter_executions_in_window(self, history_id: str, since: int = None,
+                                        until: int = None) -> AsyncIterator[dict]:
+        """Yield executions created within [since, until] (epoch seconds), stopping at the first one
+        older than `since`"""
+        async for execution in self.iter_executions(history_id, self.fields(Fields.EXECUTIONS)):
+            created = int(execution['creationTime']['seconds'])
+            if until is not None and created > until:
+                continue
+            if since is not None and created < since:
+                return
+            yield execution
+
+    async def fetch_execution_details(self, history_id: str, execution: dict) -> ExecutionDetails:
+        """Fetch the steps, environments and failing test cases of an execution concurrently, as records"""
+        execution_id = int(execution['executionId'])
+        steps, environments = await asyncio.gather(
+            _collect(self.iter_steps(history_id, execution_id, self.fields(Fields.STEPS))),
+            _collect(self.firebase.iter_environments(history_id, execution_id, self.fields(Fields.ENVIRONMENTS)))
+        )
+        details = ExecutionDetails.from_responses(execution, {'steps': steps}, {'environments': environments})
+        step_ids = steps_needing_test_cases(details)
+        cases = await asyncio.gather(*(
+            _collect(self.iter_test_cases(history_id, execution_id, step_id, self.fields(Fields.TEST_CASES)))
+            for step_id in step_ids
+        ))
+        for step_id, step_cases in zip(step_ids, cases):
+            details.add_test_cases(step_id, {'testCases': step_cases})
+        return details
+
+    async def get_test_case_results_by_execution_summary(self, execution_outcome_summary: str, since: int = None,
+                                                         until: int = None) -> list:
+        """Get test case results from executions with a provided outcome summary, optionally
+        limited to executions created within [since, until] (epoch seconds)"""
+        past_day = int(time.time()) - ONE_DAY
+        tasks = []
+        for history_id in await self.history_ids():
+            async for execution in self.iter_executions_in_window(history_id, since, until):
+                if self.check_for_execution_state(execution, 'complete'):
+                    if execution['outcome']['summary'] == execution_outcome_summary:
+                        tasks.append(asyncio.ensure_future(self.fetch_execution_details(history_id, execution)))
+
+        results = []
+        for details in await asyncio.gather(*tasks):
+            results.extend(test_case_results_from_details(details, past_day))
+        return results
+
+    async def count_steps(self, history_id: str, execution_id: int) -> int:
+        """Count every step of an execution, paging through them without holding more than one page"""
+        count = 0
+        async for _ in self.iter_steps(history_id, execution_id, self.fields(Fields.STEP_IDS)):
+            count += 1
+        return count
+
+    async def get_recent_step_count_by_execution_summary(self, execution_outcome_summary: str, since: int = None,
+                                                         until: int = None) -> int:
+        """Count the steps of executions with a provided outcome summary created within [since, until]
+        (epoch seconds), by default the past day"""
+        if since is None:
+            since = int(time.time()) - ONE_DAY
+        tasks = []
+        for history_id in await self.history_ids():
+            async for execution in self.iter_executions_in_window(history_id, since, until):
+                if self.check_for_execution_state(execution, 'complete'):
+                    if execution['outcome']['summary'] == execution_outcome_summary:
+                        tasks.append(asyncio.ensure_future(self.count_steps(history_id, int(execution['executionId']))))
+        return sum(await asyncio.gather(*tasks))
@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Runs the AsyncFirebaseHelper reports against a local fake ToolResults
+HTTP server, checks they match the threaded FirebaseHelper results and
+reports wall time for each concurrency limit
+'''
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_firebase import AsyncFirebaseHelper  # noqa: E402
+from firebase import ExecutionOutcome, FirebaseHelper  # noqa: E402
+from lib.fake_toolresults import (  # noqa: E402
+    FakeConnection, FakeToolResults, FakeToolResultsServer, SyntheticHistory
+)
+from lib.scheduler import RequestScheduler  # noqa: E402
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the asyncio client against a local fake ToolResults server'
+    )
+    parser.add_argument('--executions', type=int, default=100)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--cases', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='Simulated server latency (seconds)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64, 256])
+    return parser.parse_args(args=cmdln_args)
+
+
+async def run_async(endpoint: str, concurrency: int) -> tuple:
+    async with AsyncFirebaseHelper('moz-fenix', 'org.mozilla.fenix.debug', concurrency, endpoint,
+                                   anonymous=True, scheduler=RequestScheduler(None)) as helper:
+        results = await helper.get_test_case_results_by_execution_summary(ExecutionOutcome.FAILURE.value, since=0)
+        count = await helper.get_recent_step_count_by_execution_summary(ExecutionOutcome.SUCCESS.value, since=0)
+    return results, count
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    history = SyntheticHistory(args.executions, args.steps, args.cases)
+
+    helper = FirebaseHelper('moz-fenix', 'org.mozilla.fenix.debug', connection=FakeConnection(FakeToolResults(history)),
+                            scheduler=RequestScheduler(None))
+    expected = (
+        helper.get_test_case_results_by_execution_summary(ExecutionOutcome.FAILURE.value, since=0),
+        helper.get_recent_step_count_by_execution_summary(ExecutionOutcome.SUCCESS.value, since=0),
+    )
+
+    backend = FakeToolResults(history, latency=args.latency)
+    with FakeToolResultsServer(backend) as server:
+        print(f"{'concurrency':>11} {'seconds':>9} {'requests':>9}")
+        for concurrency in args.concurrency:
+            backend.calls = 0
+            start = time.perf_counter()
+            actual = asyncio.run(run_async(server.endpoint, concurrency))
+            elapsed = time.perf_counter() - start
+            if actual != expected:
+                raise SystemExit(f"Async results with concurrency {concurrency} differ from FirebaseHelper")
+            print(f"{concurrency:>11} {elapsed:>9.3f} {backend.calls:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Compares the serial, parallel and batched fetch paths of
+FirebaseHelper.get_test_case_results_by_execution_summary against a
+simulated ToolResults backend with a fixed round-trip latency
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from firebase import ExecutionOutcome, FirebaseHelper  # noqa: E402
+from lib.fake_toolresults import FakeConnection, FakeToolResults, SyntheticHistory  # noqa: E402
+from lib.scheduler import RequestScheduler  # noqa: E402
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Benchmark concurrent execution detail fetching'
+    )
+    parser.add_argument('--executions', type=int, default=40)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--cases', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='Simulated round trip (seconds)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16])
+    return parser.parse_args(args=cmdln_args)
+
+
+def run(args, workers: int, batch: bool = False) -> tuple:
+    backend = FakeToolResults(
+        SyntheticHistory(args.executions, args.steps, args.cases, now=1_700_000_000),
+        latency=args.latency
+    )
+    helper = FirebaseHelper('moz-fenix', 'org.mozilla.fenix.debug', workers, batch, connection=FakeConnection(backend),
+                            scheduler=RequestScheduler(None, max_in_flight=workers))
+    start = time.perf_counter()
+    results = helper.get_test_case_results_by_execution_summary(ExecutionOutcome.FAILURE.value)
+    elapsed = time.perf_counter() - start
+    helper.fetcher.close()
+    return results, elapsed, backend.calls
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    baseline, serial, _ = run(args, 1)
+    print(f"{'mode':>10} {'seconds':>9} {'calls':>6} {'speedup':>8}")
+    runs = [(f'{workers} wkr', workers, False) for workers in args.workers] + [('batch', 1, True)]
+    for label, workers, batch in runs:
+        results, elapsed, calls = run(args, workers, batch)
+        if results != baseline:
+            raise SystemExit(f"Results for {label} differ from the serial path")
+        print(f"{label:>10} {elapsed:>9.3f} {calls:>6} {serial / elapsed:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
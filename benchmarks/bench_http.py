@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Runs the serial, parallel and batched fetch paths of
+FirebaseHelper.get_test_case_results_by_execution_summary through the real
+Google client stack (service account credentials, googleapiclient, httplib2)
+against a local ToolResults server that requires the tokens it issues, and
+checks each returns the same results as the in-process fake connection
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from firebase import ExecutionOutcome, FirebaseHelper  # noqa: E402
+from lib.fake_toolresults import FakeConnection, FakeToolResults, FakeToolResultsServer, SyntheticHistory  # noqa: E402
+from lib.firebase_conn import CREDENTIAL_VARIABLES, FirebaseConn  # noqa: E402
+from lib.scheduler import RequestScheduler  # noqa: E402
+
+PROJECT = 'moz-fenix'
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Check and time the fetch paths over HTTP with the real Google client'
+    )
+    parser.add_argument('--executions', type=int, default=20)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--cases', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.005, help='Simulated round trip (seconds)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8])
+    return parser.parse_args(args=cmdln_args)
+
+
+def service_account_info(token_uri: str) -> dict:
+    """A service account with a throwaway key, whose tokens are granted by `token_uri`"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return {
+        'type': 'service_account',
+        'project_id': PROJECT,
+        'private_key_id': 'bench',
+        'private_key': key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode(),
+        'client_email': 'bench@{}.iam.gserviceaccount.com'.format(PROJECT),
+        'client_id': '0',
+        'token_uri': token_uri,
+    }
+
+
+def discovery_document(root_url: str, path: str) -> str:
+    """The bundled toolresults discovery document, pointed at `root_url`"""
+    from googleapiclient import discovery_cache
+
+    document = json.loads(discovery_cache.get_static_doc('toolresults', 'v1beta3'))
+    document['rootUrl'] = root_url
+    with open(path, 'w') as document_file:
+        json.dump(document, document_file)
+    return path
+
+
+def run(connection, workers: int, batch: bool = False) -> tuple:
+    helper = FirebaseHelper(PROJECT, 'org.mozilla.fenix.debug', workers, batch, connection=connection,
+                            scheduler=RequestScheduler(None, max_in_flight=workers))
+    start = time.perf_counter()
+    results = helper.get_test_case_results_by_execution_summary(ExecutionOutcome.FAILURE.value)
+    elapsed = time.perf_counter() - start
+    helper.fetcher.close()
+    return results, elapsed
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    backend = FakeToolResults(
+        SyntheticHistory(args.executions, args.steps, args.cases, now=1_700_000_000),
+        latency=args.latency
+    )
+    baseline, _ = run(FakeConnection(backend), 1)
+    with FakeToolResultsServer(backend, require_token=True) as server, tempfile.TemporaryDirectory() as tmp:
+        os.environ[CREDENTIAL_VARIABLES[PROJECT]] = json.dumps(service_account_info(server.token_uri))
+        document = discovery_document(server.root_url, os.path.join(tmp, 'toolresults.json'))
+        print(f"{'mode':>10} {'seconds':>9} {'calls':>6} {'batches':>8} {'refreshes':>10}")
+        runs = [(f'{workers} wkr', workers, False) for workers in args.workers] + [('batch', 1, True)]
+        for label, workers, batch in runs:
+            connection = FirebaseConn(PROJECT, discovery_document=document, pool_size=workers)
+            calls, batches = backend.calls, server.batches
+            results, elapsed = run(connection, workers, batch)
+            if results != baseline:
+                raise SystemExit(f"Results for {label} differ from the in-process fake")
+            if server.unauthorized:
+                raise SystemExit(f"{server.unauthorized} requests for {label} were not authorized")
+            print(f"{label:>10} {elapsed:>9.3f} {backend.calls - calls:>6} {server.batches - batches:>8}"
+                  f" {connection.stats()['tokenRefreshes']:>10}")
+
+
+if __name__ == '__main__':
+    main()
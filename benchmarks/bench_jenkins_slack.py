@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Benchmarks building the jenkins_slack.py blocks from large performance
+result files, as a JSON array and as NDJSON, against the previous
+json.load and str.replace formatting, reporting time and peak memory
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jenkins_slack import build_payload_content, iter_records  # noqa: E402
+
+METRICS = ('duration', 'tabsOpened', 'memoryMb', 'cpuPercent', 'frameDrops', 'jankCount', 'startupMs', 'retries')
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Benchmark formatting large performance result files for Slack'
+    )
+    parser.add_argument('--results', type=int, nargs='+', default=[10_000, 50_000])
+    return parser.parse_args(args=cmdln_args)
+
+
+def result(index: int) -> dict:
+    """A test result with a mix of float, integer and zero measurements"""
+    record = {'testName': 'TabsPerformanceTest/testTabs{}()'.format(index)}
+    for position, metric in enumerate(METRICS):
+        record[metric] = 0 if (index + position) % 5 == 0 else (index * 7919 + position * 104729) % 100000 / 997
+    return record
+
+
+def write_inputs(directory: str, results: int) -> dict:
+    array_path, ndjson_path = os.path.join(directory, 'results.json'), os.path.join(directory, 'results.ndjson')
+    with open(array_path, 'w') as array_file, open(ndjson_path, 'w') as ndjson_file:
+        array_file.write('[\n')
+        for index in range(results):
+            line = json.dumps(result(index))
+            array_file.write(('    ' if index == 0 else ',\n    ') + line)
+            ndjson_file.write(line + '\n')
+        array_file.write('\n]\n')
+    return {'json array': array_path, 'ndjson': ndjson_path}
+
+
+def legacy_payload_content(path: str) -> list:
+    """The previous jenkins_slack.build_payload_content, after json.load of the whole file"""
+    with open(path) as data_file:
+        dataset = json.load(data_file)
+    for dictionary in dataset:
+        for key, value in dictionary.items():
+            if key != "testName":
+                dictionary[key] = round(float(dictionary[key]), 4)
+    new_data = [{k: v for k, v in d.items() if v != 0.0} for d in dataset]
+    slack_payload = []
+    for dic in new_data:
+        s = json.dumps(dic)
+        string = s.replace("testName", "").replace("\"", "").replace("()", "*").replace(":", "=")
+        string = string.replace("TabsPerformanceTest/", "*").replace(",", "\n")
+        slack_payload.append({"type": "section", "fields": [{"type": "mrkdwn", "text": string[2:-1]}]})
+    return slack_payload
+
+
+def measure(build) -> tuple:
+    """Time a run on its own, then trace the peak memory of another"""
+    start = time.perf_counter()
+    blocks = build()
+    elapsed = time.perf_counter() - start
+    count = len(blocks)
+    lines = sum(block['fields'][0]['text'].count('\n') for block in blocks)
+    del blocks
+    tracemalloc.start()
+    build()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, count, lines
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    print(f"{'results':>8} {'input':>11} {'method':>10} {'seconds':>8} {'peak MiB':>9} {'blocks':>7} {'values':>8}")
+    for results in args.results:
+        with tempfile.TemporaryDirectory() as directory:
+            inputs = write_inputs(directory, results)
+            for label, path in inputs.items():
+                for method, build in (
+                    ('legacy', lambda: legacy_payload_content(path)),
+                    ('streaming', lambda: build_payload_content(iter_records(path))),
+                ):
+                    if method == 'legacy' and label == 'ndjson':
+                        continue
+                    elapsed, peak, blocks, lines = measure(build)
+                    print(f'{results:>8} {label:>11} {method:>10} {elapsed:>8.3f} {peak / 2 ** 20:>9.1f} '
+                          f'{blocks:>7} {lines:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Benchmarks lib.perf_baseline with thousands of metrics and hundreds of
+stored commits: the time to store a commit's results and to compare it
+with the rolling baseline, and how many injected regressions are found
+'''
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.perf_baseline import Change, PerfBaseline  # noqa: E402
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Benchmark storing and comparing performance results against a baseline'
+    )
+    parser.add_argument('--tests', type=int, default=1000)
+    parser.add_argument('--metrics', type=int, default=8, help='Metrics per test')
+    parser.add_argument('--commits', type=int, default=300)
+    parser.add_argument('--window', type=int, nargs='+', default=[20, 100, 300])
+    parser.add_argument('--regressions', type=int, default=25, help='Metrics slowed down by 50%% in the last commit')
+    return parser.parse_args(args=cmdln_args)
+
+
+def results(tests: int, metrics: int, commit: int, slowed: set) -> list:
+    """Noisy results around a per-metric mean, with the `slowed` (test, metric) pairs 50% higher"""
+    rng = random.Random(commit)
+    return [
+        {
+            'testName': 'PerfTest/test{}()'.format(test),
+            **{
+                'metric{}'.format(metric): (100 + test % 50 + metric) * rng.gauss(1.0, 0.02)
+                * (1.5 if (test, metric) in slowed else 1.0)
+                for metric in range(metrics)
+            },
+        }
+        for test in range(tests)
+    ]
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    rng = random.Random(0)
+    slowed = set(rng.sample([(t, m) for t in range(args.tests) for m in range(args.metrics)], args.regressions))
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = PerfBaseline(os.path.join(directory, 'baseline.sqlite'))
+        start = time.perf_counter()
+        for commit in range(args.commits):
+            baseline.add('commit{}'.format(commit), results(args.tests, args.metrics, commit, set()))
+        stored = time.perf_counter() - start
+        last = results(args.tests, args.metrics, args.commits, slowed)
+        start = time.perf_counter()
+        baseline.add('latest', last)
+        add_seconds = time.perf_counter() - start
+        print(f'{args.tests * args.metrics} metrics, {args.commits} commits stored in {stored:.2f} s '
+              f'({add_seconds * 1000:.1f} ms per commit)')
+        print(f"{'window':>7} {'compare ms':>11} {'regressed':>10} {'improved':>9} {'found':>6}")
+        for window in args.window:
+            start = time.perf_counter()
+            changes = baseline.compare('latest', window=window)
+            elapsed = time.perf_counter() - start
+            regressed = {name for name, change in changes.items() if change['change'] == Change.REGRESSED}
+            found = sum(('PerfTest/test{}()'.format(t), 'metric{}'.format(m)) in regressed for t, m in slowed)
+            print(f'{window:>7} {elapsed * 1000:>11.1f} {len(regressed):>10} {len(changes) - len(regressed):>9} '
+                  f'{found:>3}/{len(slowed)}')
+        baseline.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Compares the memory held by the details of a large synthetic history as
+raw API response dicts and as lib.records records, with and without the
+raw responses kept alongside
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.fake_toolresults import SyntheticHistory  # noqa: E402
+from lib.records import ExecutionDetails  # noqa: E402
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the memory footprint of the parsed records'
+    )
+    parser.add_argument('--executions', type=int, default=200)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--cases', type=int, default=50)
+    return parser.parse_args(args=cmdln_args)
+
+
+"""Distinct executions encoded up front; larger histories cycle through them"""
+TEMPLATES = 20
+
+
+def encode(history: SyntheticHistory, execution: int) -> tuple:
+    """The JSON bodies of one execution's responses"""
+    return (
+        json.dumps(history.execution(execution)),
+        json.dumps({'steps': [history.step(execution, step) for step in range(history.steps)]}),
+        json.dumps({'environments': [history.environment(execution, step) for step in range(history.steps)]}),
+        {
+            'bs.{}'.format(step): json.dumps({'testCases': [
+                history.test_case(execution, step, case) for case in range(history.cases)
+            ]})
+            for step in range(history.steps)
+        },
+    )
+
+
+def decode(bodies: tuple) -> tuple:
+    """Freshly decoded responses, as the API client returns them"""
+    execution, steps, environments, cases = bodies
+    return (
+        json.loads(execution),
+        json.loads(steps),
+        json.loads(environments),
+        {step_id: json.loads(body) for step_id, body in cases.items()},
+    )
+
+
+def raw(bodies: tuple):
+    execution, steps, environments, cases = decode(bodies)
+    return {'execution': execution, 'steps': steps, 'environments': environments, 'testCases': cases}
+
+
+def records(bodies: tuple, keep_raw: bool = False):
+    execution, steps, environments, cases = decode(bodies)
+    details = ExecutionDetails.from_responses(execution, steps, environments, keep_raw)
+    for step_id, step_cases in cases.items():
+        details.add_test_cases(step_id, step_cases, keep_raw)
+    return details
+
+
+def measure(templates: list, executions: int, build) -> tuple:
+    """Memory still held once every execution is decoded and built, and the time taken"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    held = [build(templates[execution % len(templates)]) for execution in range(executions)]
+    elapsed = time.perf_counter() - start
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return current, elapsed
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    history = SyntheticHistory(args.executions, args.steps, args.cases, now=1_700_000_000)
+    templates = [encode(history, execution) for execution in range(min(args.executions, TEMPLATES))]
+    print(f'{args.executions} executions x {args.steps} steps x {args.cases} test cases')
+    print(f"{'form':>18} {'held MiB':>9} {'seconds':>8} {'ratio':>6}")
+    baseline = None
+    for label, build in (
+        ('raw dicts', raw),
+        ('records', records),
+        ('records + raw', lambda bodies: records(bodies, keep_raw=True)),
+    ):
+        held, elapsed = measure(templates, args.executions, build)
+        baseline = baseline or held
+        print(f'{label:>18} {held / 2 ** 20:>9.1f} {elapsed:>8.2f} {held / baseline:>6.2f}')
+
+
+if __name__ == '__main__':
+    main()
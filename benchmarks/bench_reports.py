@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Benchmarks the FirebaseHelper reports without live credentials, against
+synthetic histories of growing size (or a recording made with
+client.py --record), and reports wall time, API call count and peak
+memory for each, along with the time spent waiting on the API and the
+(uncompressed) response bytes received
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from firebase import ONE_DAY, ExecutionOutcome, FirebaseHelper  # noqa: E402
+from lib.fake_toolresults import FakeConnection, FakeToolResults, SyntheticHistory  # noqa: E402
+from lib.scheduler import RequestScheduler  # noqa: E402
+
+REPORTS = {
+    'test_case_results': lambda helper: helper.get_test_case_results_by_execution_summary(
+        ExecutionOutcome.FAILURE.value),
+    'recent_step_count': lambda helper: helper.get_recent_step_count_by_execution_summary(
+        ExecutionOutcome.SUCCESS.value),
+    'past_day_executions': lambda helper: helper.get_executions_from_past_day_by_execution_summary(
+        ExecutionOutcome.SUCCESS.value),
+}
+
+
+def parse_size(value: str) -> tuple:
+    executions, steps, cases = (int(part) for part in value.split('x'))
+    return executions, steps, cases
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the FirebaseHelper reports against synthetic or recorded histories'
+    )
+    parser.add_argument(
+        '--sizes', type=parse_size, nargs='+',
+        default=[(50, 10, 20), (100, 10, 20), (200, 20, 50), (400, 20, 100)],
+        help='History sizes as <executions>x<steps>x<cases>'
+    )
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated round trip (seconds)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch', action='store_true')
+    parser.add_argument('--rate', type=float, help='Requests per second allowed by the scheduler (default: unlimited)')
+    parser.add_argument('--bandwidth', type=float, help='Simulated transfer rate (bytes per second)')
+    parser.add_argument('--full-responses', action='store_true', help='Do not send fields= masks')
+    parser.add_argument('--histories', type=int, default=1,
+                        help='Histories per package of each size; more than one runs the reports across all of them')
+    parser.add_argument('--reports', nargs='+', choices=sorted(REPORTS), default=list(REPORTS))
+    parser.add_argument('--replay', help='Run once against a client.py --record recording instead')
+    parser.add_argument('--project', default='moz-fenix')
+    parser.add_argument('--filter-by-name', default='org.mozilla.fenix.debug')
+    parser.add_argument('--output', help='Also write the measurements to this JSON file')
+    return parser.parse_args(args=cmdln_args)
+
+
+def measure(args, connection, counter) -> dict:
+    """Run each report on a fresh helper; counter() returns the API calls made so far"""
+    measurements = {}
+    for name in args.reports:
+        helper = FirebaseHelper(args.project, args.filter_by_name, args.workers, args.batch, connection=connection,
+                                scheduler=RequestScheduler(args.rate, max_in_flight=args.workers),
+                                partial_responses=not args.full_responses, all_histories=args.histories > 1)
+        calls = counter()
+        tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            REPORTS[name](helper)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        helper.fetcher.close()
+        metrics = helper.get_metrics()
+        measurements[name] = {
+            'seconds': elapsed,
+            'calls': counter() - calls,
+            'peak_kib': peak / 1024,
+            'api_seconds': metrics['apiSeconds'],
+            'response_kib': metrics['responseBytes'] / 1024,
+        }
+    return measurements
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    rows = []
+    if args.replay:
+        from lib.firebase_conn import FirebaseConn
+        from lib.replay import ReplayHttp
+
+        http = ReplayHttp(args.replay, args.latency)
+        connection = FirebaseConn(args.project, http=http, pool_size=max(8, args.workers))
+        rows.append(('replay', measure(args, connection, lambda: http.calls)))
+    else:
+        for executions, steps, cases in args.sizes:
+            """Spread every history over the past day so all three reports cover all of it"""
+            histories = [
+                SyntheticHistory(executions, steps, cases, interval=max(1, ONE_DAY // (executions + 1)), seed=seed)
+                for seed in range(args.histories)
+            ]
+            backend = FakeToolResults(histories, latency=args.latency, bandwidth=args.bandwidth)
+            rows.append((
+                f'{executions}x{steps}x{cases}',
+                measure(args, FakeConnection(backend), lambda: backend.calls)
+            ))
+
+    print(f"{'size':>14} {'report':>20} {'seconds':>9} {'api s':>9} {'calls':>7} {'resp KiB':>10} {'peak KiB':>10}")
+    for size, measurements in rows:
+        for name, result in measurements.items():
+            print(f"{size:>14} {name:>20} {result['seconds']:>9.3f} {result['api_seconds']:>9.3f} "
+                  f"{result['calls']:>7} {result['response_kib']:>10.1f} {result['peak_kib']:>10.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(dict(rows), outfile, indent=4)
+
+
+if __name__ == '__main__':
+    main()
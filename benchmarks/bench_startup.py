@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Measures client.py import and startup time in fresh interpreters and
+fails when startup regresses: importing client.py must stay under
+--max-import-ms and must not pull in the Google client stack
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('googleapiclient', 'google.oauth2', 'httplib2')
+
+STARTUP = '''
+import json, sys, time
+start = time.perf_counter()
+import client
+imported = time.perf_counter()
+args = client.parse_args(['--project', 'moz-fenix', '--filter-by-name', 'org.mozilla.fenix', '--no-cache'])
+helper = client.FirebaseHelper(args.project, args.filter_by_name, args.workers, args.batch, None,
+                               client.FirebaseConn(args.project, args.discovery_document))
+ready = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'startup_ms': (ready - start) * 1000,
+    'heavy': [m for m in sys.modules if m.startswith(%r)],
+}))
+''' % (HEAVY_MODULES,)
+
+BUILD = '''
+import json, sys, time
+from google.auth.credentials import AnonymousCredentials
+from lib.firebase_conn import FirebaseConn
+connection = FirebaseConn('moz-fenix', sys.argv[1])
+connection._credentials = AnonymousCredentials()
+start = time.perf_counter()
+connection.build_client()
+print(json.dumps({'build_ms': (time.perf_counter() - start) * 1000}))
+'''
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Benchmark client.py import and startup time'
+    )
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-import-ms', type=float, default=250.0)
+    parser.add_argument('--discovery-document', default=os.path.join(ROOT, '.cache', 'toolresults.v1beta3.json'))
+    return parser.parse_args(args=cmdln_args)
+
+
+def measure(code: str, *argv) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', code, *argv], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    runs = [measure(STARTUP) for _ in range(args.runs)]
+    import_ms = statistics.median(run['import_ms'] for run in runs)
+    startup_ms = statistics.median(run['startup_ms'] for run in runs)
+    print(f"import client:             {import_ms:8.1f} ms (median of {args.runs})")
+    print(f"+ parse args, helper init: {startup_ms:8.1f} ms")
+
+    try:
+        builds = [measure(BUILD, args.discovery_document) for _ in range(args.runs)]
+        print(f"first client build:        {statistics.median(b['build_ms'] for b in builds):8.1f} ms")
+    except subprocess.CalledProcessError as e:
+        print(f"first client build:        skipped ({e.stderr.strip().splitlines()[-1]})")
+
+    failures = []
+    if import_ms > args.max_import_ms:
+        failures.append(f"import took {import_ms:.1f} ms (limit {args.max_import_ms} ms)")
+    heavy = sorted({module for run in runs for module in run['heavy']})
+    if heavy:
+        failures.append(f"startup imported {', '.join(heavy)}")
+    if failures:
+        raise SystemExit('Startup regression: ' + '; '.join(failures))
+
+
+if __name__ == '__main__':
+    main()
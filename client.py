@@ -5,9 +5,23 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import argparse
+import os
+import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
-from firebase import ExecutionOutcome, FirebaseHelper
+from firebase import ONE_DAY, ExecutionOutcome, FirebaseHelper, write_JSON
+from lib.crashes import CrashIndex
+from lib.execution_cache import ExecutionCache
+from lib.firebase_conn import FirebaseConn
+from lib.flaky import FlakyIndex
+from lib.metrics import ApiMetrics
+from lib.replay import ReplayHttp
+from lib.scheduler import RequestScheduler
+from lib.sync_state import SyncState
 
 PROJECTS = [
     'moz-fenix',
@@ -23,6 +37,38 @@ FILTER_NAME_PACKAGE = [
     'org.mozilla.focus.nightly'
 ]
 
+"""The packages each project tests (and has credentials for), as reported by --targets all"""
+PROJECT_PACKAGES = {
+    'moz-fenix': ['org.mozilla.fenix.debug', 'org.mozilla.fenix'],
+    'moz-focus-android': ['org.mozilla.focus.debug', 'org.mozilla.focus.nightly'],
+}
+
+
+def parse_time(value: str) -> int:
+    """Parse an ISO 8601 date/time (UTC unless an offset is given) or a relative age such as 24h or 7d
+    into epoch seconds"""
+    relative = re.fullmatch(r'(\d+)([hd])', value)
+    if relative:
+        unit = 60 * 60 if relative.group(2) == 'h' else 24 * 60 * 60
+        return int(time.time()) - int(relative.group(1)) * unit
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def parse_target(value: str):
+    """Parse a <project>:<package> pair, or 'all' for every package of PROJECT_PACKAGES"""
+    if value == 'all':
+        return [(project, package) for project, packages in PROJECT_PACKAGES.items() for package in packages]
+    project, _, package = value.partition(':')
+    if project not in PROJECTS or package not in FILTER_NAME_PACKAGE:
+        raise argparse.ArgumentTypeError(f"invalid target: {value} (expected <project>:<package> or all)")
+    return [(project, package)]
+
 
 def parse_args(cmdln_args):
     parser = argparse.ArgumentParser(
@@ -32,35 +78,392 @@ def parse_args(cmdln_args):
     parser.add_argument(
         "--project",
         help="Indicate project",
-        required=True,
         choices=PROJECTS
     )
 
     parser.add_argument(
         "--filter-by-name",
         help="Indicate filter by name",
-        required=True,
         choices=FILTER_NAME_PACKAGE
     )
 
-    return parser.parse_args(args=cmdln_args)
+    parser.add_argument(
+        "--targets",
+        help="Report on several <project>:<package> pairs (or all) in one run and write a combined payload",
+        nargs="+",
+        type=parse_target
+    )
+
+    parser.add_argument(
+        "--workers",
+        help="Number of concurrent API workers",
+        type=int,
+        default=4
+    )
+
+    parser.add_argument(
+        "--batch",
+        help="Group list calls into multipart HTTP batch requests",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--rate",
+        help="Average API requests per second allowed per project",
+        type=float,
+        default=10.0
+    )
+
+    parser.add_argument(
+        "--burst",
+        help="API requests per project allowed in a burst above --rate",
+        type=int,
+        default=20
+    )
+
+    parser.add_argument(
+        "--max-in-flight",
+        help="Maximum number of concurrent API requests across all targets",
+        type=int,
+        default=8
+    )
+
+    parser.add_argument(
+        "--max-retries",
+        help="Retries of a request failing with 429 or 5xx, with exponential backoff",
+        type=int,
+        default=5
+    )
+
+    parser.add_argument(
+        "--cache",
+        help="Path of the on-disk cache of completed executions",
+        default=".cache/executions.sqlite"
+    )
+
+    parser.add_argument(
+        "--cache-max-mb",
+        help="Evict least recently used cache entries past this size",
+        type=int,
+        default=256
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        help="Bypass the on-disk cache and always query the API",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--discovery-document",
+        help="Local copy of the toolresults discovery document, created on first use",
+        default=".cache/toolresults.v1beta3.json"
+    )
+
+    parser.add_argument(
+        "--record",
+        help="Append every API response to this NDJSON recording"
+    )
+
+    parser.add_argument(
+        "--replay",
+        help="Answer API calls from a recording made with --record instead of the live API"
+    )
+
+    parser.add_argument(
+        "--full-responses",
+        help="Request whole resources instead of only the fields the reports read",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--all-histories",
+        help="Cover every history matching the package, not only the most recently modified one, "
+             "and merge their results",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        help="Write per-endpoint API call metrics to this JSON file"
+    )
+
+    parser.add_argument(
+        "--timings",
+        help="Directory of columnar step timing archives to merge this run into, with daily statistics (needs numpy)"
+    )
+
+    parser.add_argument(
+        "--flaky-index",
+        help="Path of the incremental test outcome index; adds each package's flakiest tests to the payload"
+    )
+
+    parser.add_argument(
+        "--flaky-days",
+        help="Window (days) of the flake rates, and of the first flaky index update",
+        type=int,
+        default=14
+    )
+
+    parser.add_argument(
+        "--crash-index",
+        help="Path of the incremental crash signature index; adds each package's top crashes to the payload"
+    )
+
+    parser.add_argument(
+        "--crash-days",
+        help="Window (days) of the top crashes, and of the first crash index update",
+        type=int,
+        default=14
+    )
+
+    parser.add_argument(
+        "--top-crashes",
+        help="Number of crash signatures reported per package",
+        type=int,
+        default=10
+    )
+
+    parser.add_argument(
+        "--serve",
+        help="Run as a service on this local port: poll the targets every --poll-interval and serve "
+             "GET /report, /health and /metrics",
+        type=int,
+        metavar="PORT"
+    )
+
+    parser.add_argument(
+        "--host",
+        help="Address the --serve endpoint listens on",
+        default="127.0.0.1"
+    )
+
+    parser.add_argument(
+        "--poll-interval",
+        help="Seconds between the polls of --serve",
+        type=float,
+        default=300
+    )
+
+    parser.add_argument(
+        "--since",
+        help="Only include executions created at or after this time (ISO 8601 or e.g. 24h, 7d; default: 24h)",
+        type=parse_time
+    )
+
+    parser.add_argument(
+        "--until",
+        help="Only include executions created at or before this time (ISO 8601 or e.g. 1h)",
+        type=parse_time
+    )
+
+    parser.add_argument(
+        "--incremental",
+        help="Only report executions created since the previous run",
+        action="store_true"
+    )
+
+    parser.add_argument(
+        "--state-file",
+        help="Path of the incremental sync watermarks",
+        default=".cache/sync_state.json"
+    )
+
+    args = parser.parse_args(args=cmdln_args)
+    if args.record and args.replay:
+        parser.error("--record and --replay are mutually exclusive")
+    if args.targets:
+        args.targets = list(dict.fromkeys(target for targets in args.targets for target in targets))
+    elif not (args.project and args.filter_by_name):
+        parser.error("either --project and --filter-by-name, or --targets is required")
+    elif args.serve is not None:
+        args.targets = [(args.project, args.filter_by_name)]
+    return args
+
+
+def connect(args, project: str) -> FirebaseConn:
+    """No more requests than --max-in-flight ever run at once, so the transport pool is that large"""
+    return FirebaseConn(
+        project, args.discovery_document, args.record, ReplayHttp(args.replay) if args.replay else None,
+        pool_size=args.max_in_flight
+    )
+
+
+def archive_timings(args, helper: FirebaseHelper) -> None:
+    """With --incremental, each archive keeps its own watermarks next to it, so runs archive every execution
+    settled since the previous one (e.g. over a weekend) rather than the --since window"""
+    from lib.timings import archive_path, save
+
+    path = archive_path(args.timings, helper.firebase.projectId, helper.firebase.filterByName)
+    state = SyncState(os.path.splitext(path)[0] + '.sync.json') if args.incremental else None
+    timings = helper.get_timings(args.since, args.until, state)
+    save(path, timings)
+    if state is not None:
+        state.save()
+
+
+def write_timing_stats(args) -> None:
+    from lib.timings import write_stats
+
+    write_stats(args.timings)
+    print('Timing statistics written to [{}]'.format(args.timings), end='\n\n')
+
+
+def run_targets(args, cache: ExecutionCache, state: SyncState, metrics: ApiMetrics,
+                scheduler: RequestScheduler, flaky: FlakyIndex, crashes: CrashIndex) -> list:
+    """Run the step count report for every target concurrently. Targets of the same project share
+    one set of credentials; each gets its own client since the transports are not thread-safe.
+    A target that fails gets an entry with its error instead of a payload, and keeps its watermarks"""
+    connections = {project: connect(args, project) for project, _ in args.targets}
+
+    def run(target: tuple) -> dict:
+        project, filter_by_name = target
+        target_state = state.fork() if state is not None else None
+        try:
+            helper = FirebaseHelper(
+                project, filter_by_name, args.workers, args.batch, cache, connections[project].fork(), metrics,
+                scheduler, partial_responses=not args.full_responses, all_histories=args.all_histories
+            )
+            if target_state is not None:
+                count = helper.get_new_step_count_by_execution_summary(ExecutionOutcome.SUCCESS.value, target_state)
+            else:
+                count = helper.get_recent_step_count_by_execution_summary(
+                    ExecutionOutcome.SUCCESS.value, args.since, args.until
+                )
+            if args.timings:
+                archive_timings(args, helper)
+            payload = helper.build_payload(count)
+            if flaky is not None:
+                helper.update_flaky_index(flaky, since=int(time.time()) - args.flaky_days * ONE_DAY)
+                payload['flakyTests'] = helper.get_flaky_tests(flaky, args.flaky_days)
+            if crashes is not None:
+                helper.update_crash_index(crashes, since=int(time.time()) - args.crash_days * ONE_DAY)
+                payload['topCrashes'] = helper.get_top_crashes(crashes, args.crash_days, args.top_crashes)
+            if target_state is not None:
+                target_state.commit()
+            return payload
+        except Exception as e:
+            print(f"Failed {project} {filter_by_name}: {e!r}")
+            return {'project': project, 'application': filter_by_name, 'error': repr(e)}
+
+    with ThreadPoolExecutor(max_workers=len(args.targets)) as executor:
+        return list(executor.map(run, args.targets))
+
+
+def serve(args, cache: ExecutionCache, metrics: ApiMetrics, scheduler: RequestScheduler) -> None:
+    """Keep one warm helper per target, poll them all on a schedule and serve the latest report
+    until interrupted. Step counts cover a rolling --since window (default: the past day)"""
+    from lib.service import ReportService
+
+    connections = {project: connect(args, project) for project, _ in args.targets}
+    helpers = {
+        (project, filter_by_name): FirebaseHelper(
+            project, filter_by_name, args.workers, args.batch, cache, connections[project].fork(), metrics,
+            scheduler, partial_responses=not args.full_responses, all_histories=args.all_histories
+        )
+        for project, filter_by_name in args.targets
+    }
+    window = int(time.time()) - args.since if args.since else ONE_DAY
+    flaky = FlakyIndex(args.flaky_index) if args.flaky_index else None
+    crashes = CrashIndex(args.crash_index) if args.crash_index else None
+    service = ReportService(helpers, metrics, scheduler, args.poll_interval, window, flaky, args.flaky_days,
+                            crashes, args.crash_days, args.top_crashes)
+    httpd = service.serve(args.host, args.serve)
+    stop = threading.Event()
+    poller = threading.Thread(target=service.run, args=(stop,), daemon=True)
+    poller.start()
+    print('Serving /report, /health and /metrics on http://{}:{}'.format(*httpd.server_address[:2]), end='\n\n')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        httpd.server_close()
+        poller.join()
+        service.close()
+        if flaky is not None:
+            flaky.close()
+        if crashes is not None:
+            crashes.close()
 
 
 def main():
     args = parse_args(sys.argv[1:])
 
-    FirebaseHelperClient = FirebaseHelper(args.project, args.filter_by_name)
+    cache = None if args.no_cache else ExecutionCache(args.cache, args.cache_max_mb * 1024 * 1024)
+    metrics = ApiMetrics()
+    scheduler = RequestScheduler(args.rate, args.burst, args.max_in_flight, args.max_retries)
+
+    if args.serve is not None:
+        serve(args, cache, metrics, scheduler)
+        return
+
+    if args.targets:
+        state = SyncState(args.state_file) if args.incremental else None
+        flaky = FlakyIndex(args.flaky_index) if args.flaky_index else None
+        crashes = CrashIndex(args.crash_index) if args.crash_index else None
+        payloads = run_targets(args, cache, state, metrics, scheduler, flaky, crashes)
+        write_JSON(payloads)
+        if state is not None:
+            state.save()
+        if flaky is not None:
+            flaky.save()
+        if crashes is not None:
+            crashes.save()
+        if args.timings:
+            write_timing_stats(args)
+        if args.metrics_file:
+            metrics.write(args.metrics_file)
+        """The payloads of the targets that succeeded are written, but the run still fails"""
+        if any('error' in payload for payload in payloads):
+            sys.exit(1)
+        return
+
+    FirebaseHelperClient = FirebaseHelper(
+        args.project, args.filter_by_name, args.workers, args.batch, cache,
+        connect(args, args.project), metrics, scheduler, partial_responses=not args.full_responses,
+        all_histories=args.all_histories
+    )
     # FirebaseHelperClient.print_test_results_by_execution_summary(
     #     execution_outcome_summary=ExecutionOutcome.FAILURE.value
     # )
     # FirebaseHelperClient.print_test_results_by_execution_summary(
     #     execution_outcome_summary=ExecutionOutcome.INCONCLUSIVE.value
     # )
-    FirebaseHelperClient.post_recent_step_count_by_execution_summary(
-        execution_outcome_summary=ExecutionOutcome.SUCCESS.value
-    )
+    state = SyncState(args.state_file) if args.incremental else None
+    if state is not None:
+        count = FirebaseHelperClient.get_new_step_count_by_execution_summary(
+            execution_outcome_summary=ExecutionOutcome.SUCCESS.value,
+            state=state
+        )
+    else:
+        count = FirebaseHelperClient.get_recent_step_count_by_execution_summary(
+            execution_outcome_summary=ExecutionOutcome.SUCCESS.value,
+            since=args.since,
+            until=args.until
+        )
+    payload = FirebaseHelperClient.build_payload(count)
     # FirebaseHelperClient.get_executions_from_past_day_by_execution_summary(
     #     ExecutionOutcome.SUCCESS.value)
+    if args.timings:
+        archive_timings(args, FirebaseHelperClient)
+        write_timing_stats(args)
+    if args.flaky_index:
+        flaky = FlakyIndex(args.flaky_index)
+        FirebaseHelperClient.update_flaky_index(flaky, since=int(time.time()) - args.flaky_days * ONE_DAY)
+        flaky.save()
+        payload['flakyTests'] = FirebaseHelperClient.get_flaky_tests(flaky, args.flaky_days)
+    if args.crash_index:
+        crashes = CrashIndex(args.crash_index)
+        FirebaseHelperClient.update_crash_index(crashes, since=int(time.time()) - args.crash_days * ONE_DAY)
+        crashes.save()
+        payload['topCrashes'] = FirebaseHelperClient.get_top_crashes(crashes, args.crash_days, args.top_crashes)
+    write_JSON(payload)
+    if state is not None:
+        state.save()
+    if args.metrics_file:
+        metrics.write(args.metrics_file)
 
 
 if __name__ == '__main__':
@@ -9,10 +9,22 @@
 from __future__ import absolute_import
 
 import json
-import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from enum import Enum
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator
 
+from lib.crashes import CrashIndex
+from lib.execution_cache import ExecutionCache
 from lib.firebase_conn import FirebaseConn
+from lib.flaky import FlakyIndex
+from lib.metrics import ApiMetrics
+from lib.records import Execution, ExecutionDetails
+from lib.scheduler import RETRYABLE_STATUS, RequestScheduler, error_status, retry_after
+from lib.sync_state import SyncState
 
 
 class ExecutionOutcome(Enum):
@@ -32,124 +44,462 @@ class TestStatus(Enum):
 
 
 class Paging(Enum):
+    HISTORIES_PAGE_SIZE = 100
     EXECUTIONS_PAGE_SIZE = 100
     STEPS_PAGE_SIZE = 250
     CASES_PAGE_SIZE = 250
+    DETAILS_BATCH_SIZE = 4
+    BATCH_REQUEST_SIZE = 50
+
+
+class Fields(Enum):
+    """Partial response masks of the list calls, limited to the fields the reports read"""
+    HISTORIES = 'nextPageToken,histories(historyId,name)'
+    EXECUTIONS = 'nextPageToken,executions(executionId,state,creationTime,outcome/summary,testExecutionMatrixId)'
+    STEP_IDS = 'nextPageToken,steps/stepId'
+    STEPS = (
+        'nextPageToken,steps(stepId,creationTime,outcome(summary,failureDetail/crashed),dimensionValue,'
+        'testExecutionStep(testTiming/testProcessDuration,testIssues(type,errorMessage,stackTrace/exception)))'
+    )
+    ENVIRONMENTS = 'nextPageToken,environments(environmentId,dimensionValue,environmentResult/outcome/summary)'
+    TEST_CASES = 'nextPageToken,testCases(testCaseId,status,testCaseReference(name,className),elapsedTime)'
+
+
+"""The key of the items in each list resource's pages"""
+PAGE_ITEMS = {'steps': 'steps', 'environments': 'environments', 'test_cases': 'testCases'}
+
+ONE_DAY = 24 * 60 * 60
+
+"""Executions still not complete this long after their creation are abandoned (test matrices time out far sooner)"""
+PENDING_CUTOFF = 6 * 60 * 60
 
 
 class Firebase:
-    def __init__(self, project_id: str, filter_by_name: str) -> None:
+    def __init__(self, project_id: str, filter_by_name: str, connection: FirebaseConn = None,
+                 metrics: ApiMetrics = None, scheduler: RequestScheduler = None) -> None:
+        """Credentials are only loaded on the first request, which raises if they are missing"""
+        self.connection = connection or FirebaseConn(project_id)
+        self.metrics = metrics or ApiMetrics()
+        self.scheduler = scheduler or RequestScheduler()
+        self.metrics.add_connection(project_id, self.connection)
+        self._projects_client = None
+        self.projectId = project_id
+        self.filterByName = filter_by_name
+
+    @property
+    def projects_client(self):
+        """The API client is only built (and credentials loaded) on the first call"""
+        if self._projects_client is None:
+            self._projects_client = self.connection.get_projects_client()
+        return self._projects_client
+
+    def _attempt(self, endpoint: str, request) -> dict:
+        """Execute a request once, recording its latency, response size (as received by the transport) or
+        error under `endpoint`"""
+        start = time.perf_counter()
         try:
-            self.connection = FirebaseConn(project_id)
-            self.projects_client = self.connection.get_projects_client()
-            self.projectId = project_id
-            self.filterByName = filter_by_name
-        except KeyError:
-            print("Firebase connection failed")
-            sys.exit(1)
-
-    def get_histories(self) -> dict:
-        """Get a list of (default: 20) histories sorted by modification time in descending order"""
-        histories = self.projects_client.projects().histories().list(
-            projectId=self.projectId,
-            filterByName=self.filterByName
-        ).execute()
+            with self.connection.pool.transport() as http:
+                received = http.received
+                response = request.execute(http=http)
+                size = http.received - received
+        except Exception as e:
+            self.metrics.record(endpoint, time.perf_counter() - start, error=e)
+            raise
+        self.metrics.record(endpoint, time.perf_counter() - start, size)
+        return response
+
+    def _execute(self, endpoint: str, request) -> dict:
+        """Execute a request within the project's quota, retrying throttled and failed attempts"""
+        return self.scheduler.execute(self.projectId, lambda: self._attempt(endpoint, request))
+
+    def get_histories(self, page_token: str = None, fields: str = None) -> dict:
+        """Get a page of histories sorted by modification time in descending order"""
+        histories = self._execute(
+            'histories.list',
+            self.projects_client.projects().histories().list(
+                projectId=self.projectId,
+                filterByName=self.filterByName,
+                pageSize=int(Paging.HISTORIES_PAGE_SIZE.value),
+                pageToken=page_token,
+                fields=fields
+            )
+        )
         return histories
 
-    def get_executions(self, history_id: str, page_token: str = None) -> dict:
+    def iter_histories(self, fields: str = None) -> Iterator[dict]:
+        """Lazily yield every matching history, most recently modified first, following nextPageToken"""
+        page_token = None
+        while True:
+            histories = self.get_histories(page_token, fields)
+            yield from histories.get('histories', [])
+            page_token = histories.get('nextPageToken')
+            if not page_token:
+                return
+
+    def get_executions(self, history_id: str, page_token: str = None, fields: str = None) -> dict:
         """Get a list of (default: 25) executions for a given project """
-        executions = self.projects_client.projects().histories().executions().list(
-            projectId=self.projectId,
-            historyId=history_id,
-            pageSize=int(Paging.EXECUTIONS_PAGE_SIZE.value),
-            pageToken=page_token
-        ).execute()
+        executions = self._execute(
+            'executions.list',
+            self.projects_client.projects().histories().executions().list(
+                projectId=self.projectId,
+                historyId=history_id,
+                pageSize=int(Paging.EXECUTIONS_PAGE_SIZE.value),
+                pageToken=page_token,
+                fields=fields
+            )
+        )
         return executions
 
+    def iter_executions(self, history_id: str, fields: str = None) -> Iterator[dict]:
+        """Lazily yield every execution for a given history, one page at a time, following nextPageToken"""
+        page_token = None
+        while True:
+            executions = self.get_executions(history_id, page_token, fields)
+            yield from executions.get('executions', [])
+            page_token = executions.get('nextPageToken')
+            if not page_token:
+                return
+
     def get_execution(self, history_id: str, execution_id: int) -> dict:
         """Get a single execution"""
-        execution = self.projects_client.projects().histories().executions().get(
-            projectId=self.projectId,
-            historyId=history_id,
-            executionId=execution_id
-        ).execute()
+        execution = self._execute(
+            'executions.get',
+            self.projects_client.projects().histories().executions().get(
+                projectId=self.projectId,
+                historyId=history_id,
+                executionId=execution_id
+            )
+        )
         return execution
 
-    def get_steps(self, history_id: str, execution_id: int, page_size: int, page_token: str = None) -> dict:
-        """Get a list of all steps (default: 25, max: 200 without page token) for a given execution
-        sorted by creation time in descending order"""
-        steps = self.projects_client.projects().histories().executions().steps().list(
+    def steps_request(self, history_id: str, execution_id: int, page_size: int, page_token: str = None,
+                      fields: str = None):
+        """Build (without executing) a steps list request"""
+        return self.projects_client.projects().histories().executions().steps().list(
             projectId=self.projectId,
             historyId=history_id,
             executionId=execution_id,
             pageSize=page_size,
-            pageToken=page_token
-        ).execute()
+            pageToken=page_token,
+            fields=fields
+        )
+
+    def get_steps(self, history_id: str, execution_id: int, page_size: int, page_token: str = None,
+                  fields: str = None) -> dict:
+        """Get a list of all steps (default: 25, max: 200 without page token) for a given execution
+        sorted by creation time in descending order"""
+        steps = self._execute('steps.list', self.steps_request(history_id, execution_id, page_size, page_token, fields))
         return steps
 
     def get_step(self, history_id: str, execution_id: int, step_id: str) -> dict:
         """Get a single step"""
-        step = self.projects_client.projects().histories().executions().steps().get(
-            projectId=self.projectId,
-            historyId=history_id,
-            executionId=execution_id,
-            stepId=step_id
-        ).execute()
+        step = self._execute(
+            'steps.get',
+            self.projects_client.projects().histories().executions().steps().get(
+                projectId=self.projectId,
+                historyId=history_id,
+                executionId=execution_id,
+                stepId=step_id
+            )
+        )
         return step
 
-    def get_test_cases(self, history_id: str, execution_id: int, step_id: str, page_size: int) -> dict:
-        """Get a list of test cases attached to a Step"""
-        test_cases = self.projects_client.projects().histories().executions().steps().testCases().list(
+    def iter_steps(self, history_id: str, execution_id: int, page_size: int = Paging.STEPS_PAGE_SIZE.value,
+                   fields: str = None) -> Iterator[dict]:
+        """Lazily yield every step of an execution, one page at a time, following nextPageToken"""
+        page_token = None
+        while True:
+            steps = self.get_steps(history_id, execution_id, page_size, page_token, fields)
+            yield from steps.get('steps', [])
+            page_token = steps.get('nextPageToken')
+            if not page_token:
+                return
+
+    def test_cases_request(self, history_id: str, execution_id: int, step_id: str, page_size: int,
+                           page_token: str = None, fields: str = None):
+        """Build (without executing) a test cases list request"""
+        return self.projects_client.projects().histories().executions().steps().testCases().list(
             projectId=self.projectId,
             historyId=history_id,
             executionId=execution_id,
             stepId=step_id,
-            pageSize=page_size
-        ).execute()
+            pageSize=page_size,
+            pageToken=page_token,
+            fields=fields
+        )
+
+    def get_test_cases(self, history_id: str, execution_id: int, step_id: str, page_size: int,
+                       page_token: str = None, fields: str = None) -> dict:
+        """Get a page of test cases attached to a Step"""
+        test_cases = self._execute(
+            'testCases.list', self.test_cases_request(history_id, execution_id, step_id, page_size, page_token, fields))
         return test_cases
 
+    def iter_test_cases(self, history_id: str, execution_id: int, step_id: str,
+                        page_size: int = Paging.CASES_PAGE_SIZE.value, fields: str = None) -> Iterator[dict]:
+        """Lazily yield every test case of a step, one page at a time, following nextPageToken"""
+        page_token = None
+        while True:
+            test_cases = self.get_test_cases(history_id, execution_id, step_id, page_size, page_token, fields)
+            yield from test_cases.get('testCases', [])
+            page_token = test_cases.get('nextPageToken')
+            if not page_token:
+                return
+
     def get_test_case(self, history_id: str, execution_id: int, step_id: str, test_case_id: str) -> dict:
         """Get a single test case"""
-        test_case = self.projects_client.projects().histories().executions().steps().testCases().get(
-            projectId=self.projectId,
-            historyId=history_id,
-            executionId=execution_id,
-            stepId=step_id,
-            testCaseId=test_case_id
-        ).execute()
+        test_case = self._execute(
+            'testCases.get',
+            self.projects_client.projects().histories().executions().steps().testCases().get(
+                projectId=self.projectId,
+                historyId=history_id,
+                executionId=execution_id,
+                stepId=step_id,
+                testCaseId=test_case_id
+            )
+        )
         return test_case
 
-    def get_environments(self, history_id: str, execution_id: int) -> dict:
-        """Get the environments for a given execution"""
-        environments = self.projects_client.projects().histories().executions().environments().list(
+    def environments_request(self, history_id: str, execution_id: int, page_token: str = None, fields: str = None):
+        """Build (without executing) an environments list request"""
+        return self.projects_client.projects().histories().executions().environments().list(
             projectId=self.projectId,
             historyId=history_id,
             executionId=execution_id,
-        ).execute()
+            pageToken=page_token,
+            fields=fields
+        )
+
+    def get_environments(self, history_id: str, execution_id: int, page_token: str = None,
+                         fields: str = None) -> dict:
+        """Get a page of the environments for a given execution"""
+        environments = self._execute(
+            'environments.list', self.environments_request(history_id, execution_id, page_token, fields))
         return environments
 
+    def iter_environments(self, history_id: str, execution_id: int, fields: str = None) -> Iterator[dict]:
+        """Lazily yield every environment of an execution, following nextPageToken"""
+        page_token = None
+        while True:
+            environments = self.get_environments(history_id, execution_id, page_token, fields)
+            yield from environments.get('environments', [])
+            page_token = environments.get('nextPageToken')
+            if not page_token:
+                return
+
     def get_environment(self, history_id: str, execution_id: int, environment_id: int) -> dict:
-        environment = self.projects_client.projects().histories().executions().environments().get(
-            projectId=self.projectId,
-            historyId=history_id,
-            executionId=execution_id,
-            environmentId=environment_id
-        ).execute()
+        environment = self._execute(
+            'environments.get',
+            self.projects_client.projects().histories().executions().environments().get(
+                projectId=self.projectId,
+                historyId=history_id,
+                executionId=execution_id,
+                environmentId=environment_id
+            )
+        )
         return environment
 
+    def batch_execute(self, requests: list) -> list:
+        """
+        Execute many list requests as multipart HTTP batches and return their responses in order.
+        Every sub-request counts against the project's quota; those failing with a retryable
+        status are retried on their own in a later batch, after the scheduler's backoff.
+        """
+        responses = [None] * len(requests)
+        pending = list(range(len(requests)))
+        for attempt in range(self.scheduler.max_retries + 1):
+            errors = {}
+
+            def callback(request_id: str, response: dict, exception: Exception) -> None:
+                if exception is None:
+                    responses[int(request_id)] = response
+                else:
+                    errors[int(request_id)] = exception
+
+            for start in range(0, len(pending), Paging.BATCH_REQUEST_SIZE.value):
+                chunk = pending[start:start + Paging.BATCH_REQUEST_SIZE.value]
+                batch = self.projects_client.new_batch_http_request(callback=callback)
+                for index in chunk:
+                    batch.add(requests[index], request_id=str(index))
+                self.scheduler.execute(
+                    self.projectId, lambda: self._attempt_batch(batch, chunk, errors), cost=len(chunk))
+
+            for index, exception in errors.items():
+                if error_status(exception) not in RETRYABLE_STATUS or attempt == self.scheduler.max_retries:
+                    raise exception
+            pending = sorted(errors)
+            if not pending:
+                break
+            """Wait as long as the longest Retry-After among the failed sub-requests asks"""
+            self.scheduler.wait(attempt, max(errors.values(), key=lambda exception: retry_after(exception) or 0))
+        return responses
+
+    def _attempt_batch(self, batch, chunk: list, errors: dict) -> None:
+        """Execute one batch, recording it under 'batch' with its multipart response size and its first
+        failed sub-request, if any"""
+        started = time.perf_counter()
+        try:
+            with self.connection.pool.transport() as http:
+                received = http.received
+                batch.execute(http=http)
+                size = http.received - received
+        except Exception as e:
+            self.metrics.record('batch', time.perf_counter() - started, error=e)
+            raise
+        self.metrics.record(
+            'batch',
+            time.perf_counter() - started,
+            size,
+            next((errors[index] for index in chunk if index in errors), None)
+        )
 
-class FirebaseHelper:
-    def __init__(self, project_id: str, filter_by_name: str) -> None:
-        self.firebase = Firebase(project_id, filter_by_name)
 
-    def get_histories(self) -> dict:
-        """Get a list of all test histories"""
-        return self.firebase.get_histories()
+def test_case_results_from_details(details: ExecutionDetails, past_day: int) -> list:
+    """
+    Build the test case result records of one execution from its fetched details, as a flat join:
+    one record per failed test case of a failing step, joined with the environment sharing the
+    step's dimensions, plus one record per inconclusive environment.
+    """
+    execution = details.execution
+    common = {
+        'matrix': execution.matrixId,
+        'creationTime': datetime.fromtimestamp(execution.creationTime, tz=timezone.utc).strftime('%Y-%m-%d'),
+        'withinPastDay': execution.creationTime >= past_day,
+    }
+    environments_by_dimensions = {environment.dimensions: environment for environment in details.environments}
+    steps = {step.stepId: step for step in details.steps}
+
+    results = []
+    for step_id in steps_needing_test_cases(details):
+        step = steps[step_id]
+        environment = environments_by_dimensions.get(step.dimensions)
+        for case in details.testCases.get(step_id, []):
+            if case.status == TestStatus.FAILED.value:
+                results.append(dict(
+                    common,
+                    testCase=case.reference,
+                    testCaseResult=case.status,
+                    step=step_id,
+                    environment=environment.environmentId if environment else None,
+                    environmentSummary=environment.outcome if environment else None,
+                    dimensions=dict(step.dimensions),
+                    duration=step.duration,
+                ))
+
+    """Search for inconclusive environments"""
+    for environment in details.environments:
+        if environment.outcome == ExecutionOutcome.INCONCLUSIVE.value:
+            results.append(dict(
+                common,
+                matrixResult=execution.outcome,
+                environment=environment.environmentId,
+                dimensions=dict(environment.dimensions),
+            ))
+    return results
+
+
+def steps_needing_test_cases(details: ExecutionDetails) -> list:
+    """Test cases are only needed for failing steps of executions with a failing or flaky environment"""
+    failing = {ExecutionOutcome.FLAKY.value, ExecutionOutcome.FAILURE.value}
+    if not any(env.outcome in failing for env in details.environments):
+        return []
+    return [step.stepId for step in details.steps if step.outcome == ExecutionOutcome.FAILURE.value]
+
+
+class ParallelFetcher:
+    """Run Firebase calls on a pool of worker threads. They share one API client: every request
+    checks a transport out of the connection's pool, since httplib2 transports are not thread-safe"""
+
+    def __init__(self, firebase: Firebase, workers: int = 1) -> None:
+        self.firebase = firebase
+        self.workers = max(1, workers)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def map(self, fn: Callable, items: Iterable) -> list:
+        """Apply fn(firebase, item) to every item, returning results in input order. Several threads
+        (e.g. one per history) may map at once, and share the one executor"""
+        if self.workers == 1:
+            return [fn(self.firebase, item) for item in items]
+        with self._lock:
+            if self._executor is None:
+                """Build the client once, before the workers need it"""
+                self.firebase.projects_client
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            executor = self._executor
+        return list(executor.map(lambda item: fn(self.firebase, item), items))
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+class FirebaseHelper:
+    def __init__(self, project_id: str, filter_by_name: str, workers: int = 1, batch: bool = False,
+                 cache: ExecutionCache = None, connection: FirebaseConn = None, metrics: ApiMetrics = None,
+                 scheduler: RequestScheduler = None, keep_raw: bool = False, partial_responses: bool = True,
+                 all_histories: bool = False) -> None:
+        """keep_raw: also keep the full API responses on the parsed records (as `raw`); otherwise, unless
+        partial_responses is turned off, list calls only ask for the fields the reports read.
+        all_histories: run the reports across every history matching the package, not only the most
+        recently modified one, and merge their results"""
+        self.firebase = Firebase(project_id, filter_by_name, connection, metrics, scheduler)
+        self.fetcher = ParallelFetcher(self.firebase, workers)
+        self.batch = batch
+        self.cache = cache
+        self.keep_raw = keep_raw
+        self.partial_responses = partial_responses and not keep_raw
+        self.all_histories = all_histories
+
+    def fields(self, mask: Fields) -> str:
+        """The fields= mask to send, or None for full responses"""
+        return mask.value if self.partial_responses else None
+
+    def get_histories(self, page_token: str = None) -> dict:
+        """Get a page of test histories"""
+        return self.firebase.get_histories(page_token)
+
+    def iter_histories(self, fields: str = None) -> Iterator[dict]:
+        """Lazily iterate over every test history across all pages"""
+        return self.firebase.iter_histories(fields)
+
+    def history_ids(self) -> list:
+        """The histories the reports cover: the most recently modified one, or all of them in all_histories mode"""
+        histories = self.iter_histories(self.fields(Fields.HISTORIES))
+        history_ids = [history['historyId'] for history in islice(histories, None if self.all_histories else 1)]
+        if not history_ids:
+            raise ValueError('No history of {} matches {}'.format(self.firebase.projectId, self.firebase.filterByName))
+        return history_ids
+
+    def map_histories(self, fn: Callable, history_ids: list = None) -> list:
+        """
+        Apply fn(history_id) to every covered history (or the given ones), returning results in
+        history order. Several histories run concurrently on threads of their own, since fn
+        itself fans out on the fetcher's workers.
+        """
+        if history_ids is None:
+            history_ids = self.history_ids()
+        if len(history_ids) <= 1:
+            return [fn(history_id) for history_id in history_ids]
+        with ThreadPoolExecutor(max_workers=min(len(history_ids), self.fetcher.workers)) as executor:
+            return list(executor.map(fn, history_ids))
+
+    def state_key(self, history_id: str) -> str:
+        """The package's key in the sync watermarks; each history has its own in all_histories mode"""
+        if self.all_histories:
+            return '{}@{}'.format(self.firebase.filterByName, history_id)
+        return self.firebase.filterByName
 
     def get_executions(self, history_id: str, page_token: str) -> dict:
         """Get a list of all test executions"""
         return self.firebase.get_executions(history_id, page_token)
 
+    def iter_executions(self, history_id: str, fields: str = None) -> Iterator[dict]:
+        """Lazily iterate over every test execution across all pages"""
+        return self.firebase.iter_executions(history_id, fields)
+
     def get_execution(self, history_id: str, execution_id: int) -> dict:
         """Get a single execution"""
         return self.firebase.get_execution(history_id, execution_id)
@@ -158,200 +508,409 @@ class FirebaseHelper:
         """Get a list of all test steps"""
         return self.firebase.get_steps(history_id, execution_id, page_size, page_token)
 
+    def iter_steps(self, history_id: str, execution_id: int, fields: str = None) -> Iterator[dict]:
+        """Lazily iterate over every step of an execution across all pages"""
+        return self.firebase.iter_steps(history_id, execution_id, fields=fields)
+
     def get_step(self, history_id: str, execution_id: int, step_id: str) -> dict:
         """Get a single step"""
         return self.firebase.get_step(history_id, execution_id, step_id)
 
-    def get_test_cases(self, history_id: str, execution_id: int, step_id: str, page_size: int) -> dict:
+    def get_test_cases(self, history_id: str, execution_id: int, step_id: str, page_size: int,
+                       page_token: str = None) -> dict:
         """Get a list of test cases attached to a Step"""
-        return self.firebase.get_test_cases(history_id, execution_id, step_id, page_size)
+        return self.firebase.get_test_cases(history_id, execution_id, step_id, page_size, page_token)
+
+    def iter_test_cases(self, history_id: str, execution_id: int, step_id: str, fields: str = None) -> Iterator[dict]:
+        """Lazily iterate over every test case of a step across all pages"""
+        return self.firebase.iter_test_cases(history_id, execution_id, step_id, fields=fields)
 
     def get_test_case(self, history_id: str, execution_id: int, step_id: str, test_case_id: str) -> dict:
         """Get a single test case"""
         return self.firebase.get_test_case(history_id, execution_id, step_id, test_case_id)
 
-    def get_environments(self, history_id: str, execution_id: int) -> dict:
+    def get_environments(self, history_id: str, execution_id: int, page_token: str = None) -> dict:
         """Get the environments for a given execution"""
-        return self.firebase.get_environments(history_id, execution_id)
+        return self.firebase.get_environments(history_id, execution_id, page_token)
 
     def get_environment(self, history_id: str, execution_id: int, environment_id: int) -> dict:
         """Get a single environment"""
         return self.firebase.get_environment(history_id, execution_id, environment_id)
 
+    def get_metrics(self) -> dict:
+        """Call counts, latency histograms, response sizes and errors per API endpoint so far"""
+        return self.firebase.metrics.snapshot()
+
     def check_for_execution_state(self, execution: dict, state: str) -> bool:
         """Check if an execution is in a complete immutable state"""
         if (('state', state) in execution.items()):
             return True
         else:
             return False
-    
-    def get_test_case_results_by_execution_summary(self, execution_outcome_summary: str) -> dict:
-        from datetime import datetime, timedelta
-
-        """Get test case results from executions with a provided outcome summary"""
-        history = next(iter([x for y in self.get_histories().values() for x in y]))
-        executions = self.get_executions(
-            history_id=history['historyId'],
-            page_token=None
-        )
-        results = []
 
-        for execution in executions['executions']:
-            """Filter on complete immutable executions"""
+    def iter_executions_in_window(self, history_id: str, since: int = None, until: int = None,
+                                  fields: Fields = Fields.EXECUTIONS) -> Iterator[dict]:
+        """Yield executions created within [since, until] (epoch seconds, either bound optional).
+        Executions are listed newest first, so paging stops at the first one older than `since`"""
+        for execution in self.iter_executions(history_id, self.fields(fields) if fields else None):
+            created = int(execution['creationTime']['seconds'])
+            if until is not None and created > until:
+                continue
+            if since is not None and created < since:
+                return
+            yield execution
+
+    def iter_new_executions(self, history_id: str, watermark: dict, since: int = None) -> Iterator[dict]:
+        """Yield executions newer than the watermark, newest first, and stop paging once it is reached.
+        Without a watermark (first sync) stop at executions created before `since` instead"""
+        for execution in self.iter_executions(history_id, self.fields(Fields.EXECUTIONS)):
+            created = int(execution['creationTime']['seconds'])
+            if watermark is not None:
+                newest = (watermark['creationTime'], int(watermark['executionId']))
+                if (created, int(execution['executionId'])) <= newest:
+                    return
+            elif since is not None and created < since:
+                return
+            yield execution
+
+    def sync_executions(self, history_id: str, state: SyncState, since: int = None) -> tuple:
+        """
+        Get the executions created since the last sync, oldest first, with the watermark to advance to once
+        they are processed (None when there is nothing new): pass it to commit_watermark() only after they
+        were, so a failure leaves them to the next sync. Only settled executions are returned: the watermark
+        stops before the oldest execution that is not complete yet, so it (and anything newer) is picked up
+        again by the next sync. An execution still not complete PENDING_CUTOFF after its creation is
+        abandoned, so it cannot hold back newer ones forever.
+        """
+        watermark = state.get(self.firebase.projectId, self.state_key(history_id))
+        cutoff = int(time.time()) - PENDING_CUTOFF
+        settled = []
+        last = None
+        for execution in reversed(list(self.iter_new_executions(history_id, watermark, since))):
             if self.check_for_execution_state(execution, 'complete'):
-                """Executions with flaky tests (of multiple attempts) are treated as successful"""
-                if execution['outcome']['summary'] == execution_outcome_summary:
-                    steps = self.get_steps(
-                        history_id=history['historyId'],
-                        execution_id=int(execution['executionId']),
-                        page_size=int(Paging.STEPS_PAGE_SIZE.value),
-                        page_token=None
-                    )
-                    environments = self.get_environments(
-                        history_id=history['historyId'],
-                        execution_id=int(execution['executionId'])
-                    )
-                    for k, v in environments.items():
-                        if k == 'environments':
-                            for env in v:
-                                if env['environmentResult']['outcome']['summary'] in {ExecutionOutcome.FLAKY.value, ExecutionOutcome.FAILURE.value}:
-                                    for k, v in steps.items():
-                                        if k == 'steps':
-                                            for step in v:
-                                                if step['outcome']['summary'] == ExecutionOutcome.FAILURE.value:
-                                                    cases = self.get_test_cases(
-                                                        history_id=history['historyId'],
-                                                        execution_id=int(execution['executionId']),
-                                                        step_id=step['stepId'],
-                                                        page_size=int(Paging.CASES_PAGE_SIZE.value)
-                                                    )
-                                                    for k, v in cases.items():
-                                                        if k == 'testCases':
-                                                            for case in v:
-                                                                if 'status' in case:
-                                                                    if case['status'] == TestStatus.FAILED.value:
-                                                                        results.append({
-                                                                                'testCase': [case['testCaseReference'] for case in cases['testCases']],
-                                                                                'testCaseResult': [case['status'] for case in cases['testCases']],
-                                                                                'matrix': execution['testExecutionMatrixId'],
-                                                                                'environmentSummary': [environment['environmentResult']['outcome']['summary'] for environment in environments['environments']],
-                                                                                'duration': [step['testExecutionStep']['testTiming']['testProcessDuration']['seconds']],
-                                                                                'creationTime': str(
-                                                                                    datetime.fromtimestamp(
-                                                                                        int(execution['creationTime']['seconds'])
-                                                                                    ).strftime('%Y-%m-%d')
-                                                                                ),
-                                                                                'withinPastDay': ((datetime.utcnow() - datetime.fromtimestamp(int(execution['creationTime']['seconds']))) > timedelta(days=1)),
-                                                                                #'testIssues': [[testIssues['type'] for testIssues in step['testExecutionStep']['testIssues']] if 'testIssues' in step['testExecutionStep'] else None]
-                                                                            }
-                                                                        )
-                                                    # WIP Crashes
-                                                    if 'failureDetail' in step['outcome']:
-                                                        if (('crashed', True)) in step['outcome']['failureDetail'].items():
-                                                            print(f"{execution['testExecutionMatrixId']} - {[testIssues['type'] for testIssues in step['testExecutionStep']['testIssues'] if 'type' in testIssues]}")
-                                """Search for inconclusive executions and return a list"""
-                                if env['environmentResult']['outcome']['summary'] in {ExecutionOutcome.INCONCLUSIVE.value}:
-                                    results.append({
-                                        'matrix': execution['testExecutionMatrixId'],
-                                        'matrixResult': execution['outcome']['summary'],
-                                        'creationTime': str(
-                                            datetime.fromtimestamp(
-                                                int(execution['creationTime']['seconds'])
-                                            ).strftime('%Y-%m-%d')
-                                        ),
-                                        'withinPastDay': ((datetime.utcnow() - datetime.fromtimestamp(int(execution['creationTime']['seconds']))) > timedelta(days=1)),
-                                    })
+                settled.append(execution)
+            elif int(execution['creationTime']['seconds']) >= cutoff:
+                break
+            last = execution
+        return settled, last
+
+    def commit_watermark(self, history_id: str, state: SyncState, watermark: dict) -> None:
+        """Advance the watermark returned by sync_executions(), once its executions were processed"""
+        if watermark is not None:
+            state.set(self.firebase.projectId, self.state_key(history_id), watermark)
+
+    def cached(self, history_id: str, execution: dict, resource: str, fetch: Callable) -> dict:
+        """Serve a resource of a completed execution from the cache, calling fetch() on a miss
+        or when the execution may still change"""
+        if self.cache is None or not self.check_for_execution_state(execution, 'complete'):
+            return fetch()
+        key = (self.firebase.projectId, history_id, execution['executionId'], resource)
+        value = self.cache.get(*key)
+        if value is None:
+            value = fetch()
+            self.cache.put(*key, value)
+        return value
+
+    def fetch(self, jobs: list) -> list:
+        """Run (resource, args[, kwargs]) list calls, e.g. ('steps', (history_id, execution_id, page_size)),
+        in order either as multipart HTTP batches or concurrently over the fetcher's workers"""
+        if self.batch:
+            return self.firebase.batch_execute([
+                getattr(self.firebase, f'{job[0]}_request')(*job[1], **(job[2] if len(job) > 2 else {}))
+                for job in jobs
+            ])
+        return self.fetcher.map(
+            lambda firebase, job: getattr(firebase, f'get_{job[0]}')(*job[1], **(job[2] if len(job) > 2 else {})),
+            jobs
+        )
 
+    def fetch_all_pages(self, jobs: list) -> list:
+        """Like fetch(), but follow every nextPageToken and return each job's items merged into a single page.
+        Further pages are fetched in rounds, so pages of different jobs are still batched together"""
+        pages = self.fetch(jobs)
+        results = [{PAGE_ITEMS[job[0]]: page.get(PAGE_ITEMS[job[0]], [])} for job, page in zip(jobs, pages)]
+        pending = [(index, page['nextPageToken']) for index, page in enumerate(pages) if page.get('nextPageToken')]
+        while pending:
+            pages = self.fetch([
+                (jobs[index][0], jobs[index][1], dict(jobs[index][2] if len(jobs[index]) > 2 else {}, page_token=token))
+                for index, token in pending
+            ])
+            for (index, _), page in zip(pending, pages):
+                key = PAGE_ITEMS[jobs[index][0]]
+                results[index][key].extend(page.get(key, []))
+            pending = [
+                (index, page['nextPageToken']) for (index, _), page in zip(pending, pages) if page.get('nextPageToken')
+            ]
         return results
 
-    def get_recent_step_count_by_execution_summary(self, execution_outcome_summary: str) -> dict:
-        from datetime import datetime, timedelta
-        
-        """Get test case results from executions with a provided outcome summary"""
-        history = next(iter([x for y in self.get_histories().values() for x in y]))
-        executions = self.get_executions(
-            history_id=history['historyId'],
-            page_token=None
-        )
-        results = []
+    def fetch_execution_details(self, history_id: str, executions: list) -> list:
+        """Get the steps, environments and failing test cases of executions as records, in input order.
+        Completed executions are served from the cache when one is configured, unless the raw responses
+        are kept: the cache only stores the records"""
+        if self.cache is None or self.keep_raw:
+            return self._fetch_execution_details(history_id, executions)
 
-        for execution in executions['executions']:
-            """Filter on complete immutable executions"""
+        project = self.firebase.projectId
+        details = [None] * len(executions)
+        for index, execution in enumerate(executions):
             if self.check_for_execution_state(execution, 'complete'):
-                """Executions with flaky tests (of multiple attempts) are treated as successful"""
+                cached = self.cache.get(project, history_id, execution['executionId'], 'records')
+                if cached is not None:
+                    details[index] = ExecutionDetails.from_dict(Execution.from_response(execution), cached)
+
+        missing = [index for index, detail in enumerate(details) if detail is None]
+        fetched = self._fetch_execution_details(history_id, [executions[index] for index in missing])
+        for index, detail in zip(missing, fetched):
+            details[index] = detail
+            if detail.execution.state == 'complete':
+                self.cache.put(project, history_id, detail.execution.executionId, 'records', detail.to_dict())
+        return details
+
+    def _fetch_execution_details(self, history_id: str, executions: list) -> list:
+        """Fetch the steps, environments and failing test cases of executions concurrently, in input order.
+        Responses are parsed into records as they arrive, so only the fields the reports read are kept"""
+        children = iter(self.fetch_all_pages([
+            job
+            for execution in executions
+            for job in (
+                ('steps', (history_id, int(execution['executionId']), int(Paging.STEPS_PAGE_SIZE.value)),
+                 {'fields': self.fields(Fields.STEPS)}),
+                ('environments', (history_id, int(execution['executionId'])),
+                 {'fields': self.fields(Fields.ENVIRONMENTS)}),
+            )
+        ]))
+        details = [
+            ExecutionDetails.from_responses(execution, next(children), next(children), self.keep_raw)
+            for execution in executions
+        ]
+
+        case_jobs = [(detail, step_id) for detail in details for step_id in steps_needing_test_cases(detail)]
+        cases = self.fetch_all_pages([
+            ('test_cases', (history_id, int(detail.execution.executionId), step_id, int(Paging.CASES_PAGE_SIZE.value)),
+             {'fields': self.fields(Fields.TEST_CASES)})
+            for detail, step_id in case_jobs
+        ])
+        for (detail, step_id), step_cases in zip(case_jobs, cases):
+            detail.add_test_cases(step_id, step_cases, self.keep_raw)
+        return details
+
+    def fetch_remaining_test_cases(self, history_id: str, details: list) -> None:
+        """Fetch the test cases of every step of the executions not fetched yet"""
+        jobs = [
+            (detail, step.stepId) for detail in details for step in detail.steps if step.stepId not in detail.testCases
+        ]
+        cases = self.fetch_all_pages([
+            ('test_cases', (history_id, int(detail.execution.executionId), step_id, int(Paging.CASES_PAGE_SIZE.value)),
+             {'fields': self.fields(Fields.TEST_CASES)})
+            for detail, step_id in jobs
+        ])
+        for (detail, step_id), step_cases in zip(jobs, cases):
+            detail.add_test_cases(step_id, step_cases, self.keep_raw)
+
+    def update_flaky_index(self, index: FlakyIndex, since: int = None) -> int:
+        """Index the test case outcomes of the executions created since the previous update (the first
+        one goes back to `since`, by default the past day) and return the number of executions added"""
+        if since is None:
+            since = int(time.time()) - ONE_DAY
+
+        def update(history_id: str) -> int:
+            settled, watermark = self.sync_executions(history_id, index, since)
+            executions = iter(settled)
+            added = 0
+            while batch := list(islice(executions, self.fetcher.workers * Paging.DETAILS_BATCH_SIZE.value)):
+                details = self.fetch_execution_details(history_id, batch)
+                self.fetch_remaining_test_cases(history_id, details)
+                for detail in details:
+                    index.add(self.firebase.projectId, self.firebase.filterByName, detail)
+                added += len(details)
+            self.commit_watermark(history_id, index, watermark)
+            return added
+
+        return sum(self.map_histories(update))
+
+    def get_flaky_tests(self, index: FlakyIndex, days: int = 14, limit: int = 10) -> list:
+        """The tests of this package with the highest flake rate over the past `days`"""
+        return index.flaky_tests(self.firebase.projectId, self.firebase.filterByName, days, limit)
+
+    def update_crash_index(self, index: CrashIndex, since: int = None) -> int:
+        """
+        Index the crashes of the executions created since the previous update (the first one goes
+        back to `since`, by default the past day) in one pass, a batch of executions at a time,
+        and return the number of crashes added
+        """
+        if since is None:
+            since = int(time.time()) - ONE_DAY
+
+        def update(history_id: str) -> int:
+            settled, watermark = self.sync_executions(history_id, index, since)
+            executions = iter(settled)
+            added = 0
+            while batch := list(islice(executions, self.fetcher.workers * Paging.DETAILS_BATCH_SIZE.value)):
+                for detail in self.fetch_execution_details(history_id, batch):
+                    added += index.add(self.firebase.projectId, self.firebase.filterByName, detail)
+            self.commit_watermark(history_id, index, watermark)
+            return added
+
+        return sum(self.map_histories(update))
+
+    def get_top_crashes(self, index: CrashIndex, days: int = 14, limit: int = 10) -> list:
+        """The crash signatures of this package that crashed the most executions over the past `days`"""
+        return index.top_crashes(self.firebase.projectId, self.firebase.filterByName, days, limit)
+
+    def get_test_case_results_by_execution_summary(self, execution_outcome_summary: str, since: int = None,
+                                                   until: int = None) -> dict:
+        """Get test case results from executions with a provided outcome summary, optionally
+        limited to executions created within [since, until] (epoch seconds)"""
+        past_day = int(time.time()) - ONE_DAY
+
+        def results(history_id: str) -> list:
+            results = []
+            """Filter on complete immutable executions"""
+            """Executions with flaky tests (of multiple attempts) are treated as successful"""
+            executions = (
+                execution for execution in self.iter_executions_in_window(history_id, since, until)
+                if self.check_for_execution_state(execution, 'complete')
+                and execution['outcome']['summary'] == execution_outcome_summary
+            )
+            while batch := list(islice(executions, self.fetcher.workers * Paging.DETAILS_BATCH_SIZE.value)):
+                for details in self.fetch_execution_details(history_id, batch):
+                    results.extend(test_case_results_from_details(details, past_day))
+            return results
+
+        return list(chain.from_iterable(self.map_histories(results)))
+
+    def get_timings(self, since: int = None, until: int = None, state: SyncState = None):
+        """Collect the step durations, outcomes and timestamps (and those of all their test cases, so
+        the failure rate is not skewed towards failing steps) of complete executions created within
+        [since, until] (epoch seconds), by default the past day, into a lib.timings.TimingColumns.
+        With a state, the executions settled since its watermarks are collected instead (the first
+        sync goes back to `since`), and the watermarks advance once they all were"""
+        from lib.timings import TimingColumns
+
+        if since is None:
+            since = int(time.time()) - ONE_DAY
+        timings = TimingColumns(self.firebase.projectId, self.firebase.filterByName)
+        lock = threading.Lock()
+
+        def collect(history_id: str) -> None:
+            watermark = None
+            if state is not None:
+                settled, watermark = self.sync_executions(history_id, state, since)
+                executions = iter(settled)
+            else:
+                executions = (
+                    execution for execution in self.iter_executions_in_window(history_id, since, until)
+                    if self.check_for_execution_state(execution, 'complete')
+                )
+            while batch := list(islice(executions, self.fetcher.workers * Paging.DETAILS_BATCH_SIZE.value)):
+                details = self.fetch_execution_details(history_id, batch)
+                self.fetch_remaining_test_cases(history_id, details)
+                with lock:
+                    for detail in details:
+                        timings.add(detail)
+            if state is not None:
+                self.commit_watermark(history_id, state, watermark)
+
+        self.map_histories(collect)
+        return timings
+
+    def count_steps(self, history_id: str, execution: dict) -> int:
+        """Count every step of an execution, paging through them without holding more than one page"""
+        count = self.cached(
+            history_id,
+            execution,
+            'stepCount',
+            lambda: {'count': sum(1 for _ in self.iter_steps(
+                history_id, int(execution['executionId']), self.fields(Fields.STEP_IDS)))}
+        )
+        return count['count']
+
+    def get_recent_step_count_by_execution_summary(self, execution_outcome_summary: str, since: int = None,
+                                                   until: int = None) -> int:
+        """Count the steps of executions with a provided outcome summary created within [since, until]
+        (epoch seconds), by default the past day"""
+        if since is None:
+            since = int(time.time()) - ONE_DAY
+
+        def count(history_id: str) -> int:
+            results = []
+            for execution in self.iter_executions_in_window(history_id, since, until):
+                """Filter on complete immutable executions"""
+                if self.check_for_execution_state(execution, 'complete'):
+                    """Executions with flaky tests (of multiple attempts) are treated as successful"""
+                    if execution['outcome']['summary'] == execution_outcome_summary:
+                        results.append(self.count_steps(history_id, execution))
+            return sum(results)
+
+        return sum(self.map_histories(count))
+
+    def get_new_step_count_by_execution_summary(self, execution_outcome_summary: str, state: SyncState) -> int:
+        """Count the steps of executions with a provided outcome summary created since the last sync.
+        The first sync, without a watermark, covers the past day"""
+        since = int(time.time()) - ONE_DAY
+
+        def count(history_id: str) -> int:
+            results = []
+            settled, watermark = self.sync_executions(history_id, state, since)
+            for execution in settled:
                 if execution['outcome']['summary'] == execution_outcome_summary:
-                    for k, v in execution['creationTime'].items():
-                        if k == 'seconds':
-                            dt_obj = datetime.fromtimestamp(
-                                int(v)
-                            )
-                            time_diff = ((datetime.utcnow() - dt_obj) > timedelta(days=1))
-                            if not time_diff:
-                                steps = self.get_steps(
-                                    history_id=history['historyId'],
-                                    execution_id=int(execution['executionId']),
-                                    page_size=int(Paging.STEPS_PAGE_SIZE.value),
-                                    page_token=None
-                                )
-                                results.append(len(steps['steps']))
-
-                                '''Check for next page token and query again'''
-                                if 'nextPageToken' in steps:
-                                    if steps['nextPageToken'] is not None:
-                                        steps = self.get_steps(
-                                            history_id=history['historyId'],
-                                            execution_id=int(execution['executionId']),
-                                            page_size=int(Paging.STEPS_PAGE_SIZE.value),
-                                            page_token=steps['nextPageToken']
-                                        )
-                                        results.append(len(steps['steps']))
-        return sum(results)
-
-    def post_recent_step_count_by_execution_summary(self, execution_outcome_summary: str) -> dict:
-        self.generate_JSON(payload=(self.get_recent_step_count_by_execution_summary(execution_outcome_summary)))
-
-    def print_test_results_by_execution_summary(self, execution_outcome_summary: str) -> None:
-        results = self.get_test_case_results_by_execution_summary(execution_outcome_summary)
+                    results.append(self.count_steps(history_id, execution))
+            self.commit_watermark(history_id, state, watermark)
+            return sum(results)
+
+        return sum(self.map_histories(count))
+
+    def post_new_step_count_by_execution_summary(self, execution_outcome_summary: str, state: SyncState) -> None:
+        self.generate_JSON(payload=(self.get_new_step_count_by_execution_summary(execution_outcome_summary, state)))
+        state.save()
+
+    def post_recent_step_count_by_execution_summary(self, execution_outcome_summary: str, since: int = None,
+                                                    until: int = None) -> None:
+        self.generate_JSON(
+            payload=(self.get_recent_step_count_by_execution_summary(execution_outcome_summary, since, until))
+        )
+
+    def print_test_results_by_execution_summary(self, execution_outcome_summary: str, since: int = None,
+                                                until: int = None) -> None:
+        results = self.get_test_case_results_by_execution_summary(execution_outcome_summary, since, until)
         if results:
             for result in results:
                 print(f"{result}")
         else:
             print(f"No results found for {execution_outcome_summary}")
 
-    def get_executions_from_past_day_by_execution_summary(self, execution_outcome_summary: str) -> None:
-        from datetime import datetime, timedelta
+    def get_executions_from_past_day_by_execution_summary(self, execution_outcome_summary: str) -> list:
+        since = int(time.time()) - ONE_DAY
 
-        history = next(iter([x for y in self.get_histories().values() for x in y]))
-        executions = self.get_executions(
-            history_id=history['historyId'],
-            page_token=None
-        )
-        candidates = []
-        for execution in executions['executions']:
-            """Filter on complete immutable executions"""
-            if (('state', 'complete') in execution.items()):
-                if execution['outcome']['summary'] == execution_outcome_summary:
-                    for k, v in execution['creationTime'].items():
-                        if k == 'seconds':
-                            dt_obj = datetime.fromtimestamp(
-                                int(v)
-                            )
-                            time_diff = ((datetime.utcnow() - dt_obj) > timedelta(days=1))
-                            if not time_diff:
-                                candidates.append(execution)   
-                            #print(f"{dt_obj.strftime('%Y-%m-%d')} - {execution['testExecutionMatrixId']} - {'more than 24 hours have passed' if time_diff else None}")
-        return candidates
+        def candidates(history_id: str) -> list:
+            candidates = []
+            """The executions are returned as listed, so ask for them whole"""
+            for execution in self.iter_executions_in_window(history_id, since, fields=None):
+                """Filter on complete immutable executions"""
+                if self.check_for_execution_state(execution, 'complete'):
+                    if execution['outcome']['summary'] == execution_outcome_summary:
+                        candidates.append(execution)
+            return candidates
 
-    def generate_JSON(self, payload: str) -> None:
-        payload = {
+        return list(chain.from_iterable(self.map_histories(candidates)))
+
+    def build_payload(self, payload) -> dict:
+        return {
             'project': self.firebase.projectId,
             'application': self.firebase.filterByName,
             'payload': payload
         }
-        if payload:
-            try:
-                 with open('payload.json', 'w') as outfile:
-                    json.dump(payload, outfile, indent=4)
-                    print('Output written to [{}]'.format(outfile.name), end='\n\n')
-            except OSError as e:
-                raise SystemExit(e)
+
+    def generate_JSON(self, payload: str) -> None:
+        write_JSON(self.build_payload(payload))
+
+
+def write_JSON(payload, path: str = 'payload.json') -> None:
+    """Write a report payload, or a list of them for a multi-project run"""
+    if payload:
+        try:
+            with open(path, 'w') as outfile:
+                json.dump(payload, outfile, indent=4)
+                print('Output written to [{}]'.format(outfile.name), end='\n\n')
+        except OSError as e:
+            raise SystemExit(e)
@@ -14,10 +14,10 @@ import json
 import os
 import sys
 
-import requests
-
 from datetime import date
 
+from lib.slack_delivery import SlackDelivery
+
 
 def parse_args(cmdln_args):
     parser = argparse.ArgumentParser(
@@ -27,15 +27,54 @@ def parse_args(cmdln_args):
     parser.add_argument(
         '--input',
         default='payload.json',
-        help='Input (JSON)',
+        help='Input (JSON array or NDJSON of test results)',
+        required=False
+    )
+
+    parser.add_argument(
+        '--baseline',
+        help='SQLite store of earlier results (created if missing); marks metrics that changed',
+        required=False
+    )
+
+    parser.add_argument(
+        '--baseline-window',
+        default=20,
+        type=int,
+        help='Number of earlier commits the baseline median is taken over',
+        required=False
+    )
+
+    parser.add_argument(
+        '--threshold',
+        default=10.0,
+        type=float,
+        help='Percentage change from the baseline median (and 3 MADs) a metric must exceed',
+        required=False
+    )
+
+    parser.add_argument(
+        '--higher-is-better',
+        default=[],
+        nargs='+',
+        help='Metrics that improve when they go up (all others improve going down)',
+        required=False
+    )
+
+    parser.add_argument(
+        '--keep-commits',
+        default=500,
+        type=int,
+        help='Number of commits kept in the baseline store',
         required=False
     )
 
     return parser.parse_args(args=cmdln_args)
 
-def post_to_slack(data):
-    webhook_url = os.environ['SLACK_WEBHOOK']
-    requests.post(webhook_url, json=data)
+def post_to_slack(content: list, header: list = (), footer: list = ()) -> None:
+    # One section per test: large suites are split over several messages
+    with SlackDelivery() as delivery:
+        delivery.post(content, header, footer)
 
 def build_payload_header() -> str:
     return [{
@@ -62,38 +101,129 @@ def build_payload_app_information():
         }
     ]
 
-def build_payload_content(dataset: dict) -> list:
-    # Print only 4 decimals
-    for dictionary in dataset:
-        for key, value in dictionary.items():
-            if key != "testName":
-                dictionary[key] = round(float(dictionary[key]),4)
-
-    new_data = [{k: v for k, v in d.items() if v != 0.0} for d in dataset]
-    first_string = new_data[1]
-    slack_payload = []
-
-    for dic in new_data:
-        s = json.dumps(dic)
-        string = s.replace("testName", "") 
-        string2 = string.replace("\"", "")
-        string3 = string2.replace("()", "*")
-        string4 = string3.replace(":", "=")
-        string5 = string4.replace("TabsPerformanceTest/", "*")
-        string6 = string5.replace(",", "\n")
-
-        each_test_data = {
-                    "type": "section",
-                    "fields": [
-                        {
-                            "type": "mrkdwn",
-                            "text": string6[2:-1]
-                        }
-                    ]
+def iter_records(path: str, chunk_size: int = 1 << 16):
+    # Yield the results one at a time from a JSON array or NDJSON file,
+    # without loading the whole file
+    with open(path) as data_file:
+        first = data_file.read(chunk_size)
+        # Look past any leading whitespace, however long, to tell an array from NDJSON
+        while first and not first.strip():
+            chunk = data_file.read(chunk_size)
+            if not chunk:
+                break
+            first += chunk
+        if not first.lstrip().startswith('['):
+            data_file.seek(0)
+            for line in data_file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = first
+        position = first.index('[') + 1
+        eof = False
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if buffer.startswith(']', position):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                record, end = None, None
+            # A record is only complete once something follows it
+            if end is None or (end == len(buffer) and not eof):
+                if eof:
+                    raise ValueError('Truncated JSON array in {}'.format(path))
+                chunk = data_file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield record
+            position = end
+
+# By lib.perf_baseline.Change
+CHANGE_EMOJI = {
+    "regressed": ":small_red_triangle:",
+    "improved": ":white_check_mark:",
+}
+
+def format_change(change: dict) -> str:
+    # e.g. ":small_red_triangle: +12.5% vs 10.1"
+    return "  {} {:+.1%} vs {}".format(CHANGE_EMOJI[change['change']], change['delta'], round(change['baseline'], 4))
+
+def format_value(value):
+    # Numbers and numeric strings as floats rounded to 4 decimals; integers and anything else as is
+    if isinstance(value, (bool, int)):
+        return value
+    try:
+        return round(float(value), 4)
+    except (TypeError, ValueError):
+        return value
+
+def format_test(record: dict, changes: dict = None) -> str:
+    # e.g. "*testOpenTabs*\nmetric= 12.3456", one line per measurement (zeros included),
+    # floats (numeric strings too) printed with only 4 decimals, and the change of metrics that moved past the baseline
+    test = record.get("testName")
+    name = str(test or "").rsplit("/", 1)[-1]
+    if name.endswith("()"):
+        name = name[:-2]
+    lines = [f"*{name}*"]
+    lines += [
+        f"{key}= {format_value(value)}"
+        + (format_change(changes[test, key]) if changes and (test, key) in changes else "")
+        for key, value in record.items()
+        if key != "testName" and value is not None
+    ]
+    return "\n".join(lines)
+
+def build_payload_content(dataset, changes: dict = None) -> list:
+    # One section per test result, formatted straight from the parsed values
+    return [
+        {
+            "type": "section",
+            "fields": [
+                {
+                    "type": "mrkdwn",
+                    "text": format_test(record, changes)
+                }
+            ]
+        }
+        for record in dataset
+    ]
+
+def build_payload_changes_summary(changes: dict, window: int) -> list:
+    regressed = sum(change['change'] == "regressed" for change in changes.values())
+    return [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "{} {} regressed, {} {} improved vs the median of the last {} commits"
+                .format(CHANGE_EMOJI["regressed"], regressed,
+                        CHANGE_EMOJI["improved"], len(changes) - regressed, window)
             }
-        slack_payload.append(each_test_data)
+        }
+    ]
 
-    return slack_payload
+def compare_with_baseline(args) -> dict:
+    # Store this commit's results, then compare them with the earlier commits (needs numpy)
+    from lib.perf_baseline import PerfBaseline
+
+    baseline = PerfBaseline(args.baseline)
+    try:
+        baseline.add(os.environ['GIT_COMMIT'], iter_records(args.input))
+        baseline.prune(args.keep_commits)
+        return baseline.compare(
+            os.environ['GIT_COMMIT'],
+            window=args.baseline_window,
+            threshold=args.threshold / 100,
+            higher_is_better=set(args.higher_is_better)
+        )
+    finally:
+        baseline.close()
 
 def build_payload_footer():
     return [
@@ -133,17 +263,18 @@ def main():
     args = parse_args(sys.argv[1:])
     
     try:
-        with open(args.input) as data_file:
-            dataset = json.load(data_file)
-            header = build_payload_header()
-            app_info = build_payload_app_information()
-            content = build_payload_content(dataset)
-            content_link = build_payload_link_to_content()
-            footer = build_payload_footer()
-            divider = [{"type": "divider"}]
-
-        data = {'blocks': header + app_info + divider + content + divider + content_link + footer}
-        post_to_slack(data)
+        header = build_payload_header()
+        app_info = build_payload_app_information()
+        changes = None
+        if args.baseline:
+            changes = compare_with_baseline(args)
+            app_info += build_payload_changes_summary(changes, args.baseline_window)
+        content = build_payload_content(iter_records(args.input), changes)
+        content_link = build_payload_link_to_content()
+        footer = build_payload_footer()
+        divider = [{"type": "divider"}]
+
+        post_to_slack(content, header + app_info + divider, divider + content_link + footer)
 
     except FileNotFoundError as e:
         print(e)
@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""An incremental SQLite index of crash signatures, for per-package top crash reports"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from lib.records import ExecutionDetails, Step
+
+"""Crashed steps reported without a crash test issue (or cached before crashes were kept on them)"""
+UNKNOWN_CRASH = 'unknownCrash'
+
+MAX_SIGNATURE_CHARS = 300
+
+"""Addresses, object hashes and other numbers vary between runs of the same crash"""
+_VARIABLE = re.compile(r'0x[0-9a-fA-F]+|\b[0-9a-fA-F]*\d[0-9a-fA-F]*\b')
+_FRAME = re.compile(r'^(at |#\d+ )')
+"""A native frame's number and program counter, ahead of its library and symbol"""
+_NATIVE_FRAME = re.compile(r'^#\d+\s+pc\s+[0-9a-fA-F]+\s+')
+
+
+def crash_signature(issue_type: str, trace: str) -> str:
+    """
+    Group crashes by issue type, exception (the first line of the trace) and top stack frame
+    (Java or native), with the numbers masked so the same crash in other runs, on other
+    devices and at other line numbers shares one signature.
+    """
+    lines = [line.strip() for line in trace.splitlines() if line.strip()] if trace else []
+    parts = [issue_type]
+    if lines:
+        parts.append(_VARIABLE.sub('#', lines[0]))
+        frame = next((line for line in lines[1:] if _FRAME.match(line)), None)
+        if frame is not None:
+            parts.append(_VARIABLE.sub('#', _NATIVE_FRAME.sub('', frame)))
+    return ' | '.join(parts)[:MAX_SIGNATURE_CHARS]
+
+
+def step_crashes(step: Step) -> list:
+    """The (issue type, signature) of every crash of a step"""
+    crashes = [(issue_type, crash_signature(issue_type, trace)) for issue_type, trace in step.crashes or ()]
+    if step.crashed and not crashes:
+        crashes.append((UNKNOWN_CRASH, UNKNOWN_CRASH))
+    return crashes
+
+
+def device(step: Step) -> str:
+    """The model and OS version of a step's dimensions, or all of them when it has neither"""
+    dimensions = dict(step.dimensions)
+    names = [dimensions[key] for key in ('Model', 'Version') if key in dimensions]
+    return '/'.join(names or dimensions.values())
+
+
+def _date(seconds: int) -> str:
+    return time.strftime('%Y-%m-%d', time.gmtime(seconds))
+
+
+class CrashIndex:
+    """
+    Maps each crash signature of a project and package to one row per step it crashed, with
+    the execution, device and creation time, and keeps the signature's first and last sighting
+    (which survive pruning). Like the FlakyIndex, it keeps a watermark per project and package
+    (with the SyncState get/set/save interface) so each update only streams the executions
+    newer than the previous one, and changes are only committed by save().
+    """
+
+    def __init__(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS signatures ('
+            ' id INTEGER PRIMARY KEY, project TEXT, package TEXT, signature TEXT, issue_type TEXT,'
+            ' first_seen INTEGER, last_seen INTEGER, UNIQUE (project, package, signature));'
+            'CREATE TABLE IF NOT EXISTS crashes ('
+            ' signature INTEGER, execution TEXT, step TEXT, device TEXT, creation_time INTEGER,'
+            ' PRIMARY KEY (signature, execution, step)) WITHOUT ROWID;'
+            'CREATE INDEX IF NOT EXISTS crashes_time ON crashes (creation_time, signature);'
+            'CREATE TABLE IF NOT EXISTS watermarks ('
+            ' project TEXT, package TEXT, creation_time INTEGER, execution TEXT,'
+            ' PRIMARY KEY (project, package));'
+        )
+        self._db.commit()
+
+    def get(self, project: str, package: str) -> dict:
+        """The watermark ({'creationTime': int, 'executionId': str}) of the newest indexed execution, or None"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT creation_time, execution FROM watermarks WHERE project = ? AND package = ?',
+                (project, package)
+            ).fetchone()
+        return {'creationTime': row[0], 'executionId': row[1]} if row else None
+
+    def set(self, project: str, package: str, execution: dict) -> None:
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)',
+                (project, package, int(execution['creationTime']['seconds']), execution['executionId'])
+            )
+
+    def _signature_id(self, project: str, package: str, signature: str, issue_type: str, seen: int) -> int:
+        return self._db.execute(
+            'INSERT INTO signatures (project, package, signature, issue_type, first_seen, last_seen)'
+            ' VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (project, package, signature) DO UPDATE SET'
+            ' first_seen = MIN(first_seen, excluded.first_seen), last_seen = MAX(last_seen, excluded.last_seen)'
+            ' RETURNING id',
+            (project, package, signature, issue_type, seen, seen)
+        ).fetchone()[0]
+
+    def add(self, project: str, package: str, details: ExecutionDetails) -> int:
+        """Index the crashes of an execution's steps; returns the number of crashes recorded"""
+        execution = details.execution
+        crashes = [
+            (issue_type, signature, step.stepId, device(step), step.creationTime or execution.creationTime)
+            for step in details.steps
+            for issue_type, signature in step_crashes(step)
+        ]
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO crashes VALUES (?, ?, ?, ?, ?)', [
+                (self._signature_id(project, package, signature, issue_type, created),
+                 execution.executionId, step_id, step_device, created)
+                for issue_type, signature, step_id, step_device, created in crashes
+            ])
+        return len(crashes)
+
+    def top_crashes(self, project: str, package: str, days: int = 14, limit: int = 10, devices: int = 5,
+                    now: int = None) -> list:
+        """The signatures that crashed the most executions over the past `days`, with their most affected devices"""
+        since = int(time.time() if now is None else now) - days * 86400
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT signatures.id, signatures.signature, signatures.issue_type, signatures.first_seen,'
+                ' signatures.last_seen, COUNT(DISTINCT crashes.execution) AS executions, COUNT(*) AS occurrences,'
+                ' COUNT(DISTINCT crashes.device)'
+                ' FROM crashes JOIN signatures ON signatures.id = crashes.signature'
+                ' WHERE signatures.project = ? AND signatures.package = ? AND crashes.creation_time >= ?'
+                ' GROUP BY crashes.signature ORDER BY executions DESC, occurrences DESC, signatures.last_seen DESC'
+                ' LIMIT ?',
+                (project, package, since, limit)
+            ).fetchall()
+            top_devices = {
+                signature_id: self._db.execute(
+                    'SELECT device, COUNT(*) AS occurrences FROM crashes WHERE signature = ? AND creation_time >= ?'
+                    ' GROUP BY device ORDER BY occurrences DESC, device LIMIT ?',
+                    (signature_id, since, devices)
+                ).fetchall()
+                for signature_id, *_ in rows
+            }
+        return [
+            {
+                'signature': signature,
+                'type': issue_type,
+                'executions': executions,
+                'occurrences': occurrences,
+                'deviceCount': device_count,
+                'devices': dict(top_devices[signature_id]),
+                'firstSeen': _date(first_seen),
+                'lastSeen': _date(last_seen),
+            }
+            for signature_id, signature, issue_type, first_seen, last_seen, executions, occurrences, device_count
+            in rows
+        ]
+
+    def prune(self, days: int, now: int = None) -> None:
+        """Drop crashes older than `days`; the signatures keep their first and last sightings"""
+        since = int(time.time() if now is None else now) - days * 86400
+        with self._lock:
+            self._db.execute('DELETE FROM crashes WHERE creation_time < ?', (since,))
+
+    def save(self) -> None:
+        with self._lock:
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
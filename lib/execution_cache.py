@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""An on-disk SQLite cache for the child resources of completed executions"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class ExecutionCache:
+    """
+    Completed executions are immutable, so their steps, environments and test cases
+    can be stored once and served locally on every later run. Entries are keyed by
+    project, history and execution ID plus a resource name ('stepCount', or 'records'
+    for the parsed steps, environments and per-step test cases of a report); the least
+    recently used entries are evicted once the stored (compressed) size grows
+    past max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS executions ('
+            ' project TEXT, history TEXT, execution TEXT, resource TEXT,'
+            ' value BLOB, size INTEGER, accessed REAL,'
+            ' PRIMARY KEY (project, history, execution, resource))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS executions_accessed ON executions (accessed)')
+        self._db.commit()
+
+    def get(self, project: str, history: str, execution: str, resource: str) -> dict:
+        """Return a cached resource of an execution, or None"""
+        key = (project, history, str(execution), resource)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM executions WHERE project = ? AND history = ? AND execution = ? AND resource = ?',
+                key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute(
+                'UPDATE executions SET accessed = ?'
+                ' WHERE project = ? AND history = ? AND execution = ? AND resource = ?',
+                (time.time(),) + key
+            )
+            self._db.commit()
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, project: str, history: str, execution: str, resource: str, value: dict) -> None:
+        """Store a resource of a completed execution and evict old entries past the size limit"""
+        blob = zlib.compress(json.dumps(value, separators=(',', ':')).encode())
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO executions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (project, history, str(execution), resource, blob, len(blob), time.time())
+            )
+            self._evict()
+            self._db.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM executions').fetchone()[0]
+
+    def _evict(self) -> None:
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM executions').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute('SELECT rowid, size FROM executions ORDER BY accessed').fetchall()
+        evicted = []
+        for rowid, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((rowid,))
+            total -= size
+        self._db.executemany('DELETE FROM executions WHERE rowid = ?', evicted)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,547 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""A stand-in for the Cloud ToolResults v1beta3 API, in-process or over local HTTP, used for benchmarks"""
+
+import gzip
+import hashlib
+import json
+import threading
+import time
+from email.parser import BytesParser, Parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from lib import fields
+from lib.firebase_conn import TransportPool
+
+
+def _rand(*key) -> float:
+    """Deterministic pseudo-random number in [0, 1) for a given key"""
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2 ** 64
+
+
+"""The crashes of failing steps, most frequent first: (issue type, stack trace with a varying address)"""
+_CRASHES = (
+    ('fatalException',
+     'java.lang.IllegalStateException: Fragment HomeFragment{{{address:x}}} not attached to a context.\n'
+     '\tat androidx.fragment.app.Fragment.requireContext(Fragment.java:{address})\n'
+     '\tat org.mozilla.fenix.home.HomeFragment.onResume(HomeFragment.kt:412)'),
+    ('nativeCrash',
+     'signal 11 (SIGSEGV), code 1 (SEGV_MAPERR), fault addr 0x{address:x}\n'
+     '#00 pc 000000000{address:x}  /data/app/org.mozilla.fenix/lib/arm64/libxul.so (mozalloc_abort+40)'),
+    ('fatalException',
+     'java.lang.NullPointerException: Attempt to invoke virtual method on a null object reference\n'
+     '\tat mozilla.components.browser.engine.gecko.GeckoEngineSession.loadUrl(GeckoEngineSession.kt:151)'),
+    ('anr',
+     'Input dispatching timed out (Waiting to send non-key event because the touched window has not '
+     'finished processing certain input events that were delivered to it over 500.0ms ago.)'),
+)
+
+
+class SyntheticHistory:
+    """
+    A generated test history of executions, each with one step per environment (shard)
+    and a fixed number of test cases per step. Resources are built on demand so large
+    histories do not need to be held in memory.
+    """
+
+    def __init__(self, executions: int = 50, steps: int = 10, cases: int = 20, failure_rate: float = 0.3,
+                 interval: int = 1800, now: int = None, seed: int = 0) -> None:
+        self.executions = executions
+        self.steps = steps
+        self.cases = cases
+        self.failure_rate = failure_rate
+        self.interval = interval
+        self.now = int(time.time() if now is None else now)
+        self.seed = seed
+        self.history_id = 'bh.{:016x}'.format(int(_rand(seed) * 2 ** 64))
+
+    def history(self, name: str) -> dict:
+        return {'historyId': self.history_id, 'name': name, 'displayName': name}
+
+    def _execution_outcome(self, execution: int) -> str:
+        roll = _rand(self.seed, execution)
+        if roll < self.failure_rate:
+            return 'failure'
+        if roll < self.failure_rate + 0.05:
+            return 'flaky'
+        if roll < self.failure_rate + 0.08:
+            return 'inconclusive'
+        return 'success'
+
+    def _step_outcome(self, execution: int, step: int) -> str:
+        outcome = self._execution_outcome(execution)
+        if outcome in {'failure', 'flaky'} and (step == 0 or _rand(self.seed, execution, step) < 0.2):
+            return outcome
+        if outcome == 'inconclusive' and step == 0:
+            return outcome
+        return 'success'
+
+    def _dimensions(self, step: int) -> list:
+        return [
+            {'key': 'Model', 'value': 'Pixel{}'.format(2 + step % 4)},
+            {'key': 'Version', 'value': str(28 + step % 3)},
+            {'key': 'Locale', 'value': 'en'},
+            {'key': 'Orientation', 'value': 'portrait'},
+            {'key': 'Shard', 'value': str(step)},
+        ]
+
+    def execution(self, execution: int) -> dict:
+        return {
+            'executionId': str(10 ** 9 - execution),
+            'state': 'complete',
+            'creationTime': {'seconds': str(self.now - execution * self.interval), 'nanos': 0},
+            'completionTime': {'seconds': str(self.now - execution * self.interval + 900), 'nanos': 0},
+            'outcome': {'summary': self._execution_outcome(execution)},
+            'testExecutionMatrixId': 'matrix-{}'.format(execution),
+        }
+
+    def step(self, execution: int, step: int) -> dict:
+        outcome = {'summary': self._step_outcome(execution, step)}
+        test_issues = []
+        if outcome['summary'] == 'failure' and _rand(self.seed, execution, step, 'crash') < 0.25:
+            outcome['failureDetail'] = {'crashed': True}
+            issue_type, trace = _CRASHES[int(_rand(self.seed, execution, step, 'signature') ** 2 * len(_CRASHES))]
+            trace = trace.format(address=int(_rand(self.seed, execution, step, 'address') * 2 ** 32))
+            test_issues.append({
+                'errorMessage': trace.splitlines()[0],
+                'type': issue_type,
+                'severity': 'severe',
+                'stackTrace': {'exception': trace},
+            })
+        return {
+            'stepId': 'bs.{}'.format(step),
+            'state': 'complete',
+            'name': 'Instrumentation test',
+            'creationTime': {'seconds': str(self.now - execution * self.interval + step), 'nanos': 0},
+            'outcome': outcome,
+            'dimensionValue': self._dimensions(step),
+            'testExecutionStep': {
+                'testTiming': {
+                    'testProcessDuration': {'seconds': str(120 + int(_rand(self.seed, execution, step) * 600))}
+                },
+                'testIssues': test_issues,
+            },
+        }
+
+    def environment(self, execution: int, step: int) -> dict:
+        return {
+            'environmentId': str(step),
+            'executionId': str(10 ** 9 - execution),
+            'dimensionValue': self._dimensions(step),
+            'environmentResult': {'outcome': {'summary': self._step_outcome(execution, step)}},
+        }
+
+    def test_case(self, execution: int, step: int, case: int) -> dict:
+        step_outcome = self._step_outcome(execution, step)
+        status = 'passed'
+        if step_outcome in {'failure', 'flaky'} and (case == 0 or _rand(self.seed, execution, step, case) < 0.05):
+            status = 'failed' if step_outcome == 'failure' else 'flaky'
+        return {
+            'testCaseId': str(case),
+            'status': status,
+            'testCaseReference': {
+                'name': 'test{}'.format(case),
+                'className': 'org.mozilla.fenix.ui.Suite{}Test'.format(case % 25),
+            },
+            'elapsedTime': {'seconds': str(1 + case % 30)},
+        }
+
+    def execution_index(self, execution_id: str) -> int:
+        return 10 ** 9 - int(execution_id)
+
+
+class FakeToolResults:
+    """
+    Serves SyntheticHistory resources for the handful of list/get calls Firebase makes,
+    honoring fields= masks. `bytes` counts the JSON served, and `bandwidth` (bytes per
+    second) adds the time a response of that size would take to transfer. Given a list of
+    histories, every package has all of them, listed in order.
+    """
+
+    def __init__(self, history, latency: float = 0.0, bandwidth: float = None) -> None:
+        self.histories = list(history) if isinstance(history, (list, tuple)) else [history]
+        self.data = self.histories[0]
+        self._by_id = {data.history_id: data for data in self.histories}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.calls = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._masks = {}
+
+    def _page(self, items: int, build, key: str, params: dict) -> dict:
+        offset = int(params.get('pageToken') or 0)
+        page_size = int(params.get('pageSize') or 25)
+        end = min(items, offset + page_size)
+        page = {key: [build(i) for i in range(offset, end)]} if end > offset else {}
+        if end < items:
+            page['nextPageToken'] = str(end)
+        return page
+
+    def round_trip(self) -> None:
+        """Account for one HTTP round trip"""
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def handle(self, collection: str, method: str, params: dict, http: 'FakeHttp' = None) -> dict:
+        self.round_trip()
+        return self.respond(collection, method, params, http)
+
+    def respond(self, collection: str, method: str, params: dict, http: 'FakeHttp' = None) -> dict:
+        """The response to a call, projected on its fields mask and accounted for (also as received by `http`)"""
+        response = self._resource(collection, method, params)
+        if params.get('fields'):
+            mask = params['fields']
+            if mask not in self._masks:
+                self._masks[mask] = fields.parse(mask)
+            response = fields.project(response, self._masks[mask])
+        size = len(json.dumps(response))
+        with self._lock:
+            self.bytes += size
+        if http is not None:
+            http.received += size
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+        return response
+
+    def _resource(self, collection: str, method: str, params: dict) -> dict:
+        if collection == 'histories':
+            histories = self.histories
+            return self._page(len(histories), lambda i: histories[i].history(params.get('filterByName')),
+                              'histories', params)
+        data = self._by_id.get(params.get('historyId'), self.data)
+        execution = data.execution_index(params['executionId']) if 'executionId' in params else None
+        if collection == 'executions':
+            if method == 'get':
+                return data.execution(execution)
+            return self._page(data.executions, data.execution, 'executions', params)
+        if collection == 'steps':
+            if method == 'get':
+                return data.step(execution, int(params['stepId'].split('.')[-1]))
+            return self._page(data.steps, lambda i: data.step(execution, i), 'steps', params)
+        if collection == 'environments':
+            if method == 'get':
+                return data.environment(execution, int(params['environmentId']))
+            return self._page(data.steps, lambda i: data.environment(execution, i), 'environments', params)
+        if collection == 'testCases':
+            step = int(params['stepId'].split('.')[-1])
+            if method == 'get':
+                return data.test_case(execution, step, int(params['testCaseId']))
+            return self._page(data.cases, lambda i: data.test_case(execution, step, i), 'testCases', params)
+        raise ValueError('Unsupported collection {}'.format(collection))
+
+
+_CHILDREN = {
+    'client': ('projects',),
+    'projects': ('histories',),
+    'histories': ('executions',),
+    'executions': ('steps', 'environments'),
+    'steps': ('testCases',),
+}
+
+
+class FakeHttp:
+    """Stands in for a connection's (metered) transports: only counts the bytes served through it"""
+
+    def __init__(self) -> None:
+        self.received = 0
+
+
+class FakeRequest:
+    def __init__(self, backend: FakeToolResults, collection: str, method: str, params: dict) -> None:
+        self.backend = backend
+        self.collection = collection
+        self.method = method
+        self.params = params
+
+    def execute(self, http=None) -> dict:
+        return self.backend.handle(self.collection, self.method, self.params, http)
+
+
+class FakeBatch:
+    """Mimics googleapiclient.http.BatchHttpRequest: all added requests share one round trip"""
+
+    def __init__(self, backend: FakeToolResults, callback) -> None:
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: FakeRequest, request_id: str) -> None:
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None) -> None:
+        self.backend.round_trip()
+        for request_id, request in self.requests:
+            try:
+                response = self.backend.respond(request.collection, request.method, request.params, http)
+            except Exception as e:
+                self.callback(request_id, None, e)
+            else:
+                self.callback(request_id, response, None)
+
+
+class FakeCollection:
+    """Mimics the chained resource objects of a googleapiclient discovery client"""
+
+    def __init__(self, backend: FakeToolResults, name: str) -> None:
+        self.backend = backend
+        self.name = name
+
+    def __getattr__(self, child: str):
+        if child in _CHILDREN.get(self.name, ()):
+            return lambda: FakeCollection(self.backend, child)
+        raise AttributeError(child)
+
+    def list(self, **params) -> FakeRequest:
+        return FakeRequest(self.backend, self.name, 'list', params)
+
+    def get(self, **params) -> FakeRequest:
+        return FakeRequest(self.backend, self.name, 'get', params)
+
+    def new_batch_http_request(self, callback) -> FakeBatch:
+        return FakeBatch(self.backend, callback)
+
+
+class FakeConnection:
+    """Drop-in replacement for FirebaseConn that talks to a FakeToolResults backend"""
+
+    def __init__(self, backend: FakeToolResults, pool: TransportPool = None) -> None:
+        self.backend = backend
+        self.projects_client = self.build_client()
+        """Stand-in transports keep the pool statistics and response sizes meaningful"""
+        self.pool = pool or TransportPool(FakeHttp, size=64)
+
+    def get_projects_client(self):
+        return self.projects_client
+
+    def build_client(self):
+        return FakeCollection(self.backend, 'client')
+
+    def fork(self) -> 'FakeConnection':
+        return FakeConnection(self.backend, self.pool)
+
+    def stats(self) -> dict:
+        return self.pool.stats()
+
+
+_ID_PARAMS = {
+    'projects': 'projectId',
+    'histories': 'historyId',
+    'executions': 'executionId',
+    'steps': 'stepId',
+    'testCases': 'testCaseId',
+    'environments': 'environmentId',
+}
+
+API_PATH = '/toolresults/v1beta3/'
+
+
+"""The batch endpoint (the discovery document's batchPath) and the OAuth token endpoint"""
+BATCH_PATH = '/batch'
+TOKEN_PATH = '/token'
+
+BATCH_BOUNDARY = 'batch_fake_toolresults'
+
+
+class _FakeToolResultsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _authorized(self, headers) -> bool:
+        """Without require_token any request goes; otherwise it needs a bearer token issued by /token"""
+        if not self.server.require_token:
+            return True
+        scheme, _, token = (headers.get('Authorization') or '').partition(' ')
+        with self.server.lock:
+            return scheme.lower() == 'bearer' and token in self.server.tokens
+
+    def _respond(self, path: str, headers, batched: bool = False) -> tuple:
+        """The (status, body) of a GET, sent on its own or as part of a batch (whose round trip is shared)"""
+        if not self._authorized(headers):
+            with self.server.lock:
+                self.server.unauthorized += 1
+            return 401, {'error': {'code': 401, 'message': 'Request had invalid authentication credentials.'}}
+        url = urlsplit(path)
+        segments = url.path[len(API_PATH):].strip('/').split('/') if url.path.startswith(API_PATH) else []
+        params = dict(parse_qsl(url.query))
+        """Paths alternate collection names and IDs: an odd number of segments lists the last collection"""
+        for collection, resource_id in zip(segments[0::2], segments[1::2]):
+            params[_ID_PARAMS.get(collection, collection)] = resource_id
+        try:
+            if not segments or segments[-1 if len(segments) % 2 else -2] not in _ID_PARAMS:
+                raise ValueError('Unknown path {}'.format(url.path))
+            collection = segments[-1] if len(segments) % 2 else segments[-2]
+            method = 'list' if len(segments) % 2 else 'get'
+            if batched:
+                return 200, self.server.backend.respond(collection, method, params)
+            return 200, self.server.backend.handle(collection, method, params)
+        except (KeyError, ValueError) as e:
+            return 404, {'error': {'code': 404, 'message': str(e)}}
+
+    def _send(self, status: int, content: bytes, content_type: str = 'application/json; charset=UTF-8',
+              headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and 'gzip' in self.headers.get('User-Agent', ''):
+            """Like Google APIs, only compress for clients that ask for it in their user agent too"""
+            content = gzip.compress(content)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        with self.server.lock:
+            self.server.bytes_sent += len(content)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        with self.server.lock:
+            error = self.server.errors.pop(0) if self.server.errors else None
+        if error is not None:
+            status, retry_after = error
+            with self.server.lock:
+                self.server.errors_sent += 1
+            body = {'error': {'code': status, 'message': 'Injected error'}}
+            headers = {'Retry-After': str(retry_after)} if retry_after is not None else None
+            self._send(status, json.dumps(body).encode(), headers=headers)
+            return
+        status, body = self._respond(self.path, self.headers)
+        self._send(status, json.dumps(body).encode())
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = urlsplit(self.path).path
+        if path == TOKEN_PATH:
+            self._token()
+        elif path == BATCH_PATH:
+            self._batch(body)
+        else:
+            self._send(404, json.dumps({'error': {'code': 404, 'message': 'Unknown path {}'.format(path)}}).encode())
+
+    def _token(self) -> None:
+        """Grant a new access token to any assertion, as a service account token exchange would"""
+        with self.server.lock:
+            token = 'fake-token-{}'.format(len(self.server.tokens))
+            self.server.tokens.add(token)
+        self._send(200, json.dumps({'access_token': token, 'expires_in': 3600, 'token_type': 'Bearer'}).encode())
+
+    def _batch(self, body: bytes) -> None:
+        """
+        Answer a multipart/mixed batch of GETs in one response, like the Google API batch endpoint:
+        each application/http part gets a part with the same Content-ID, prefixed with "response-".
+        The batch as a whole takes a single round trip.
+        """
+        message = BytesParser().parsebytes(
+            'Content-Type: {}\r\n\r\n'.format(self.headers['Content-Type']).encode() + body)
+        if not message.is_multipart():
+            self._send(400, json.dumps({'error': {'code': 400, 'message': 'Not a multipart batch'}}).encode())
+            return
+        self.server.backend.round_trip()
+        parts = []
+        for part in message.get_payload():
+            request_line, _, request = part.get_payload().replace('\r\n', '\n').partition('\n')
+            method, path, _ = request_line.split(' ', 2)
+            headers = Parser().parsestr(request, headersonly=True)
+            if method != 'GET':
+                status, response = 405, {'error': {'code': 405, 'message': 'Only GET requests can be batched'}}
+            else:
+                status, response = self._respond(path, headers, batched=True)
+            parts.append(
+                '--{}\r\nContent-Type: application/http\r\nContent-ID: <response-{}\r\n\r\n'
+                'HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n{}\r\n'.format(
+                    BATCH_BOUNDARY, part['Content-ID'][1:], status, self.responses[status][0], json.dumps(response))
+            )
+        with self.server.lock:
+            self.server.batches += 1
+        content = ''.join(parts) + '--{}--\r\n'.format(BATCH_BOUNDARY)
+        self._send(200, content.encode(), 'multipart/mixed; boundary={}'.format(BATCH_BOUNDARY))
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class FakeToolResultsServer:
+    """
+    Serves a FakeToolResults backend over HTTP on localhost, using the real REST paths, the
+    batch endpoint and a token endpoint. With require_token, API calls (batched ones included)
+    need a bearer token from the token endpoint, and get a 401 otherwise. `bytes_sent` counts
+    the response bodies as sent, i.e. after compression. inject_errors() makes the next GET
+    requests fail, e.g. to exercise retries.
+    """
+
+    def __init__(self, backend: FakeToolResults, host: str = '127.0.0.1', port: int = 0,
+                 require_token: bool = False) -> None:
+        self.backend = backend
+        self.httpd = ThreadingHTTPServer((host, port), _FakeToolResultsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.request_queue_size = 1024
+        self.httpd.backend = backend
+        self.httpd.require_token = require_token
+        self.httpd.tokens = set()
+        self.httpd.unauthorized = 0
+        self.httpd.batches = 0
+        self.httpd.errors = []
+        self.httpd.errors_sent = 0
+        self.httpd.bytes_sent = 0
+        self.httpd.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def bytes_sent(self) -> int:
+        return self.httpd.bytes_sent
+
+    @property
+    def errors_sent(self) -> int:
+        return self.httpd.errors_sent
+
+    def inject_errors(self, status: int, count: int = 1, retry_after: float = None) -> None:
+        """Answer the next `count` GET requests with `status` (and a Retry-After header, if given)"""
+        with self.httpd.lock:
+            self.httpd.errors.extend([(status, retry_after)] * count)
+
+    @property
+    def tokens_issued(self) -> int:
+        return len(self.httpd.tokens)
+
+    @property
+    def unauthorized(self) -> int:
+        return self.httpd.unauthorized
+
+    @property
+    def batches(self) -> int:
+        return self.httpd.batches
+
+    @property
+    def root_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    @property
+    def endpoint(self) -> str:
+        return self.root_url + API_PATH.lstrip('/')
+
+    @property
+    def token_uri(self) -> str:
+        return self.root_url + TOKEN_PATH.lstrip('/')
+
+    def start(self) -> 'FakeToolResultsServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'FakeToolResultsServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
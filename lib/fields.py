@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Google API partial response (fields=) masks, e.g. 'nextPageToken,steps(stepId,outcome/summary)'"""
+
+
+def _merge(selected, selection):
+    """Combine two selections of the same field; None selects the whole field"""
+    if selected is None or selection is None:
+        return None
+    for name, sub_selection in selection.items():
+        selected[name] = _merge(selected[name], sub_selection) if name in selected else sub_selection
+    return selected
+
+
+def _parse(mask: str, index: int) -> tuple:
+    selection = {}
+    while index < len(mask):
+        end = index
+        while end < len(mask) and mask[end] not in ',()':
+            end += 1
+        path = mask[index:end].split('/')
+        index = end
+        sub_selection = None
+        if index < len(mask) and mask[index] == '(':
+            sub_selection, index = _parse(mask, index + 1)
+            if index >= len(mask) or mask[index] != ')':
+                raise ValueError('Unbalanced parentheses in fields mask {!r}'.format(mask))
+            index += 1
+        for name in reversed(path[1:]):
+            sub_selection = {name: sub_selection}
+        selection = _merge(selection, {path[0]: sub_selection})
+        if index < len(mask) and mask[index] == ',':
+            index += 1
+        elif index < len(mask) and mask[index] == ')':
+            return selection, index
+    return selection, index
+
+
+def parse(mask: str) -> dict:
+    """Parse a mask into nested dicts of the selected field names, None marking a whole field"""
+    mask = ''.join(mask.split())
+    selection, index = _parse(mask, 0)
+    if index != len(mask):
+        raise ValueError('Unbalanced parentheses in fields mask {!r}'.format(mask))
+    return selection
+
+
+def project(value, selection: dict):
+    """Keep only the selected fields of a response, as the API does for a fields mask.
+    Selections apply to every element of a list"""
+    if selection is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, selection) for item in value]
+    if isinstance(value, dict):
+        return {name: project(value[name], sub_selection) for name, sub_selection in selection.items() if name in value}
+    return value
@@ -4,12 +4,14 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import copy
 import json
 import os
+import threading
+import time
+from contextlib import contextmanager
 from enum import Enum
-
-import googleapiclient.discovery
-from google.oauth2 import service_account
+from typing import Callable
 
 
 class FirebaseProjects(Enum):
@@ -21,33 +23,231 @@ class FirebaseProjects(Enum):
     MOZ_ANDROID_COMPONENTS = "moz-android-components"
 
 
+CREDENTIAL_VARIABLES = {
+    FirebaseProjects.MOZ_FENIX.value: 'GCLOUD_AUTH_MOZ_FENIX',
+    FirebaseProjects.MOZ_FOCUS_ANDROID.value: 'GCLOUD_AUTH_MOZ_FOCUS_ANDROID',
+    FirebaseProjects.MOZ_ANDROID_COMPONENTS.value: 'GCLOUD_AUTH_MOZ_ANDROID_COMPONENTS',
+}
+
+CLOUD_PLATFORM_SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
+
+USER_AGENT = 'mozilla-mobile-test-reporting (gzip)'
+
+"""Parsed discovery documents, shared by every connection in the process"""
+_DISCOVERY_DOCUMENTS = {}
+
+
+class TransportPool:
+    """
+    Up to `size` HTTP transports, each used by one thread at a time: httplib2 transports are
+    not thread-safe, but keep their connections alive, so a transport checked back in serves
+    a later request over the same connection. Idle transports are reused most recent first.
+    """
+
+    def __init__(self, factory: Callable, size: int = 8) -> None:
+        self.factory = factory
+        self.size = max(1, size)
+        self.created = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self._idle = []
+        self._in_use = 0
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transport(self):
+        """Check out a transport for the duration of one request (or batch)"""
+        if not self._slots.acquire(blocking=False):
+            started = time.perf_counter()
+            self._slots.acquire()
+            with self._lock:
+                self.waits += 1
+                self.wait_seconds += time.perf_counter() - started
+        try:
+            with self._lock:
+                http = self._idle.pop() if self._idle else None
+                self.checkouts += 1
+                self._in_use += 1
+            try:
+                if http is None:
+                    http = self.factory()
+                    with self._lock:
+                        self.created += 1
+                yield http
+            finally:
+                with self._lock:
+                    self._in_use -= 1
+                    if http is not None:
+                        self._idle.append(http)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self.created,
+                'idle': len(self._idle),
+                'inUse': self._in_use,
+                'checkouts': self.checkouts,
+                'reuses': self.checkouts - self.created,
+                'waits': self.waits,
+                'waitSeconds': round(self.wait_seconds, 6),
+            }
+
+
+class MeteredHttp:
+    """
+    Wraps an httplib2.Http and counts the bytes of response content it received (after gzip
+    decoding). A pooled transport serves one request at a time, so the count's growth over a
+    request is that response's size, batches included, without serializing it again.
+    """
+
+    def __init__(self, http) -> None:
+        self.http = http
+        self.received = 0
+
+    def request(self, uri: str, method: str = 'GET', body=None, headers=None, **kwargs):
+        response, content = self.http.request(uri, method, body=body, headers=headers, **kwargs)
+        self.received += len(content)
+        return response, content
+
+    def __getattr__(self, name: str):
+        """Anything else (timeout, credentials, close...) goes to the wrapped transport"""
+        if name == 'http':
+            raise AttributeError(name)
+        return getattr(self.http, name)
+
+
 class FirebaseConn:
+    """
+    Credentials and the toolresults client are created on first use, so constructing a
+    connection is free and the Google client stack is only imported once a call is made.
+    Requests run on transports checked out of the connection's pool, so one client can be
+    used from several threads; forks share the pool and the credentials.
+    """
 
     def get_projects_client(self):
+        """An injected transport (e.g. a replay) needs no credentials, so they are only loaded by new_http()"""
+        if self.projects_client is None:
+            self.projects_client = self.build_client()
         return self.projects_client
 
-    def set_project(self, credentials):
-        self.projects_client = googleapiclient.discovery.build(
-            'toolresults', 'v1beta3', credentials=self.credentials)
+    def load_discovery_document(self) -> str:
+        """Read the toolresults discovery document from the local cache file, falling back to the
+        static copy bundled with googleapiclient (saved to the cache file for the next run)"""
+        path = self.discovery_document
+        if path in _DISCOVERY_DOCUMENTS:
+            return _DISCOVERY_DOCUMENTS[path]
 
-    def __init__(self, project) -> None:
-        try:
-            if project == FirebaseProjects.MOZ_FENIX.value:
-                gcloud_auth_moz_fenix = os.environ['GCLOUD_AUTH_MOZ_FENIX']
-                self.JSON_CREDENTIAL = json.loads(gcloud_auth_moz_fenix)
-            elif project == FirebaseProjects.MOZ_FOCUS_ANDROID.value:
-                gcloud_auth_moz_focus_android = os.environ['GCLOUD_AUTH_MOZ_FOCUS_ANDROID']
-                self.JSON_CREDENTIAL = json.loads(
-                    gcloud_auth_moz_focus_android)
-            elif project == FirebaseProjects.MOZ_ANDROID_COMPONENTS.value:
-                gcloud_auth_moz_android_components = os.environ['GCLOUD_AUTH_MOZ_ANDROID_COMPONENTS']
-                self.JSON_CREDENTIAL = json.loads(
-                    gcloud_auth_moz_android_components)
-        except KeyError:
-            raise Exception("Please set the GCLOUD_AUTH_MOZ_<project> auth environment variable.")
+        document = None
+        if path and os.path.exists(path):
+            with open(path) as document_file:
+                document = document_file.read()
+        else:
+            from googleapiclient import discovery_cache
+            document = discovery_cache.get_static_doc('toolresults', 'v1beta3')
+            if document and path:
+                if os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as document_file:
+                    document_file.write(document)
+        _DISCOVERY_DOCUMENTS[path] = document
+        return document
+
+    def new_http(self):
+        """A new authorized HTTP transport. Google APIs only gzip responses for user agents
+        containing "gzip", so the transport advertises it. A recording wraps the authorized
+        transport, so token requests (made by the authorization layer) are never recorded"""
+        if self.http is not None:
+            return self.http
+        import google_auth_httplib2
+        from googleapiclient.http import build_http, set_user_agent
+
+        http = google_auth_httplib2.AuthorizedHttp(self.shared_credentials, http=build_http())
+        http = set_user_agent(http, USER_AGENT)
+        if self.record is not None:
+            from lib.replay import RecordingHttp
+            http = RecordingHttp(self.record, http)
+        return http
+
+    def transport(self) -> dict:
+        """The HTTP transport a new client is built with"""
+        return {'http': self.new_http()}
+
+    def build_client(self):
+        """Build a new, independent toolresults client sharing this connection's credentials"""
+        import googleapiclient.discovery
 
+        document = self.load_discovery_document()
+        if document is not None:
+            return googleapiclient.discovery.build_from_document(document, **self.transport())
+        return googleapiclient.discovery.build(
+            'toolresults', 'v1beta3', cache_discovery=False, **self.transport())
+
+    def set_project(self, credentials):
+        self.projects_client = self.build_client()
+
+    def load_credentials(self):
         """Authenticate with Google API"""
-        self.credentials = service_account.Credentials.from_service_account_info(
-            self.JSON_CREDENTIAL)
+        from google.oauth2 import service_account
+
+        if self.project not in CREDENTIAL_VARIABLES:
+            raise Exception("Unknown Firebase project {!r}, expected one of {}.".format(
+                self.project, ', '.join(CREDENTIAL_VARIABLES)))
+        variable = CREDENTIAL_VARIABLES[self.project]
+        if variable not in os.environ:
+            raise Exception("Please set the {} auth environment variable.".format(variable))
+        self.JSON_CREDENTIAL = json.loads(os.environ[variable])
+        return service_account.Credentials.from_service_account_info(self.JSON_CREDENTIAL)
+
+    @property
+    def credentials(self):
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self.load_credentials()
+        return self._credentials
+
+    @property
+    def shared_credentials(self):
+        """The scoped credentials every transport of the pool (and batch requests) authorize with"""
+        from lib.shared_credentials import SharedCredentials
+
+        credentials = self.credentials
+        with self._lock:
+            if self._shared_credentials is None:
+                if getattr(credentials, 'requires_scopes', False):
+                    credentials = credentials.with_scopes([CLOUD_PLATFORM_SCOPE])
+                self._shared_credentials = SharedCredentials(credentials)
+        return self._shared_credentials
+
+    def fork(self) -> 'FirebaseConn':
+        """Return a connection sharing these credentials and transport pool but building its own client"""
+        if self.http is None:
+            self.shared_credentials
+        connection = copy.copy(self)
+        connection.projects_client = None
+        return connection
+
+    def stats(self) -> dict:
+        """Transport pool usage and the number of token refreshes"""
+        stats = self.pool.stats()
+        stats['tokenRefreshes'] = self._shared_credentials.refreshes if self._shared_credentials else 0
+        return stats
 
-        self.set_project(self.credentials)
+    def __init__(self, project, discovery_document: str = None, record: str = None, http=None,
+                 pool_size: int = 8) -> None:
+        """`record` appends every API response to an NDJSON file; `http` replaces the authorized
+        transport altogether, e.g. with a lib.replay.ReplayHttp serving such a recording (it is
+        then shared by the whole pool, so it must be thread-safe)"""
+        self.project = project
+        self.discovery_document = discovery_document or os.environ.get('TOOLRESULTS_DISCOVERY_DOCUMENT')
+        self.record = record
+        self.http = http
+        self.projects_client = None
+        self._credentials = None
+        self._shared_credentials = None
+        self._lock = threading.Lock()
+        self.pool = TransportPool(lambda: MeteredHttp(self.new_http()), pool_size)
@@ -0,0 +1,160 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""An incremental SQLite index of test case outcomes for flakiness analysis"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from lib.records import ExecutionDetails
+
+
+class RunOutcome:
+    """Outcome codes of one test in one execution, across all of its steps (devices and shards)"""
+    PASSED = 0
+    FAILED = 1
+    FLAKY = 2
+
+
+def run_outcome(environments: dict) -> int:
+    """
+    The outcome of a test in an execution, from its statuses in each environment (the dimensions
+    of the steps it ran in). It flaked if it was reported flaky (passed on a retry), or both passed
+    and failed in the same environment: failing on one device and passing on another is a device
+    specific failure. Returns None when it did not run (e.g. was only skipped).
+    """
+    outcome = None
+    for statuses in environments.values():
+        failed = bool(statuses & {'failed', 'error'})
+        if 'flaky' in statuses or (failed and 'passed' in statuses):
+            return RunOutcome.FLAKY
+        if failed:
+            outcome = RunOutcome.FAILED
+        elif 'passed' in statuses and outcome is None:
+            outcome = RunOutcome.PASSED
+    return outcome
+
+
+class FlakyIndex:
+    """
+    Maps each test (project, package, class and name) to one compact row per execution it ran
+    in, with the execution's day and the test's run outcome. The index also keeps a watermark
+    per project and package (with the SyncState get/set/save interface), so each update only
+    adds executions newer than the previous one instead of rescanning the history. Changes are
+    only committed by save(), so an interrupted update never moves the watermark past runs that
+    were not indexed.
+    """
+
+    def __init__(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS tests ('
+            ' id INTEGER PRIMARY KEY, project TEXT, package TEXT, class_name TEXT, name TEXT,'
+            ' UNIQUE (project, package, class_name, name));'
+            'CREATE TABLE IF NOT EXISTS runs ('
+            ' test INTEGER, execution INTEGER, day INTEGER, outcome INTEGER,'
+            ' PRIMARY KEY (test, execution)) WITHOUT ROWID;'
+            'CREATE INDEX IF NOT EXISTS runs_day ON runs (day, test);'
+            'CREATE TABLE IF NOT EXISTS watermarks ('
+            ' project TEXT, package TEXT, creation_time INTEGER, execution TEXT,'
+            ' PRIMARY KEY (project, package));'
+        )
+        self._db.commit()
+        self._test_ids = {}
+
+    def get(self, project: str, package: str) -> dict:
+        """The watermark ({'creationTime': int, 'executionId': str}) of the newest indexed execution, or None"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT creation_time, execution FROM watermarks WHERE project = ? AND package = ?',
+                (project, package)
+            ).fetchone()
+        return {'creationTime': row[0], 'executionId': row[1]} if row else None
+
+    def set(self, project: str, package: str, execution: dict) -> None:
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)',
+                (project, package, int(execution['creationTime']['seconds']), execution['executionId'])
+            )
+
+    def _test_id(self, project: str, package: str, class_name: str, name: str) -> int:
+        key = (project, package, class_name, name)
+        if key not in self._test_ids:
+            self._db.execute(
+                'INSERT OR IGNORE INTO tests (project, package, class_name, name) VALUES (?, ?, ?, ?)', key
+            )
+            self._test_ids[key] = self._db.execute(
+                'SELECT id FROM tests WHERE project = ? AND package = ? AND class_name = ? AND name = ?', key
+            ).fetchone()[0]
+        return self._test_ids[key]
+
+    def add(self, project: str, package: str, details: ExecutionDetails) -> int:
+        """Index the test cases of an execution (all of its steps' cases should have been fetched);
+        returns the number of tests recorded"""
+        environments = {step.stepId: step.dimensions for step in details.steps}
+        statuses = {}
+        for step_id, cases in details.testCases.items():
+            environment = environments.get(step_id, step_id)
+            for case in cases:
+                test = statuses.setdefault((case.className, case.name), {})
+                test.setdefault(environment, set()).add(case.status)
+        day = details.execution.creationTime // 86400
+        execution = int(details.execution.executionId)
+        with self._lock:
+            rows = [
+                (self._test_id(project, package, class_name, name), execution, day, outcome)
+                for (class_name, name), test_environments in statuses.items()
+                if (outcome := run_outcome(test_environments)) is not None
+            ]
+            self._db.executemany('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def flaky_tests(self, project: str, package: str, days: int = 14, limit: int = 10, min_runs: int = 3,
+                    now: int = None) -> list:
+        """The tests with the highest flake rate (flaky runs / runs) over the past `days`"""
+        since = int(time.time() if now is None else now) // 86400 - days
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT tests.class_name, tests.name, COUNT(*) AS run_count,'
+                ' SUM(runs.outcome = ?) AS flakes, SUM(runs.outcome = ?) AS failures, MAX(runs.day) AS last_day'
+                ' FROM runs JOIN tests ON tests.id = runs.test'
+                ' WHERE tests.project = ? AND tests.package = ? AND runs.day > ?'
+                ' GROUP BY runs.test HAVING run_count >= ? AND flakes > 0'
+                ' ORDER BY CAST(flakes AS REAL) / run_count DESC, flakes DESC LIMIT ?',
+                (RunOutcome.FLAKY, RunOutcome.FAILED, project, package, since, min_runs, limit)
+            ).fetchall()
+        return [
+            {
+                'testCase': {'className': class_name, 'name': name},
+                'runs': runs,
+                'flakes': flakes,
+                'failures': failures,
+                'flakeRate': round(flakes / runs, 4),
+                'lastSeen': time.strftime('%Y-%m-%d', time.gmtime(last_day * 86400)),
+            }
+            for class_name, name, runs, flakes, failures, last_day in rows
+        ]
+
+    def prune(self, days: int, now: int = None) -> None:
+        """Drop runs older than `days`"""
+        since = int(time.time() if now is None else now) // 86400 - days
+        with self._lock:
+            self._db.execute('DELETE FROM runs WHERE day <= ?', (since,))
+
+    def save(self) -> None:
+        with self._lock:
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
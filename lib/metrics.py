@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Per-endpoint ToolResults API call metrics"""
+
+import json
+import threading
+import time
+
+"""Upper bounds (seconds) of the latency histogram buckets"""
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class EndpointMetrics:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = {}
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.response_bytes = 0
+
+    def record(self, seconds: float, size: int, error: Exception) -> None:
+        self.calls += 1
+        self.latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        self.buckets[next(i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound)] += 1
+        self.response_bytes += size
+        if error is not None:
+            name = type(error).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {
+            'calls': self.calls,
+            'errors': dict(self.errors),
+            'latency': {
+                'sum': round(self.latency_sum, 6),
+                'mean': round(self.latency_sum / self.calls, 6) if self.calls else 0.0,
+                'max': round(self.latency_max, 6),
+                'buckets': {
+                    ('+Inf' if bound == float('inf') else str(bound)): count
+                    for bound, count in zip(LATENCY_BUCKETS, self.buckets)
+                },
+            },
+            'responseBytes': self.response_bytes,
+        }
+
+
+class ApiMetrics:
+    """
+    Thread-safe call counts, latency histograms, response sizes (bytes received) and
+    errors for each endpoint, e.g. 'steps.list'. Comparing the summed API latency
+    with the elapsed time shows whether a slow run is spent waiting on the API,
+    making too many calls, or processing locally.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.endpoints = {}
+        self.connections = {}
+        self._lock = threading.Lock()
+
+    def add_connection(self, name: str, connection) -> None:
+        """Report the transport pool and token refresh stats() of a connection (forks share them)"""
+        with self._lock:
+            self.connections[name] = connection
+
+    def record(self, endpoint: str, seconds: float, size: int = 0, error: Exception = None) -> None:
+        with self._lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = EndpointMetrics()
+            self.endpoints[endpoint].record(seconds, size, error)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            endpoints = {name: metrics.snapshot() for name, metrics in sorted(self.endpoints.items())}
+            connections = dict(self.connections)
+        return {
+            'elapsedSeconds': round(time.perf_counter() - self.started, 6),
+            'apiSeconds': round(sum(endpoint['latency']['sum'] for endpoint in endpoints.values()), 6),
+            'calls': sum(endpoint['calls'] for endpoint in endpoints.values()),
+            'responseBytes': sum(endpoint['responseBytes'] for endpoint in endpoints.values()),
+            'endpoints': endpoints,
+            'connections': {name: connection.stats() for name, connection in sorted(connections.items())},
+        }
+
+    def write(self, path: str) -> None:
+        try:
+            with open(path, 'w') as outfile:
+                json.dump(self.snapshot(), outfile, indent=4)
+                print('Metrics written to [{}]'.format(outfile.name), end='\n\n')
+        except OSError as e:
+            raise SystemExit(e)
@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""A SQLite store of performance results per commit, compared against a rolling median/MAD baseline"""
+
+import os
+import sqlite3
+import time
+import warnings
+
+import numpy as np
+
+"""Scales the median absolute deviation to a standard deviation for normally distributed values"""
+MAD_SCALE = 1.4826
+
+
+class Change:
+    """Labels of a metric that moved beyond the thresholds"""
+    REGRESSED = 'regressed'
+    IMPROVED = 'improved'
+
+
+def _number(value) -> float:
+    """A measurement as a float (numbers and numeric strings alike), or None when it is not one"""
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PerfBaseline:
+    """
+    Every (test, metric) pair gets a dense column index, and each commit's results are stored
+    as one row holding a float64 vector over those columns (NaN where a metric was not
+    reported). Loading a window of commits is then a handful of rows turned into a
+    commits x metrics matrix, and the comparison runs over whole columns at once.
+    """
+
+    def __init__(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS metrics ('
+            ' id INTEGER PRIMARY KEY, test TEXT, metric TEXT, UNIQUE (test, metric));'
+            'CREATE TABLE IF NOT EXISTS runs ('
+            ' id INTEGER PRIMARY KEY, revision TEXT UNIQUE, recorded INTEGER, metric_values BLOB);'
+        )
+        self._db.commit()
+        self._columns = {
+            (test, metric): column
+            for column, test, metric in self._db.execute('SELECT id - 1, test, metric FROM metrics')
+        }
+
+    @property
+    def metrics(self) -> list:
+        """The (test, metric) pair of every column"""
+        names = [None] * len(self._columns)
+        for name, column in self._columns.items():
+            names[column] = name
+        return names
+
+    def _column(self, test: str, metric: str) -> int:
+        key = (test, metric)
+        if key not in self._columns:
+            cursor = self._db.execute('INSERT INTO metrics (id, test, metric) VALUES (?, ?, ?)',
+                                      (len(self._columns) + 1, test, metric))
+            self._columns[key] = cursor.lastrowid - 1
+        return self._columns[key]
+
+    def add(self, revision: str, records) -> int:
+        """Store the numeric measurements of result records ({'testName': ..., <metric>: value}) for
+        a revision, replacing any stored earlier for it; returns the number of values stored"""
+        columns, values = [], []
+        for record in records:
+            test = record.get('testName')
+            for metric, value in record.items():
+                if metric != 'testName' and (number := _number(value)) is not None:
+                    columns.append(self._column(test, metric))
+                    values.append(number)
+        vector = np.full(len(self._columns), np.nan)
+        vector[np.array(columns, dtype=np.int64)] = values
+        self._db.execute(
+            'INSERT INTO runs (revision, recorded, metric_values) VALUES (?, ?, ?)'
+            ' ON CONFLICT (revision) DO UPDATE SET'
+            ' recorded = excluded.recorded, metric_values = excluded.metric_values',
+            (revision, int(time.time()), vector.tobytes())
+        )
+        self._db.commit()
+        return len(values)
+
+    def _matrix(self, rows: list) -> np.ndarray:
+        """Stack stored vectors into a runs x metrics matrix; older runs lack later columns"""
+        matrix = np.full((len(rows), len(self._columns)), np.nan)
+        for index, (blob,) in enumerate(rows):
+            vector = np.frombuffer(blob, dtype=np.float64)
+            matrix[index, :len(vector)] = vector
+        return matrix
+
+    def values(self, revision: str) -> np.ndarray:
+        """The stored vector of a revision, or None"""
+        rows = self._db.execute('SELECT metric_values FROM runs WHERE revision = ?', (revision,)).fetchall()
+        return self._matrix(rows)[0] if rows else None
+
+    def history(self, revision: str = None, window: int = 20) -> np.ndarray:
+        """The vectors of the `window` runs stored before `revision` (by default, the latest runs)"""
+        if revision is None:
+            rows = self._db.execute('SELECT metric_values FROM runs ORDER BY id DESC LIMIT ?', (window,)).fetchall()
+        else:
+            rows = self._db.execute(
+                'SELECT metric_values FROM runs WHERE id < (SELECT id FROM runs WHERE revision = ?)'
+                ' ORDER BY id DESC LIMIT ?',
+                (revision, window)
+            ).fetchall()
+        return self._matrix(rows)
+
+    def compare(self, revision: str, window: int = 20, threshold: float = 0.1, min_deviations: float = 3.0,
+                min_runs: int = 5, higher_is_better: set = frozenset()) -> dict:
+        """
+        Compare a stored revision with the median of the `window` runs before it. A metric changed
+        when it is off the median by more than `threshold` (a fraction of it) and by more than
+        `min_deviations` scaled MADs, with at least `min_runs` earlier values. Metrics named in
+        `higher_is_better` improve upwards, all others (durations, memory...) downwards.
+        Returns {(test, metric): {'change', 'value', 'baseline', 'delta', 'deviations'}}.
+        """
+        current = self.values(revision)
+        if current is None:
+            raise KeyError('No results stored for {}'.format(revision))
+        history = self.history(revision, window)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            median = np.nanmedian(history, axis=0) if len(history) else np.full(len(current), np.nan)
+            spread = MAD_SCALE * np.nanmedian(np.abs(history - median), axis=0) if len(history) else median
+            delta = (current - median) / np.abs(median)
+            deviations = np.abs(current - median) / spread
+        runs = np.count_nonzero(~np.isnan(history), axis=0)
+        changed = (
+            (runs >= min_runs) & ~np.isnan(current) & (median != 0)
+            & (np.abs(delta) > threshold) & (deviations > min_deviations)
+        )
+
+        names = self.metrics
+        higher_better = np.array([metric in higher_is_better for _, metric in names], dtype=bool)
+        improved = (delta > 0) == higher_better
+        return {
+            names[column]: {
+                'change': Change.IMPROVED if improved[column] else Change.REGRESSED,
+                'value': float(current[column]),
+                'baseline': float(median[column]),
+                'delta': float(delta[column]),
+                'deviations': float(deviations[column]),
+            }
+            for column in np.flatnonzero(changed)
+        }
+
+    def prune(self, keep: int) -> None:
+        """Drop all but the latest `keep` runs"""
+        self._db.execute('DELETE FROM runs WHERE id NOT IN (SELECT id FROM runs ORDER BY id DESC LIMIT ?)', (keep,))
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
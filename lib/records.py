@@ -0,0 +1,203 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Compact records of the ToolResults resources, keeping only the fields the reports read"""
+
+import sys
+from itertools import zip_longest
+
+"""Interned dimension tuples: the steps and environments of a history share a handful of them"""
+_DIMENSIONS = {}
+
+"""Test issue types reporting that the app under test crashed or stopped responding"""
+CRASH_ISSUE_TYPES = frozenset({'anr', 'crashDialogError', 'fatalException', 'iosCrash', 'iosException', 'nativeCrash'})
+
+"""Lines of a crash's stack trace kept on its step: the exception and its top frames"""
+CRASH_TRACE_LINES = 8
+
+
+def dimensions(resource: dict) -> tuple:
+    """The (key, value) dimensions of a step or environment, in a hashable order-independent form"""
+    key = tuple(sorted((dimension['key'], dimension['value']) for dimension in resource.get('dimensionValue', [])))
+    return _DIMENSIONS.setdefault(key, key)
+
+
+def _seconds(duration: dict) -> int:
+    return int(duration['seconds']) if duration and 'seconds' in duration else None
+
+
+def _intern(value: str) -> str:
+    return sys.intern(value) if value is not None else None
+
+
+def _crash(issue: dict) -> tuple:
+    """The (type, top of the stack trace or else error message) of a crash test issue"""
+    trace = issue.get('stackTrace', {}).get('exception') or issue.get('errorMessage')
+    return _intern(issue['type']), '\n'.join(trace.splitlines()[:CRASH_TRACE_LINES]) if trace else None
+
+
+class Record:
+    """
+    A resource parsed once from its API response into __slots__. FIELDS is the serialized
+    form used by the cache; fields added since an entry was cached are None. `raw` is the
+    full response, only kept when asked for.
+    """
+    __slots__ = ('raw',)
+    FIELDS = ()
+
+    def __init__(self, *values, raw: dict = None) -> None:
+        for name, value in zip_longest(self.FIELDS, values):
+            setattr(self, name, value)
+        self.raw = raw
+
+    def to_list(self) -> list:
+        return [getattr(self, name) for name in self.FIELDS]
+
+    @classmethod
+    def from_list(cls, values: list) -> 'Record':
+        return cls(*values)
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.to_list() == other.to_list()
+
+    def __repr__(self) -> str:
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(name, getattr(self, name)) for name in self.FIELDS))
+
+
+class Execution(Record):
+    __slots__ = FIELDS = ('executionId', 'state', 'creationTime', 'outcome', 'matrixId')
+
+    @classmethod
+    def from_response(cls, response: dict, keep_raw: bool = False) -> 'Execution':
+        return cls(
+            response['executionId'],
+            _intern(response.get('state')),
+            _seconds(response.get('creationTime')),
+            _intern(response.get('outcome', {}).get('summary')),
+            response.get('testExecutionMatrixId'),
+            raw=response if keep_raw else None
+        )
+
+
+class Step(Record):
+    __slots__ = FIELDS = (
+        'stepId', 'creationTime', 'outcome', 'crashed', 'dimensions', 'duration', 'issueTypes', 'crashes'
+    )
+
+    @classmethod
+    def from_response(cls, response: dict, keep_raw: bool = False) -> 'Step':
+        outcome = response.get('outcome', {})
+        test_step = response.get('testExecutionStep', {})
+        return cls(
+            response['stepId'],
+            _seconds(response.get('creationTime')),
+            _intern(outcome.get('summary')),
+            bool(outcome.get('failureDetail', {}).get('crashed')),
+            dimensions(response),
+            _seconds(test_step.get('testTiming', {}).get('testProcessDuration')),
+            tuple(_intern(issue['type']) for issue in test_step.get('testIssues', []) if 'type' in issue),
+            tuple(_crash(issue) for issue in test_step.get('testIssues', [])
+                  if issue.get('type') in CRASH_ISSUE_TYPES),
+            raw=response if keep_raw else None
+        )
+
+    @classmethod
+    def from_list(cls, values: list) -> 'Step':
+        """Entries cached before the crashes were kept have none"""
+        step_id, created, outcome, crashed, dims, duration, issues, crashes = (list(values) + [None])[:8]
+        dims = tuple(map(tuple, dims))
+        if crashes is not None:
+            crashes = tuple((_intern(issue_type), trace) for issue_type, trace in crashes)
+        return cls(step_id, created, _intern(outcome), crashed, _DIMENSIONS.setdefault(dims, dims), duration,
+                   tuple(map(_intern, issues)), crashes)
+
+
+class Environment(Record):
+    __slots__ = FIELDS = ('environmentId', 'outcome', 'dimensions')
+
+    @classmethod
+    def from_response(cls, response: dict, keep_raw: bool = False) -> 'Environment':
+        return cls(
+            response.get('environmentId'),
+            _intern(response.get('environmentResult', {}).get('outcome', {}).get('summary')),
+            dimensions(response),
+            raw=response if keep_raw else None
+        )
+
+    @classmethod
+    def from_list(cls, values: list) -> 'Environment':
+        environment_id, outcome, dims = values
+        dims = tuple(map(tuple, dims))
+        return cls(environment_id, _intern(outcome), _DIMENSIONS.setdefault(dims, dims))
+
+
+class TestCase(Record):
+    """Test names repeat across executions, so they are interned along with the statuses"""
+    __slots__ = FIELDS = ('testCaseId', 'status', 'name', 'className', 'elapsed')
+
+    @classmethod
+    def from_response(cls, response: dict, keep_raw: bool = False) -> 'TestCase':
+        reference = response.get('testCaseReference', {})
+        return cls(
+            response.get('testCaseId'),
+            _intern(response.get('status')),
+            _intern(reference.get('name')),
+            _intern(reference.get('className')),
+            _seconds(response.get('elapsedTime')),
+            raw=response if keep_raw else None
+        )
+
+    @classmethod
+    def from_list(cls, values: list) -> 'TestCase':
+        test_case_id, status, name, class_name, *elapsed = values
+        return cls(test_case_id, _intern(status), _intern(name), _intern(class_name), *elapsed)
+
+    @property
+    def reference(self) -> dict:
+        return {'name': self.name, 'className': self.className}
+
+
+class ExecutionDetails:
+    """An execution with its steps, environments and the test cases fetched for some of its steps"""
+    __slots__ = ('execution', 'steps', 'environments', 'testCases')
+
+    def __init__(self, execution: Execution, steps: list, environments: list, test_cases: dict = None) -> None:
+        self.execution = execution
+        self.steps = steps
+        self.environments = environments
+        self.testCases = test_cases if test_cases is not None else {}
+
+    @classmethod
+    def from_responses(cls, execution: dict, steps: dict, environments: dict,
+                       keep_raw: bool = False) -> 'ExecutionDetails':
+        """Parse an execution and its steps and environments list responses"""
+        return cls(
+            Execution.from_response(execution, keep_raw),
+            [Step.from_response(step, keep_raw) for step in steps.get('steps', [])],
+            [Environment.from_response(environment, keep_raw) for environment in environments.get('environments', [])]
+        )
+
+    def add_test_cases(self, step_id: str, test_cases: dict, keep_raw: bool = False) -> None:
+        """Parse a test cases list response of one of the steps"""
+        self.testCases[step_id] = [TestCase.from_response(case, keep_raw) for case in test_cases.get('testCases', [])]
+
+    def to_dict(self) -> dict:
+        """The JSON-serializable form of everything but the execution, as stored in the cache"""
+        return {
+            'steps': [step.to_list() for step in self.steps],
+            'environments': [environment.to_list() for environment in self.environments],
+            'testCases': {step_id: [case.to_list() for case in cases] for step_id, cases in self.testCases.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, execution: Execution, value: dict) -> 'ExecutionDetails':
+        return cls(
+            execution,
+            [Step.from_list(step) for step in value['steps']],
+            [Environment.from_list(environment) for environment in value['environments']],
+            {step_id: [TestCase.from_list(case) for case in cases] for step_id, cases in value['testCases'].items()}
+        )
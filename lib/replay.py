@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Record ToolResults HTTP responses to a file and replay them offline through FirebaseConn"""
+
+import json
+import threading
+import time
+
+
+def _key(uri: str, method: str) -> str:
+    return '{} {}'.format(method.upper(), uri)
+
+
+"""The lock and (line buffered) file of each recording, shared by all the transports appending to it"""
+_RECORDINGS = {}
+_RECORDINGS_LOCK = threading.Lock()
+
+
+def _recording(path: str) -> tuple:
+    with _RECORDINGS_LOCK:
+        if path not in _RECORDINGS:
+            _RECORDINGS[path] = (threading.Lock(), open(path, 'a', buffering=1))
+        return _RECORDINGS[path]
+
+
+class RecordingHttp:
+    """
+    Wraps an httplib2.Http and appends every response to an NDJSON recording. Wrap the
+    authorized transport rather than the one it authorizes, or token responses get recorded.
+    """
+
+    def __init__(self, path: str, http=None) -> None:
+        if http is None:
+            import httplib2
+            http = httplib2.Http()
+        self.path = path
+        self.http = http
+        self._lock, self._recording = _recording(path)
+
+    def request(self, uri: str, method: str = 'GET', body=None, headers=None, **kwargs):
+        response, content = self.http.request(uri, method, body=body, headers=headers, **kwargs)
+        text = content.decode('utf-8') if isinstance(content, bytes) else content
+        line = json.dumps({'key': _key(uri, method), 'status': response.status, 'content': text}) + '\n'
+        with self._lock:
+            self._recording.write(line)
+        return response, content
+
+    def __getattr__(self, name: str):
+        """Anything else (timeout, credentials, close...) goes to the wrapped transport"""
+        return getattr(self.http, name)
+
+
+class ReplayHttp:
+    """
+    An httplib2.Http stand-in answering requests from a recording, with an optional
+    simulated latency. Requests that were not recorded get a 404. Batch requests are
+    not replayable since their multipart boundaries change on every run.
+    """
+
+    def __init__(self, path: str, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls = 0
+        self.timeout = None
+        self.responses = {}
+        with open(path) as recording:
+            for line in recording:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.responses[entry['key']] = (entry['status'], entry['content'])
+        self._lock = threading.Lock()
+
+    def request(self, uri: str, method: str = 'GET', body=None, headers=None, **kwargs):
+        import httplib2
+
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        status, content = self.responses.get(
+            _key(uri, method),
+            (404, json.dumps({'error': {'code': 404, 'message': 'Not recorded: {}'.format(uri)}}))
+        )
+        response = httplib2.Response({'status': status, 'content-type': 'application/json; charset=UTF-8'})
+        return response, content.encode('utf-8')
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Rate limiting, in-flight cap and retries for ToolResults API (and Slack webhook) requests"""
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def error_status(exception: Exception) -> int:
+    """The HTTP status of a googleapiclient, requests or aiohttp HTTP error, or None for any other exception"""
+    response = getattr(exception, 'response', None)
+    if response is not None:
+        return getattr(response, 'status_code', None)
+    if hasattr(exception, 'resp'):
+        return getattr(exception.resp, 'status', None)
+    return getattr(exception, 'status', None)
+
+
+def retry_after(exception: Exception) -> float:
+    """Seconds to wait according to the Retry-After header of an HttpError (delay or HTTP date), if any"""
+    response = getattr(exception, 'response', None)
+    if response is not None:
+        resp = response.headers
+    else:
+        resp = getattr(exception, 'resp', getattr(exception, 'headers', None))
+    value = resp.get('retry-after') if hasattr(resp, 'get') else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `capacity`; a rate of None never waits"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Take `tokens` without waiting, and return how long to wait before using them.
+        Tokens are reserved up front, so concurrent callers queue up instead of racing for refills."""
+        if self.rate is None:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Take `tokens`, sleeping until the bucket has refilled enough; returns the time waited"""
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class RequestScheduler:
+    """
+    Shared by every Firebase client (and worker thread) of a process: requests to a project
+    draw from that project's token bucket, at most `max_in_flight` run at once, and those
+    failing with a retryable status are retried with exponential backoff and full jitter,
+    waiting at least as long as the server's Retry-After asks.
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 20, max_in_flight: int = 8, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 60.0) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self._buckets = {}
+        self._in_flight = threading.BoundedSemaphore(max(1, max_in_flight))
+        self._lock = threading.Lock()
+
+    def bucket(self, project: str) -> TokenBucket:
+        with self._lock:
+            if project not in self._buckets:
+                self._buckets[project] = TokenBucket(self.rate, self.burst)
+            return self._buckets[project]
+
+    def backoff(self, attempt: int, exception: Exception = None) -> float:
+        """Seconds to wait before retry number `attempt` (from 0)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        server_delay = retry_after(exception) if exception is not None else None
+        return delay if server_delay is None else max(delay, server_delay)
+
+    def _retry_delay(self, attempt: int, exception: Exception = None) -> float:
+        delay = self.backoff(attempt, exception)
+        with self._lock:
+            self.retries += 1
+            self.throttled_seconds += delay
+        return delay
+
+    def wait(self, attempt: int, exception: Exception = None) -> None:
+        time.sleep(self._retry_delay(attempt, exception))
+
+    def execute(self, project: str, call: Callable, cost: int = 1):
+        """Run call() once `cost` tokens of the project's quota and an in-flight slot are available,
+        retrying on a retryable HTTP status"""
+        for attempt in range(self.max_retries + 1):
+            waited = self.bucket(project).acquire(cost)
+            with self._lock:
+                self.throttled_seconds += waited
+            with self._in_flight:
+                try:
+                    return call()
+                except Exception as e:
+                    if error_status(e) not in RETRYABLE_STATUS or attempt == self.max_retries:
+                        raise
+                    exception = e
+            self.wait(attempt, exception)
+
+    async def execute_async(self, project: str, call: Callable, cost: int = 1):
+        """The coroutine counterpart of execute(): await call() within the project's quota, retrying on a
+        retryable HTTP status, with every wait an asyncio sleep. Asyncio clients cap the requests in
+        flight on their own event loop, so the (thread) in-flight slots are not used"""
+        for attempt in range(self.max_retries + 1):
+            waited = self.bucket(project).reserve(cost)
+            if waited:
+                with self._lock:
+                    self.throttled_seconds += waited
+                await asyncio.sleep(waited)
+            try:
+                return await call()
+            except Exception as e:
+                if error_status(e) not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    raise
+                exception = e
+            await asyncio.sleep(self._retry_delay(attempt, exception))
@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""A long-running report service: warm clients polled on a schedule, reports served over local HTTP"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from firebase import ONE_DAY, ExecutionOutcome, FirebaseHelper, write_JSON
+from lib.crashes import CrashIndex
+from lib.flaky import FlakyIndex
+from lib.metrics import ApiMetrics
+from lib.scheduler import RequestScheduler
+from lib.sync_state import SyncState
+
+
+def _timestamp(seconds: float) -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds)) if seconds else None
+
+
+class TargetReport:
+    """
+    The step count of one project and package over a rolling window, kept up to date
+    incrementally: each poll only syncs the executions settled since the previous one
+    (with an in-memory watermark), adds their step counts and drops those that aged out.
+    In all_histories mode the histories are listed again on every poll, so new ones are picked up.
+    """
+
+    def __init__(self, helper: FirebaseHelper, window: int = ONE_DAY) -> None:
+        self.helper = helper
+        self.window = window
+        self.state = SyncState()
+        self.history_ids = None
+        """(historyId, executionId) -> (creation time, step count) of the matching executions in the window"""
+        self.step_counts = {}
+        self.payload = None
+        self.polled = None
+        self.error = None
+
+    def _sync(self, history_id: str, now: int) -> None:
+        """The step counts only join the report, and the watermark only moves, once every execution was counted"""
+        settled, watermark = self.helper.sync_executions(history_id, self.state, since=now - self.window)
+        step_counts = {
+            (history_id, execution['executionId']): (
+                int(execution['creationTime']['seconds']), self.helper.count_steps(history_id, execution)
+            )
+            for execution in settled
+            if execution['outcome']['summary'] == ExecutionOutcome.SUCCESS.value
+        }
+        self.step_counts.update(step_counts)
+        self.helper.commit_watermark(history_id, self.state, watermark)
+
+    def poll(self, now: int) -> dict:
+        if self.history_ids is None or self.helper.all_histories:
+            self.history_ids = self.helper.history_ids()
+        self.helper.map_histories(lambda history_id: self._sync(history_id, now), self.history_ids)
+        self.step_counts = {
+            key: (created, count)
+            for key, (created, count) in self.step_counts.items()
+            if created >= now - self.window
+        }
+        return self.helper.build_payload(sum(count for _, count in self.step_counts.values()))
+
+
+class ReportService:
+    """
+    Polls every target every `interval` seconds on the same warm helpers (so the credentials,
+    API clients, caches and watermarks outlive each poll) and keeps the latest report in
+    memory. A target whose poll fails keeps its previous payload until the next one succeeds.
+    """
+
+    def __init__(self, helpers: dict, metrics: ApiMetrics, scheduler: RequestScheduler, interval: float = 300,
+                 window: int = ONE_DAY, flaky: FlakyIndex = None, flaky_days: int = 14,
+                 crashes: CrashIndex = None, crash_days: int = 14, top_crashes: int = 10,
+                 output: str = 'payload.json') -> None:
+        self.targets = {target: TargetReport(helper, window) for target, helper in helpers.items()}
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self.interval = interval
+        self.flaky = flaky
+        self.flaky_days = flaky_days
+        self.crashes = crashes
+        self.crash_days = crash_days
+        self.top_crashes = top_crashes
+        self.output = output
+        self.started = time.time()
+        self.polls = 0
+        self.last_poll = None
+        self.last_poll_seconds = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.targets)))
+
+    def _poll_target(self, target: TargetReport, now: int) -> None:
+        try:
+            payload = target.poll(now)
+            if self.flaky is not None:
+                target.helper.update_flaky_index(self.flaky, since=now - self.flaky_days * ONE_DAY)
+                payload['flakyTests'] = target.helper.get_flaky_tests(self.flaky, self.flaky_days)
+            if self.crashes is not None:
+                target.helper.update_crash_index(self.crashes, since=now - self.crash_days * ONE_DAY)
+                payload['topCrashes'] = target.helper.get_top_crashes(self.crashes, self.crash_days, self.top_crashes)
+            target.payload, target.polled, target.error = payload, time.time(), None
+        except Exception as e:
+            print(f"Polling {target.helper.firebase.projectId} {target.helper.firebase.filterByName} failed: {e!r}")
+            target.error = repr(e)
+
+    def poll(self) -> list:
+        """Update every target concurrently and return the report"""
+        start = time.time()
+        list(self._executor.map(lambda target: self._poll_target(target, int(start)), self.targets.values()))
+        if self.flaky is not None:
+            self.flaky.save()
+        if self.crashes is not None:
+            self.crashes.save()
+        with self._lock:
+            self.polls += 1
+            self.last_poll = time.time()
+            self.last_poll_seconds = self.last_poll - start
+        report = self.report()
+        if self.output:
+            write_JSON(report, self.output)
+        return report
+
+    def run(self, stop: threading.Event) -> None:
+        """Poll until `stop` is set, every `interval` seconds from the start of the previous poll"""
+        while not stop.is_set():
+            started = time.monotonic()
+            self.poll()
+            stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def report(self) -> list:
+        return [target.payload for target in self.targets.values() if target.payload is not None]
+
+    def health(self) -> dict:
+        """Healthy once every target has been polled, as long as none has gone three intervals without success"""
+        now = time.time()
+        stale = [
+            '{}:{}'.format(*name) for name, target in self.targets.items()
+            if target.polled is None or now - target.polled > 3 * self.interval
+        ]
+        return {
+            'status': 'ok' if not stale else 'starting' if not self.polls else 'stale',
+            'uptimeSeconds': round(now - self.started, 3),
+            'polls': self.polls,
+            'lastPoll': _timestamp(self.last_poll),
+            'lastPollSeconds': round(self.last_poll_seconds, 3) if self.last_poll_seconds is not None else None,
+            'staleTargets': stale,
+            'errors': {
+                '{}:{}'.format(*name): target.error for name, target in self.targets.items() if target.error
+            },
+        }
+
+    def snapshot(self) -> dict:
+        """The API call metrics, plus the scheduler's retries and throttling"""
+        snapshot = self.metrics.snapshot()
+        snapshot['retries'] = self.scheduler.retries
+        snapshot['throttledSeconds'] = round(self.scheduler.throttled_seconds, 3)
+        return snapshot
+
+    def serve(self, host: str = '127.0.0.1', port: int = 8000) -> ThreadingHTTPServer:
+        """An HTTP server (not yet started) for GET /report, /health and /metrics"""
+        httpd = ThreadingHTTPServer((host, port), _ReportHandler)
+        httpd.daemon_threads = True
+        httpd.service = self
+        return httpd
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        for target in self.targets.values():
+            target.helper.fetcher.close()
+
+
+class _ReportHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        service = self.server.service
+        path = self.path.split('?', 1)[0].rstrip('/')
+        status = 200
+        if path == '/report':
+            body = service.report()
+        elif path == '/health':
+            body = service.health()
+            status = 200 if body['status'] == 'ok' else 503
+        elif path == '/metrics':
+            body = service.snapshot()
+        else:
+            body = {'error': 'Not found; try /report, /health or /metrics'}
+            status = 404
+        content = json.dumps(body, indent=4).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
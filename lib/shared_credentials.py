@@ -0,0 +1,63 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Credentials shared by every transport of a connection (kept apart so google.auth is only imported on use)"""
+
+import threading
+
+from google.auth import credentials
+
+
+class SharedCredentials(credentials.Credentials):
+    """
+    The scoped credentials of every transport of a connection (and its forks). Tokens are
+    refreshed by one thread at a time, and threads that waited on a refresh reuse its token
+    instead of each requesting their own. Being google.auth credentials, they also authorize
+    googleapiclient batch requests, which check and apply credentials themselves.
+    """
+
+    def __init__(self, wrapped: credentials.Credentials) -> None:
+        self.credentials = wrapped
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        super().__init__()
+
+    """
+    The wrapped credentials own the token and its expiry: the base class initializer resets
+    them, which must not clear a token the wrapped credentials already hold
+    """
+    @property
+    def token(self):
+        return self.credentials.token
+
+    @token.setter
+    def token(self, value) -> None:
+        pass
+
+    @property
+    def expiry(self):
+        return self.credentials.expiry
+
+    @expiry.setter
+    def expiry(self, value) -> None:
+        pass
+
+    @property
+    def quota_project_id(self):
+        return self.credentials.quota_project_id
+
+    def refresh(self, request) -> None:
+        token = self.credentials.token
+        with self._lock:
+            if self.credentials.token != token and self.credentials.valid:
+                return
+            self.credentials.refresh(request)
+            self.refreshes += 1
+
+    def __getattr__(self, name: str):
+        if name == 'credentials':
+            raise AttributeError(name)
+        return getattr(self.credentials, name)
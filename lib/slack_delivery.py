@@ -0,0 +1,151 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Slack incoming webhook delivery: pooled connections, message chunking, rate limiting and retries"""
+
+import json
+import os
+from enum import Enum
+
+from lib.scheduler import RequestScheduler
+
+
+class SlackLimits(Enum):
+    """Block Kit limits of a single message"""
+    MAX_BLOCKS = 50
+    MAX_SECTION_CHARS = 3000
+    MAX_FIELDS = 10
+    MAX_FIELD_CHARS = 2000
+    """Of the serialized blocks; Slack truncates message text past 40,000 characters"""
+    MAX_MESSAGE_CHARS = 40000
+
+
+"""Incoming webhooks accept about one message per second, with short bursts"""
+WEBHOOK_RATE = 1.0
+WEBHOOK_BURST = 3
+
+
+def split_text(text: str, limit: int) -> list:
+    """Split text into pieces of at most `limit` characters, at line breaks where possible"""
+    pieces = []
+    while len(text) > limit:
+        end = text.rfind('\n', 0, limit + 1)
+        if end <= 0:
+            end = limit
+        pieces.append(text[:end])
+        text = text[end:].lstrip('\n')
+    return pieces + [text] if text or not pieces else pieces
+
+
+def split_block(block: dict) -> list:
+    """A section block as one or more sections within the text and fields limits; other blocks as is"""
+    text, fields = block.get('text'), block.get('fields', [])
+    if block.get('type') != 'section' or (
+            (text is None or len(text['text']) <= SlackLimits.MAX_SECTION_CHARS.value)
+            and len(fields) <= SlackLimits.MAX_FIELDS.value
+            and all(len(field['text']) <= SlackLimits.MAX_FIELD_CHARS.value for field in fields)):
+        return [block]
+    """Block IDs must stay unique, so the pieces go without one"""
+    section = {key: value for key, value in block.items() if key not in {'text', 'fields', 'block_id'}}
+    blocks = [
+        dict(section, text=dict(text, text=piece))
+        for piece in (split_text(text['text'], SlackLimits.MAX_SECTION_CHARS.value) if text is not None else [])
+    ]
+    fields = [
+        dict(field, text=piece)
+        for field in fields
+        for piece in split_text(field['text'], SlackLimits.MAX_FIELD_CHARS.value)
+    ]
+    max_fields = SlackLimits.MAX_FIELDS.value
+    blocks.extend(dict(section, fields=fields[start:start + max_fields]) for start in range(0, len(fields), max_fields))
+    return blocks
+
+
+def _size(blocks: list) -> int:
+    return len(json.dumps(blocks))
+
+
+def chunk_blocks(blocks: list, header: list = (), footer: list = ()) -> list:
+    """
+    Pack header + blocks + footer into as few messages as the block and character limits allow.
+    The header opens the first message and the footer closes the last one; oversized sections
+    are split first. Returns a list of block lists, one per message.
+    """
+    header, footer = list(header), list(footer)
+    max_blocks, max_chars = SlackLimits.MAX_BLOCKS.value, SlackLimits.MAX_MESSAGE_CHARS.value
+    body = [piece for block in blocks for piece in split_block(block)]
+    messages = []
+    current, size = header, _size(header)
+    for block in body:
+        block_size = _size([block])
+        if current and (len(current) + 1 > max_blocks or size + block_size > max_chars):
+            messages.append(current)
+            current, size = [], 2
+        current.append(block)
+        size += block_size + 2
+    if current and (len(current) + len(footer) > max_blocks or size + _size(footer) > max_chars):
+        messages.append(current)
+        current = []
+    messages.append(current + footer)
+    return [message for message in messages if message]
+
+
+def load_payloads(paths: list) -> list:
+    """The client.py payloads of several payload.json files (single or multi-target runs), as one list"""
+    payloads = []
+    for path in paths:
+        with open(path) as data_file:
+            dataset = json.load(data_file)
+        payloads.extend(dataset if isinstance(dataset, list) else [dataset])
+    return payloads
+
+
+class SlackDelivery:
+    """
+    Posts messages to an incoming webhook over one pooled requests.Session. Messages are
+    split at Slack's block and size limits, posted no faster than the webhook allows, and
+    retried with backoff (honoring Retry-After) on 429 and 5xx responses. Any other error
+    response is raised. Use as a context manager to close the session.
+    """
+
+    def __init__(self, webhook_url: str = None, session=None, rate: float = WEBHOOK_RATE,
+                 burst: int = WEBHOOK_BURST, max_retries: int = 5, scheduler: RequestScheduler = None) -> None:
+        if session is None:
+            import requests
+            session = requests.Session()
+        self.webhook_url = webhook_url or os.environ['SLACK_WEBHOOK']
+        self.session = session
+        self.scheduler = scheduler or RequestScheduler(rate, burst, 1, max_retries, base_delay=1.0, max_delay=30.0)
+        self.messages = 0
+
+    def _post(self, message: dict) -> None:
+        response = self.session.post(self.webhook_url, json=message, timeout=30)
+        response.raise_for_status()
+
+    def send(self, message: dict) -> None:
+        """Post one message as is"""
+        self.scheduler.execute(self.webhook_url, lambda: self._post(message))
+        self.messages += 1
+
+    def post(self, blocks: list, header: list = (), footer: list = (), text: str = None) -> int:
+        """Post the blocks in as many messages as needed; returns how many were sent.
+        `text` is the notification fallback of each message"""
+        messages = chunk_blocks(blocks, header, footer)
+        for index, message_blocks in enumerate(messages):
+            message = {'blocks': message_blocks}
+            if text:
+                message['text'] = text if len(messages) == 1 else '{} ({}/{})'.format(text, index + 1, len(messages))
+            self.send(message)
+        return len(messages)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> 'SlackDelivery':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
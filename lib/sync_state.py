@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Persisted per project/package watermarks for incremental execution syncs"""
+
+import json
+import os
+
+
+class SyncState:
+    """
+    A small JSON file recording, for each project and filterByName pair, the
+    creationTime and executionId of the newest execution already processed.
+    Without a path the state only lives in memory, e.g. for a long-running service.
+    """
+
+    def __init__(self, path: str = None) -> None:
+        self.path = path
+        self.watermarks = {}
+        self.parent = None
+        if path is not None:
+            try:
+                with open(path) as state_file:
+                    self.watermarks = json.load(state_file)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def key(project: str, filter_by_name: str) -> str:
+        return '{}/{}'.format(project, filter_by_name)
+
+    def get(self, project: str, filter_by_name: str) -> dict:
+        """Return the watermark ({'creationTime': int, 'executionId': str}) or None before the first sync"""
+        watermark = self.watermarks.get(self.key(project, filter_by_name))
+        if watermark is None and self.parent is not None:
+            return self.parent.get(project, filter_by_name)
+        return watermark
+
+    def set(self, project: str, filter_by_name: str, execution: dict) -> None:
+        self.watermarks[self.key(project, filter_by_name)] = {
+            'creationTime': int(execution['creationTime']['seconds']),
+            'executionId': execution['executionId'],
+        }
+
+    def fork(self) -> 'SyncState':
+        """An in-memory state reading through to this one, whose watermarks only reach it through commit(),
+        e.g. so a target that fails in a multi-target run does not move its watermarks"""
+        fork = SyncState()
+        fork.parent = self
+        return fork
+
+    def commit(self) -> None:
+        """Copy the watermarks set on a fork to the state it was forked from"""
+        self.parent.watermarks.update(self.watermarks)
+
+    def save(self) -> None:
+        """Write the state atomically so an interrupted run never leaves a partial file behind"""
+        if self.path is None:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as state_file:
+            json.dump(self.watermarks, state_file, indent=4)
+        os.replace(temp_path, self.path)
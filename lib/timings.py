@@ -0,0 +1,197 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Columnar step and test case timings, with vectorized per-day statistics"""
+
+import json
+import os
+from array import array
+
+import numpy as np
+
+from lib.records import ExecutionDetails
+
+"""Outcome and status names, stored as their index in these tuples"""
+OUTCOMES = ('success', 'failure', 'inconclusive', 'skipped', 'flaky', 'unset')
+STATUSES = ('passed', 'failed', 'error', 'skipped', 'flaky')
+
+STEP_COLUMNS = ('execution', 'step', 'created', 'duration', 'outcome', 'crashed')
+CASE_COLUMNS = ('execution', 'step', 'created', 'elapsed', 'status')
+
+
+def _code(names: tuple, name: str) -> int:
+    return names.index(name) if name in names else -1
+
+
+class TimingColumns:
+    """
+    Step and test case durations, outcomes and timestamps of one project and package,
+    appended row by row into compact arrays and handed out as NumPy columns. Missing
+    durations are NaN. Step IDs are stored as strings, the rest as numbers.
+    """
+
+    def __init__(self, project: str, package: str) -> None:
+        self.project = project
+        self.package = package
+        self.steps = {
+            'execution': array('q'), 'step': [], 'created': array('q'), 'duration': array('d'),
+            'outcome': array('b'), 'crashed': array('b'),
+        }
+        self.cases = {
+            'execution': array('q'), 'step': [], 'created': array('q'), 'elapsed': array('d'),
+            'status': array('b'),
+        }
+
+    def add(self, details: ExecutionDetails) -> None:
+        """Append the steps of an execution and whichever of their test cases were fetched"""
+        execution_id = int(details.execution.executionId)
+        for step in details.steps:
+            created = step.creationTime if step.creationTime is not None else details.execution.creationTime
+            self.steps['execution'].append(execution_id)
+            self.steps['step'].append(step.stepId)
+            self.steps['created'].append(created)
+            self.steps['duration'].append(float('nan') if step.duration is None else step.duration)
+            self.steps['outcome'].append(_code(OUTCOMES, step.outcome))
+            self.steps['crashed'].append(step.crashed)
+            for case in details.testCases.get(step.stepId, []):
+                self.cases['execution'].append(execution_id)
+                self.cases['step'].append(step.stepId)
+                self.cases['created'].append(created)
+                self.cases['elapsed'].append(float('nan') if case.elapsed is None else case.elapsed)
+                self.cases['status'].append(_code(STATUSES, case.status))
+
+    def arrays(self) -> tuple:
+        """The (steps, test cases) columns as dicts of NumPy arrays"""
+        def convert(columns: dict) -> dict:
+            return {
+                name: np.array(values, dtype=str) if name == 'step' else np.frombuffer(values, dtype=values.typecode)
+                for name, values in columns.items()
+            }
+        steps, cases = convert(self.steps), convert(self.cases)
+        steps['crashed'] = steps['crashed'].astype(bool)
+        return steps, cases
+
+
+def _unique_rows(columns: dict) -> dict:
+    """Drop repeated (execution, step) rows of step columns, keeping the last one"""
+    keys = np.char.add(columns['execution'].astype(str), np.char.add('/', columns['step'].astype(str)))
+    _, first = np.unique(keys[::-1], return_index=True)
+    keep = np.sort(len(keys) - 1 - first)
+    return {name: values[keep] for name, values in columns.items()}
+
+
+def save(path: str, timings: TimingColumns) -> dict:
+    """Merge the timings into the archive at `path` (created if missing) and return its step columns.
+    Steps already archived are replaced, so runs over overlapping windows do not count twice."""
+    steps, cases = timings.arrays()
+    if os.path.exists(path):
+        archived_steps, archived_cases = load(path)
+        steps = _unique_rows({name: np.concatenate([archived_steps[name], steps[name]]) for name in STEP_COLUMNS})
+        fetched = np.isin(archived_cases['execution'], cases['execution'])
+        cases = {name: np.concatenate([archived_cases[name][~fetched], cases[name]]) for name in CASE_COLUMNS}
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(
+        path,
+        project=timings.project,
+        package=timings.package,
+        **{'steps_' + name: values for name, values in steps.items()},
+        **{'cases_' + name: values for name, values in cases.items()}
+    )
+    return steps
+
+
+def load(path: str) -> tuple:
+    """The (steps, test cases) columns of an archive written by save()"""
+    with np.load(path) as archive:
+        return (
+            {name: archive['steps_' + name] for name in STEP_COLUMNS},
+            {name: archive['cases_' + name] for name in CASE_COLUMNS},
+        )
+
+
+def archive_path(directory: str, project: str, package: str) -> str:
+    return os.path.join(directory, project, '{}.npz'.format(package))
+
+
+def _group_quantile(values: np.ndarray, starts: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    """The nearest-rank q-quantile of every group of `values`, which are sorted within each group"""
+    return values[starts + np.ceil(q * counts).astype(np.int64).clip(1, None) - 1]
+
+
+def daily_stats(steps: dict, cases: dict = None) -> list:
+    """
+    Per UTC day: step count, p50/p95/max step duration (seconds), step pass rate, crashed
+    steps and total device minutes, plus the test case count and failure rate when given.
+    Computed over whole columns with no Python loop over rows.
+    """
+    if not len(steps['created']):
+        return []
+    days, day_index = np.unique(steps['created'] // 86400, return_inverse=True)
+    step_count = np.bincount(day_index, minlength=len(days))
+    passed = np.bincount(day_index, weights=steps['outcome'] == OUTCOMES.index('success'), minlength=len(days))
+    crashed = np.bincount(day_index, weights=steps['crashed'], minlength=len(days))
+
+    timed = ~np.isnan(steps['duration'])
+    durations, timed_days = steps['duration'][timed], day_index[timed]
+    order = np.lexsort((durations, timed_days))
+    durations, timed_days = durations[order], timed_days[order]
+    timed_count = np.bincount(timed_days, minlength=len(days))
+    starts = np.concatenate([[0], np.cumsum(timed_count)[:-1]])
+    has_timing = timed_count > 0
+    p50, p95, longest = (np.full(len(days), np.nan) for _ in range(3))
+    p50[has_timing] = _group_quantile(durations, starts[has_timing], timed_count[has_timing], 0.5)
+    p95[has_timing] = _group_quantile(durations, starts[has_timing], timed_count[has_timing], 0.95)
+    longest[has_timing] = durations[starts[has_timing] + timed_count[has_timing] - 1]
+    device_minutes = np.bincount(timed_days, weights=durations, minlength=len(days)) / 60
+
+    case_count = failed_cases = np.zeros(len(days))
+    if cases is not None and len(cases['created']):
+        case_days = np.searchsorted(days, cases['created'] // 86400)
+        known = (case_days < len(days)) & (days[case_days.clip(None, len(days) - 1)] == cases['created'] // 86400)
+        case_days = case_days[known]
+        case_count = np.bincount(case_days, minlength=len(days))
+        failed_cases = np.bincount(
+            case_days, weights=cases['status'][known] == STATUSES.index('failed'), minlength=len(days))
+
+    def number(value: float):
+        return None if np.isnan(value) else round(float(value), 2)
+
+    return [
+        {
+            'day': np.datetime_as_string(np.datetime64(int(day), 'D')),
+            'steps': int(step_count[i]),
+            'p50Seconds': number(p50[i]),
+            'p95Seconds': number(p95[i]),
+            'maxSeconds': number(longest[i]),
+            'passRate': round(float(passed[i] / step_count[i]), 4),
+            'crashedSteps': int(crashed[i]),
+            'deviceMinutes': round(float(device_minutes[i]), 2),
+            'testCases': int(case_count[i]),
+            'testCaseFailureRate': round(float(failed_cases[i] / case_count[i]), 4) if case_count[i] else None,
+        }
+        for i, day in enumerate(days)
+    ]
+
+
+def write_stats(directory: str, path: str = None) -> list:
+    """Write the daily statistics of every project and package archived under `directory`
+    (to `path`, by default stats.json in it) and return them"""
+    stats = []
+    for project in sorted(os.listdir(directory)):
+        if not os.path.isdir(os.path.join(directory, project)):
+            continue
+        for archive in sorted(os.listdir(os.path.join(directory, project))):
+            if archive.endswith('.npz'):
+                steps, cases = load(os.path.join(directory, project, archive))
+                stats.append({
+                    'project': project,
+                    'application': archive[:-len('.npz')],
+                    'days': daily_stats(steps, cases),
+                })
+    with open(path or os.path.join(directory, 'stats.json'), 'w') as outfile:
+        json.dump(stats, outfile, indent=4)
+    return stats
@@ -11,10 +11,9 @@ generated by client.py
 
 import argparse
 import json
-import os
 import sys
 
-import requests
+from lib.slack_delivery import SlackDelivery, load_payloads
 
 
 def parse_args(cmdln_args):
@@ -24,8 +23,9 @@ def parse_args(cmdln_args):
 
     parser.add_argument(
         '--input',
-        default='payload.json',
-        help='Input (JSON)',
+        default=['payload.json'],
+        nargs='+',
+        help='Input (JSON); several files are combined into one digest',
         required=False
     )
 
@@ -39,9 +39,10 @@ def parse_args(cmdln_args):
     return parser.parse_args(args=cmdln_args)
 
 
-def post_to_slack(data):
-    webhook_url = os.environ['SLACK_WEBHOOK']
-    requests.post(webhook_url, json=data)
+def post_to_slack(content: list, header: list = (), footer: list = ()) -> None:
+    """Post the content between the header and footer, split over several messages if needed"""
+    with SlackDelivery() as delivery:
+        delivery.post(content, header, footer)
 
 
 def get_header_app_name(dataset: dict) -> str:
@@ -64,8 +65,18 @@ def get_header_app_emoji(dataset: dict) -> str:
             return ':android:'
 
 
-def build_payload_header(header_type: str, dataset: dict) -> str:
+def build_payload_header(header_type: str, dataset) -> str:
     match header_type:
+        case 'cases' if isinstance(dataset, list):
+            return [
+                {
+                    "type": "header",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Daily UI Tests Ran Count"
+                    }
+                }
+            ]
         case 'cases':
             return [
                 {
@@ -92,8 +103,35 @@ def build_payload_header(header_type: str, dataset: dict) -> str:
             ]
 
 
-def build_payload_content(type: str, dataset: dict) -> list:
+def format_entry(entry: dict) -> str:
+    """A target's count, or its error for targets that failed"""
+    if 'error' in entry:
+        return "{emoji} {app}: :warning: failed ({error})".format(
+            emoji=get_header_app_emoji(entry),
+            app=entry['application'],
+            error=entry['error']
+        )
+    return "{emoji} {app}: *{count}*".format(
+        emoji=get_header_app_emoji(entry),
+        app=entry['application'],
+        count=str(entry['payload'])
+    )
+
+
+def build_payload_content(type: str, dataset) -> list:
     match type:
+        case 'cases' if isinstance(dataset, list):
+            """A combined payload from a multi-project client.py run"""
+            return [
+                {
+                    "type": "section",
+                    "text": {
+                        "type": "mrkdwn",
+                        "text": format_entry(entry)
+                    }
+                }
+                for entry in dataset
+            ]
         case 'cases':
             return [
                 {
@@ -117,28 +155,29 @@ def build_payload_content(type: str, dataset: dict) -> list:
 def main():
     args = parse_args(sys.argv[1:])
     try:
-        with open(args.input) as data_file:
-            dataset = json.load(data_file)
-            header = build_payload_header(args.type, dataset)
-            content = build_payload_content(args.type, dataset)
-            divider = [{"type": "divider"}]
-            footer = [
-                    {
-                        "type": "context",
-                        "elements": [
-                            {
-                                "type": "mrkdwn",
-                                "text": ":testops-notify: created by [<{}|{}>]"
-                                .format(
-                                    "https://mana.mozilla.org/wiki/x/P_zNBw",
-                                    "Mobile Test Engineering")
-                            }
-                        ]
-                    }
-                ]
-        post_to_slack(
-            {'blocks': header + divider + content + divider + footer}
-        )
+        if len(args.input) > 1:
+            dataset = load_payloads(args.input)
+        else:
+            with open(args.input[0]) as data_file:
+                dataset = json.load(data_file)
+        header = build_payload_header(args.type, dataset)
+        content = build_payload_content(args.type, dataset)
+        divider = [{"type": "divider"}]
+        footer = [
+                {
+                    "type": "context",
+                    "elements": [
+                        {
+                            "type": "mrkdwn",
+                            "text": ":testops-notify: created by [<{}|{}>]"
+                            .format(
+                                "https://mana.mozilla.org/wiki/x/P_zNBw",
+                                "Mobile Test Engineering")
+                        }
+                    ]
+                }
+            ]
+        post_to_slack(content, header + divider, divider + footer)
     except FileNotFoundError as e:
         print(e)
         sys.exit(1)
@@ -0,0 +1,92 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""The asyncio client against a local fake ToolResults server, compared with the threaded FirebaseHelper"""
+
+import asyncio
+
+import pytest
+
+from firebase import ExecutionOutcome, FirebaseHelper
+from lib.fake_toolresults import FakeConnection, FakeToolResults, FakeToolResultsServer, SyntheticHistory
+from lib.scheduler import RequestScheduler
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from async_firebase import AsyncFirebaseHelper  # noqa: E402
+
+PROJECT = 'moz-fenix'
+PACKAGE = 'org.mozilla.fenix.debug'
+
+
+@pytest.fixture(scope='module')
+def history():
+    return SyntheticHistory(12, 4, 6, now=1_700_000_000)
+
+
+@pytest.fixture
+def server(history):
+    with FakeToolResultsServer(FakeToolResults(history)) as server:
+        yield server
+
+
+def scheduler(max_retries: int = 5) -> RequestScheduler:
+    return RequestScheduler(None, max_retries=max_retries, base_delay=0.01, max_delay=0.05)
+
+
+def reports(endpoint: str, scheduler: RequestScheduler, concurrency: int = 16) -> tuple:
+    async def run():
+        async with AsyncFirebaseHelper(PROJECT, PACKAGE, concurrency, endpoint, anonymous=True,
+                                       scheduler=scheduler) as helper:
+            results = await helper.get_test_case_results_by_execution_summary(ExecutionOutcome.FAILURE.value, since=0)
+            count = await helper.get_recent_step_count_by_execution_summary(ExecutionOutcome.SUCCESS.value, since=0)
+        return results, count
+
+    return asyncio.run(run())
+
+
+def expected(history) -> tuple:
+    helper = FirebaseHelper(PROJECT, PACKAGE, connection=FakeConnection(FakeToolResults(history)),
+                            scheduler=RequestScheduler(None))
+    return (
+        helper.get_test_case_results_by_execution_summary(ExecutionOutcome.FAILURE.value, since=0),
+        helper.get_recent_step_count_by_execution_summary(ExecutionOutcome.SUCCESS.value, since=0),
+    )
+
+
+def test_matches_threaded_helper(history, server):
+    assert reports(server.endpoint, scheduler()) == expected(history)
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_retries_throttled_and_failed_requests(history, server, status):
+    requests = scheduler()
+    server.inject_errors(status, count=3)
+    assert reports(server.endpoint, requests) == expected(history)
+    assert server.errors_sent == 3
+    assert requests.retries == 3
+
+
+def test_waits_as_long_as_retry_after(history, server):
+    requests = scheduler()
+    server.inject_errors(429, retry_after=0.3)
+    assert reports(server.endpoint, requests, concurrency=1) == expected(history)
+    assert requests.retries == 1
+    assert requests.throttled_seconds >= 0.3
+
+
+def test_gives_up_after_max_retries(server):
+    server.inject_errors(503, count=2)
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        reports(server.endpoint, scheduler(max_retries=1))
+    assert error.value.status == 503
+
+
+def test_does_not_retry_client_errors(server):
+    requests = scheduler()
+    server.inject_errors(403)
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        reports(server.endpoint, requests)
+    assert error.value.status == 403
+    assert requests.retries == 0
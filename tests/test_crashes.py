@@ -0,0 +1,121 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from lib.crashes import MAX_SIGNATURE_CHARS, UNKNOWN_CRASH, CrashIndex, crash_signature, step_crashes
+from lib.records import Execution, ExecutionDetails, Step
+
+JAVA_TRACE = '''java.lang.IllegalStateException: Fragment {fragment} not attached to a context.
+\tat androidx.fragment.app.Fragment.requireContext(Fragment.java:{line})
+\tat org.mozilla.fenix.home.HomeFragment.onCreateView(HomeFragment.kt:212)
+'''
+
+NATIVE_TRACE = '''signal 11 (SIGSEGV), code 1 (SEGV_MAPERR), fault addr {address}
+  #00 pc {pc}  /system/lib64/libc.so (strlen+16)
+  #01 pc 000000000001f2b0  /data/app/org.mozilla.fenix/lib/arm64/libxul.so
+'''
+
+PIXEL = (('Model', 'Pixel2'), ('Version', '28'))
+NEXUS = (('Model', 'Nexus6'), ('Version', '25'))
+DAY = 86400
+NOW = 100 * DAY
+
+
+def test_java_signature():
+    assert crash_signature('fatalException', JAVA_TRACE.format(fragment='4f2a1b0', line=805)) == (
+        'fatalException | java.lang.IllegalStateException: Fragment # not attached to a context.'
+        ' | at androidx.fragment.app.Fragment.requireContext(Fragment.java:#)'
+    )
+
+
+def test_native_signature_skips_frame_number_and_pc():
+    assert crash_signature('nativeCrash', NATIVE_TRACE.format(address='0xdeadbeef', pc='000000000004a3c8')) == (
+        'nativeCrash | signal # (SIGSEGV), code # (SEGV_MAPERR), fault addr # | /system/lib64/libc.so (strlen+#)'
+    )
+
+
+@pytest.mark.parametrize('trace', [
+    JAVA_TRACE.format(fragment='a81c93f', line=811),
+    '\n' + JAVA_TRACE.format(fragment='0', line=1).replace('\t', '    '),
+])
+def test_same_crash_in_other_runs_shares_a_signature(trace):
+    assert crash_signature('fatalException', trace) == \
+        crash_signature('fatalException', JAVA_TRACE.format(fragment='4f2a1b0', line=805))
+
+
+def test_signature_depends_on_issue_type_and_top_frame():
+    trace = JAVA_TRACE.format(fragment='0', line=1)
+    assert crash_signature('anr', trace) != crash_signature('fatalException', trace)
+    other_frame = trace.replace('requireContext', 'requireActivity')
+    assert crash_signature('fatalException', other_frame) != crash_signature('fatalException', trace)
+
+
+@pytest.mark.parametrize('trace', [None, '', '  \n'])
+def test_signature_without_trace(trace):
+    assert crash_signature('anr', trace) == 'anr'
+
+
+def test_signature_without_frames_and_length():
+    assert crash_signature('anr', 'Input dispatching timed out') == 'anr | Input dispatching timed out'
+    assert len(crash_signature('anr', 'x' * 1000)) == MAX_SIGNATURE_CHARS
+
+
+def step(step_id: str, dimensions: tuple = PIXEL, crashes: tuple = (), crashed: bool = None, created: int = None):
+    return Step(step_id, created, 'failure', bool(crashes) if crashed is None else crashed, dimensions, None, (),
+                crashes)
+
+
+def test_step_crashes():
+    java = ('fatalException', JAVA_TRACE.format(fragment='0', line=1))
+    assert step_crashes(step('1', crashes=(java,))) == [('fatalException', crash_signature(*java))]
+    assert step_crashes(step('1', crashed=True)) == [(UNKNOWN_CRASH, UNKNOWN_CRASH)]
+    assert step_crashes(step('1', crashed=True, crashes=None)) == [(UNKNOWN_CRASH, UNKNOWN_CRASH)]
+    assert step_crashes(step('1')) == []
+
+
+def details(execution_id: str, day: int, steps: list) -> ExecutionDetails:
+    return ExecutionDetails(Execution(execution_id, 'complete', day * DAY, 'failure'), steps, [])
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = CrashIndex(str(tmp_path / 'crashes.sqlite'))
+    yield index
+    index.close()
+
+
+def test_top_crashes(index):
+    java = ('fatalException', JAVA_TRACE.format(fragment='0', line=1))
+    native = ('nativeCrash', NATIVE_TRACE.format(address='0x0', pc='0'))
+    for day, execution in enumerate('123', 97):
+        assert index.add('moz-fenix', 'fenix', details(execution, day, [
+            step('a', PIXEL, (java,)),
+            step('b', NEXUS, (java,) if execution == '3' else ()),
+        ])) == (2 if execution == '3' else 1)
+    index.add('moz-fenix', 'fenix', details('4', 99, [step('a', NEXUS, (native,))]))
+    index.add('moz-fenix', 'focus', details('5', 99, [step('a', NEXUS, (native,))]))
+
+    java_crash, native_crash = index.top_crashes('moz-fenix', 'fenix', now=NOW)
+    assert java_crash == {
+        'signature': crash_signature(*java),
+        'type': 'fatalException',
+        'executions': 3,
+        'occurrences': 4,
+        'deviceCount': 2,
+        'devices': {'Pixel2/28': 3, 'Nexus6/25': 1},
+        'firstSeen': '1970-04-08',
+        'lastSeen': '1970-04-10',
+    }
+    assert native_crash['executions'] == 1 and native_crash['devices'] == {'Nexus6/25': 1}
+    assert index.top_crashes('moz-fenix', 'fenix', limit=1, now=NOW) == [java_crash]
+
+
+def test_prune_keeps_first_sighting(index):
+    java = ('fatalException', JAVA_TRACE.format(fragment='0', line=1))
+    index.add('moz-fenix', 'fenix', details('1', 80, [step('a', crashes=(java,))]))
+    index.add('moz-fenix', 'fenix', details('2', 99, [step('a', crashes=(java,))]))
+    index.prune(14, now=NOW)
+    [crash] = index.top_crashes('moz-fenix', 'fenix', days=30, now=NOW)
+    assert (crash['executions'], crash['firstSeen']) == (1, '1970-03-22')
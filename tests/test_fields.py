@@ -0,0 +1,82 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from firebase import Fields
+from lib import fields
+from lib.records import Step
+
+
+@pytest.mark.parametrize('mask, selection', [
+    ('', {}),
+    ('stepId', {'stepId': None}),
+    ('nextPageToken,steps/stepId', {'nextPageToken': None, 'steps': {'stepId': None}}),
+    ('steps(stepId,outcome/summary)', {'steps': {'stepId': None, 'outcome': {'summary': None}}}),
+    ('a/b/c(d,e(f))', {'a': {'b': {'c': {'d': None, 'e': {'f': None}}}}}),
+    ('a(b),c', {'a': {'b': None}, 'c': None}),
+    (' steps( stepId ,\n outcome )', {'steps': {'stepId': None, 'outcome': None}}),
+    # Selections of the same field merge, and selecting the whole field wins
+    ('a/b,a/c', {'a': {'b': None, 'c': None}}),
+    ('a(b/c),a(b/d)', {'a': {'b': {'c': None, 'd': None}}}),
+    ('a/b,a', {'a': None}),
+    ('a,a/b', {'a': None}),
+])
+def test_parse(mask, selection):
+    assert fields.parse(mask) == selection
+
+
+@pytest.mark.parametrize('mask', ['a(b', 'a(b(c)', 'a)', 'a(b))', 'a),b'])
+def test_parse_unbalanced(mask):
+    with pytest.raises(ValueError, match='Unbalanced'):
+        fields.parse(mask)
+
+
+@pytest.mark.parametrize('mask', [mask.value for mask in Fields])
+def test_parse_report_masks(mask):
+    assert fields.parse(mask)['nextPageToken'] is None
+
+
+def test_project():
+    response = {
+        'nextPageToken': 'page2',
+        'steps': [
+            {'stepId': '1', 'name': 'Pixel2', 'outcome': {'summary': 'success', 'successDetail': {}}},
+            {'stepId': '2', 'outcome': 'not a dict'},
+            {'name': 'no id'},
+        ],
+    }
+    assert fields.project(response, fields.parse('steps(stepId,outcome/summary)')) == {
+        'steps': [
+            {'stepId': '1', 'outcome': {'summary': 'success'}},
+            {'stepId': '2', 'outcome': 'not a dict'},
+            {},
+        ],
+    }
+    assert fields.project(response, fields.parse('nextPageToken,steps')) == response
+    assert fields.project(response, None) is response
+
+
+def test_steps_mask_keeps_what_steps_read():
+    step = {
+        'stepId': '1',
+        'name': 'Pixel2-28-en',
+        'creationTime': {'seconds': '1700000000', 'nanos': 5},
+        'completionTime': {'seconds': '1700000300'},
+        'outcome': {'summary': 'failure', 'failureDetail': {'crashed': True, 'timedOut': False}},
+        'dimensionValue': [{'key': 'Model', 'value': 'Pixel2'}, {'key': 'Version', 'value': '28'}],
+        'testExecutionStep': {
+            'testTiming': {'testProcessDuration': {'seconds': '120'}},
+            'testIssues': [
+                {'type': 'fatalException', 'errorMessage': 'Crashed', 'severity': 'severe',
+                 'stackTrace': {'exception': 'java.lang.IllegalStateException\n\tat a.b(C.java:1)'}},
+                {'type': 'nonSdkApiUsageViolation', 'errorMessage': 'Used hidden API'},
+            ],
+            'toolExecution': {'toolLogs': [{'fileUri': 'gs://bucket/log'}]},
+        },
+    }
+    selection = fields.parse(Fields.STEPS.value)
+    partial = fields.project({'steps': [step]}, selection)['steps'][0]
+    assert 'completionTime' not in partial and 'toolExecution' not in partial['testExecutionStep']
+    assert Step.from_response(partial) == Step.from_response(step)
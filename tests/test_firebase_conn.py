@@ -0,0 +1,24 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from firebase import Firebase
+from lib.firebase_conn import CREDENTIAL_VARIABLES
+
+pytest.importorskip('googleapiclient')
+pytest.importorskip('google.oauth2')
+
+
+def test_missing_credentials_are_reported_on_first_request(monkeypatch):
+    monkeypatch.delenv(CREDENTIAL_VARIABLES['moz-focus-android'], raising=False)
+    firebase = Firebase('moz-focus-android', 'org.mozilla.focus.debug')
+    with pytest.raises(Exception, match='Please set the GCLOUD_AUTH_MOZ_FOCUS_ANDROID auth environment variable'):
+        firebase.get_histories()
+
+
+def test_unknown_project_is_reported_on_first_request():
+    firebase = Firebase('moz-unknown', 'org.mozilla.unknown')
+    with pytest.raises(Exception, match="Unknown Firebase project 'moz-unknown'"):
+        firebase.get_histories()
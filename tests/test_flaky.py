@@ -0,0 +1,110 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from lib import records
+from lib.flaky import FlakyIndex, RunOutcome, run_outcome
+from lib.records import Execution, ExecutionDetails, Step
+
+PIXEL = (('Model', 'Pixel2'), ('Version', '28'))
+NEXUS = (('Model', 'Nexus6'), ('Version', '25'))
+DAY = 86400
+NOW = 100 * DAY
+
+
+@pytest.mark.parametrize('environments, outcome', [
+    ({}, None),
+    ({PIXEL: {'skipped'}}, None),
+    ({PIXEL: {'passed'}}, RunOutcome.PASSED),
+    ({PIXEL: {'passed', 'skipped'}}, RunOutcome.PASSED),
+    ({PIXEL: {'failed'}}, RunOutcome.FAILED),
+    ({PIXEL: {'error'}}, RunOutcome.FAILED),
+    ({PIXEL: {'flaky'}}, RunOutcome.FLAKY),
+    ({PIXEL: {'passed', 'failed'}}, RunOutcome.FLAKY),
+    ({PIXEL: {'passed', 'error'}}, RunOutcome.FLAKY),
+    # Failing on one device and passing on another is a device specific failure, not a flake
+    ({PIXEL: {'passed'}, NEXUS: {'failed'}}, RunOutcome.FAILED),
+    ({PIXEL: {'failed'}, NEXUS: {'passed'}}, RunOutcome.FAILED),
+    ({PIXEL: {'passed'}, NEXUS: {'passed', 'failed'}}, RunOutcome.FLAKY),
+])
+def test_run_outcome(environments, outcome):
+    assert run_outcome(environments) == outcome
+
+
+def details(execution_id: int, day: int, cases: dict) -> ExecutionDetails:
+    """An execution with one step per device, `cases` mapping each device to its (name, status) pairs"""
+    steps = [Step('step{}'.format(index), None, None, False, dims) for index, dims in enumerate(cases)]
+    return ExecutionDetails(
+        Execution(str(execution_id), 'complete', day * DAY, 'success'),
+        steps,
+        [],
+        {
+            step.stepId: [
+                records.TestCase(None, status, name, 'org.mozilla.Tests') for name, status in cases[step.dimensions]
+            ]
+            for step in steps
+        }
+    )
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = FlakyIndex(str(tmp_path / 'flaky.sqlite'))
+    yield index
+    index.close()
+
+
+def test_flaky_tests(index):
+    """`retried` flakes in 2 of 4 runs and `device` only fails on one device, which is not a flake"""
+    for execution, day in enumerate(range(96, 100)):
+        retry = [('retried', 'passed'), ('retried', 'failed')] if execution % 2 else [('retried', 'passed')]
+        assert index.add('moz-fenix', 'fenix', details(execution, day, {
+            PIXEL: retry + [('device', 'passed'), ('stable', 'passed')],
+            NEXUS: [('device', 'failed'), ('stable', 'passed')],
+        })) == 3
+    index.save()
+
+    [flaky] = index.flaky_tests('moz-fenix', 'fenix', now=NOW)
+    assert flaky == {
+        'testCase': {'className': 'org.mozilla.Tests', 'name': 'retried'},
+        'runs': 4,
+        'flakes': 2,
+        'failures': 0,
+        'flakeRate': 0.5,
+        'lastSeen': '1970-04-10',
+    }
+    assert index.flaky_tests('moz-fenix', 'fenix', now=NOW, min_runs=5) == []
+    assert index.flaky_tests('moz-fenix', 'focus', now=NOW) == []
+    assert index.flaky_tests('moz-fenix', 'fenix', days=3, min_runs=1, now=NOW)[0]['runs'] == 2
+
+
+def test_readding_an_execution_replaces_its_runs(index):
+    run = details(1, 99, {PIXEL: [('test', 'passed'), ('test', 'failed')]})
+    index.add('moz-fenix', 'fenix', run)
+    index.add('moz-fenix', 'fenix', run)
+    assert index.flaky_tests('moz-fenix', 'fenix', min_runs=1, now=NOW)[0]['runs'] == 1
+
+
+def test_prune(index):
+    index.add('moz-fenix', 'fenix', details(1, 90, {PIXEL: [('test', 'flaky')]}))
+    index.add('moz-fenix', 'fenix', details(2, 99, {PIXEL: [('test', 'flaky')]}))
+    index.prune(5, now=NOW)
+    assert index.flaky_tests('moz-fenix', 'fenix', days=30, min_runs=1, now=NOW)[0]['runs'] == 1
+
+
+def test_watermark_is_only_kept_once_saved(tmp_path):
+    path = str(tmp_path / 'flaky.sqlite')
+    index = FlakyIndex(path)
+    assert index.get('moz-fenix', 'fenix') is None
+    index.set('moz-fenix', 'fenix', {'executionId': '7', 'creationTime': {'seconds': '1700000000'}})
+    assert index.get('moz-fenix', 'fenix') == {'creationTime': 1700000000, 'executionId': '7'}
+    index.close()
+    assert FlakyIndex(path).get('moz-fenix', 'fenix') is None
+
+    index = FlakyIndex(path)
+    index.set('moz-fenix', 'fenix', {'executionId': '7', 'creationTime': {'seconds': '1700000000'}})
+    index.save()
+    index.close()
+    assert FlakyIndex(path).get('moz-fenix', 'fenix') == {'creationTime': 1700000000, 'executionId': '7'}
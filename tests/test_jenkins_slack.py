@@ -0,0 +1,79 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+
+import pytest
+
+from jenkins_slack import format_test, format_value, iter_records
+
+RECORDS = [
+    {'testName': 'org.mozilla.fenix.perf/StartupTest/testColdStart()', 'duration': 1234.56789, 'memory': 0},
+    {'testName': 'BracketsTest', 'note': 'a "quoted", [bracketed] } value\nover lines', 'nested': {'values': [1, 2]}},
+    {'testName': 'EmptyTest'},
+    7,
+    'text',
+]
+
+
+def write(tmp_path, text: str) -> str:
+    path = tmp_path / 'results.json'
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 64, 1 << 16])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_json_array(tmp_path, chunk_size, indent):
+    path = write(tmp_path, '\n  ' + json.dumps(RECORDS, indent=indent) + '\n')
+    assert list(iter_records(path, chunk_size)) == RECORDS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1 << 16])
+def test_ndjson(tmp_path, chunk_size):
+    path = write(tmp_path, '\n'.join(json.dumps(record) for record in RECORDS[:3]) + '\n\n')
+    assert list(iter_records(path, chunk_size)) == RECORDS[:3]
+
+
+@pytest.mark.parametrize('text', ['[]', ' [ ] ', '[\n]\n', ''])
+def test_empty(tmp_path, text):
+    assert list(iter_records(write(tmp_path, text))) == []
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1 << 16])
+def test_truncated_array(tmp_path, chunk_size):
+    path = write(tmp_path, json.dumps(RECORDS)[:-20])
+    with pytest.raises(ValueError, match='Truncated'):
+        list(iter_records(path, chunk_size))
+
+
+def test_streams_records(tmp_path):
+    """Records are yielded as they are read, before the end of the file"""
+    path = write(tmp_path, json.dumps(RECORDS[:2]) + ' trailing garbage that is never parsed')
+    records = iter_records(path, chunk_size=8)
+    assert next(records) == RECORDS[0]
+    assert next(records) == RECORDS[1]
+
+
+@pytest.mark.parametrize('value, formatted', [
+    (1.234567, 1.2346),
+    ('1.234567', 1.2346),
+    ('12', 12.0),
+    (3, 3),
+    (0, 0),
+    (True, True),
+    ('fast', 'fast'),
+    (None, None),
+])
+def test_format_value(value, formatted):
+    assert format_value(value) == formatted
+
+
+def test_format_test():
+    assert format_test(RECORDS[0]) == '*testColdStart*\nduration= 1234.5679\nmemory= 0'
+    change = {'change': 'regressed', 'delta': 0.125, 'baseline': 1097.3901}
+    assert format_test(RECORDS[0], {(RECORDS[0]['testName'], 'duration'): change}) == (
+        '*testColdStart*\nduration= 1234.5679  :small_red_triangle: +12.5% vs 1097.3901\nmemory= 0'
+    )
+    assert format_test({'testName': 'EmptyTest', 'skipped': None}) == '*EmptyTest*'
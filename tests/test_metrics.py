@@ -0,0 +1,56 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+
+import pytest
+
+from firebase import ExecutionOutcome, FirebaseHelper
+from lib.fake_toolresults import FakeConnection, FakeToolResults, FakeToolResultsServer, SyntheticHistory
+from lib.firebase_conn import FirebaseConn
+from lib.scheduler import RequestScheduler
+
+PROJECT = 'moz-fenix'
+
+
+def report(connection, workers: int = 4, batch: bool = False) -> dict:
+    helper = FirebaseHelper(PROJECT, 'org.mozilla.fenix.debug', workers, batch, connection=connection,
+                            scheduler=RequestScheduler(None))
+    helper.get_test_case_results_by_execution_summary(ExecutionOutcome.FAILURE.value)
+    helper.fetcher.close()
+    return helper.get_metrics()
+
+
+@pytest.fixture
+def backend():
+    return FakeToolResults(SyntheticHistory(6, 3, 5, now=1_700_000_000))
+
+
+def test_response_sizes_in_process(backend):
+    metrics = report(FakeConnection(backend))
+    assert metrics['responseBytes'] == backend.bytes
+    assert metrics['calls'] == backend.calls
+    assert sum(endpoint['responseBytes'] for endpoint in metrics['endpoints'].values()) == backend.bytes
+
+
+def test_response_sizes_over_http(tmp_path, backend):
+    """The sizes of the (gzip decoded) responses the transports received, batches included. An
+    injected transport is shared by the whole pool, and httplib2 is not thread-safe: one worker"""
+    httplib2 = pytest.importorskip('httplib2')
+    discovery_cache = pytest.importorskip('googleapiclient.discovery_cache')
+
+    with FakeToolResultsServer(backend) as server:
+        document = json.loads(discovery_cache.get_static_doc('toolresults', 'v1beta3'))
+        document['rootUrl'] = server.root_url
+        path = tmp_path / 'toolresults.json'
+        path.write_text(json.dumps(document))
+
+        served = backend.bytes
+        metrics = report(FirebaseConn(PROJECT, str(path), http=httplib2.Http()), workers=1)
+        assert metrics['responseBytes'] == backend.bytes - served
+
+        metrics = report(FirebaseConn(PROJECT, str(path), http=httplib2.Http()), workers=1, batch=True)
+        endpoints = metrics['endpoints']
+        assert endpoints['batch']['responseBytes'] > 0
+        assert sum(endpoint['responseBytes'] for endpoint in endpoints.values()) == metrics['responseBytes']
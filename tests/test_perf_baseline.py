@@ -0,0 +1,110 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from lib.perf_baseline import Change, PerfBaseline  # noqa: E402
+
+STARTUP = 'StartupTest'
+"""Durations around 100 with a scaled MAD of about 1.5"""
+HISTORY = [99, 101, 100, 102, 98, 100, 101, 99]
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    baseline = PerfBaseline(str(tmp_path / 'baseline.sqlite'))
+    yield baseline
+    baseline.close()
+
+
+def store(baseline: PerfBaseline, durations: list, **metrics) -> None:
+    for index, duration in enumerate(durations):
+        record = {'testName': STARTUP, 'duration': duration}
+        record.update({name: values[index] for name, values in metrics.items()})
+        baseline.add('rev{}'.format(index), [record])
+
+
+def test_add_stores_numbers(baseline):
+    assert baseline.add('rev0', [
+        {'testName': STARTUP, 'duration': 100, 'memory': '512.5', 'device': 'Pixel2', 'passed': True, 'skip': None},
+        {'testName': 'ScrollTest', 'duration': 50.5},
+    ]) == 3
+    assert baseline.metrics == [(STARTUP, 'duration'), (STARTUP, 'memory'), ('ScrollTest', 'duration')]
+    assert baseline.values('rev0').tolist() == [100, 512.5, 50.5]
+    assert baseline.values('missing') is None
+
+
+def test_readding_a_revision_replaces_it(baseline):
+    baseline.add('rev0', [{'testName': STARTUP, 'duration': 100}])
+    baseline.add('rev0', [{'testName': STARTUP, 'duration': 120}])
+    assert baseline.values('rev0').tolist() == [120]
+    assert len(baseline.history()) == 1
+
+
+def test_older_runs_lack_later_metrics(baseline):
+    baseline.add('rev0', [{'testName': STARTUP, 'duration': 100}])
+    baseline.add('rev1', [{'testName': STARTUP, 'memory': 512}])
+    baseline.close()
+    reopened = PerfBaseline(baseline.path)
+    assert reopened.values('rev0')[0] == 100 and math.isnan(reopened.values('rev0')[1])
+    assert math.isnan(reopened.values('rev1')[0]) and reopened.values('rev1')[1] == 512
+    reopened.close()
+
+
+def test_compare_flags_regression(baseline):
+    store(baseline, HISTORY + [120])
+    change = baseline.compare('rev8')[STARTUP, 'duration']
+    assert change['change'] == Change.REGRESSED
+    assert (change['value'], change['baseline']) == (120, 100)
+    assert change['delta'] == pytest.approx(0.2)
+    assert change['deviations'] == pytest.approx(20 / 1.4826)
+
+
+def test_compare_flags_improvement(baseline):
+    store(baseline, HISTORY + [80], frames=[60] * 8 + [75])
+    changes = baseline.compare('rev8', higher_is_better={'frames'})
+    assert changes[STARTUP, 'duration']['change'] == Change.IMPROVED
+    assert changes[STARTUP, 'frames']['change'] == Change.IMPROVED
+    assert changes[STARTUP, 'frames']['delta'] == pytest.approx(0.25)
+
+
+@pytest.mark.parametrize('durations, options', [
+    (HISTORY + [105], {}),
+    (HISTORY + [120], {'threshold': 0.25}),
+    ([100, 130, 70, 140, 60, 120, 80, 100] + [120], {}),
+    (HISTORY[:4] + [120], {}),
+    (HISTORY + [120], {'window': 3}),
+    (HISTORY + [120], {'min_runs': 9}),
+])
+def test_compare_ignores_noise_and_short_histories(baseline, durations, options):
+    """Small changes, changes within the spread of earlier runs and too few earlier runs are not flagged"""
+    store(baseline, durations)
+    assert baseline.compare('rev{}'.format(len(durations) - 1), **options) == {}
+
+
+def test_compare_uses_runs_before_the_revision(baseline):
+    store(baseline, HISTORY + [120, 100])
+    assert (STARTUP, 'duration') in baseline.compare('rev8')
+    assert baseline.compare('rev9') == {}
+
+
+def test_compare_skips_missing_and_zero_baselines(baseline):
+    store(baseline, HISTORY + [120], memory=[0] * 9, frames=[60] * 8 + [None])
+    assert list(baseline.compare('rev8')) == [(STARTUP, 'duration')]
+
+
+def test_compare_unknown_revision(baseline):
+    with pytest.raises(KeyError):
+        baseline.compare('missing')
+
+
+def test_prune(baseline):
+    store(baseline, HISTORY)
+    baseline.prune(3)
+    assert len(baseline.history(window=20)) == 3
+    assert baseline.values('rev0') is None and baseline.values('rev7') is not None
@@ -0,0 +1,123 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import json
+
+import pytest
+
+from lib.scheduler import RequestScheduler
+from lib.slack_delivery import SlackDelivery, SlackLimits, chunk_blocks, split_block, split_text
+
+MAX_BLOCKS = SlackLimits.MAX_BLOCKS.value
+MAX_SECTION_CHARS = SlackLimits.MAX_SECTION_CHARS.value
+MAX_FIELD_CHARS = SlackLimits.MAX_FIELD_CHARS.value
+
+
+def section(text: str, **block) -> dict:
+    return dict(block, type='section', text={'type': 'mrkdwn', 'text': text})
+
+
+def field(text: str) -> dict:
+    return {'type': 'mrkdwn', 'text': text}
+
+
+def texts(blocks: list) -> list:
+    return [block['text']['text'] for block in blocks]
+
+
+@pytest.mark.parametrize('text, limit, pieces', [
+    ('', 5, ['']),
+    ('short', 5, ['short']),
+    ('abcdefghij', 4, ['abcd', 'efgh', 'ij']),
+    ('ab\ncd\nef', 5, ['ab\ncd', 'ef']),
+    ('ab\ncdef', 3, ['ab', 'cde', 'f']),
+])
+def test_split_text(text, limit, pieces):
+    assert split_text(text, limit) == pieces
+
+
+def test_split_text_keeps_every_line():
+    lines = ['line {}'.format(number) for number in range(2000)]
+    pieces = split_text('\n'.join(lines), MAX_SECTION_CHARS)
+    assert all(len(piece) <= MAX_SECTION_CHARS for piece in pieces)
+    assert '\n'.join(pieces).split('\n') == lines
+
+
+@pytest.mark.parametrize('block', [
+    {'type': 'divider'},
+    {'type': 'header', 'text': {'type': 'plain_text', 'text': 'x' * 5000}},
+    section('x' * MAX_SECTION_CHARS, block_id='small'),
+    {'type': 'section', 'fields': [field('x')] * SlackLimits.MAX_FIELDS.value},
+])
+def test_split_block_keeps_blocks_within_limits(block):
+    assert split_block(block) == [block]
+
+
+def test_split_block_splits_long_text():
+    lines = ['line {}'.format(number) for number in range(1000)]
+    blocks = split_block(section('\n'.join(lines), block_id='results'))
+    assert len(blocks) > 1
+    assert all('block_id' not in block and len(block['text']['text']) <= MAX_SECTION_CHARS for block in blocks)
+    assert '\n'.join(texts(blocks)).split('\n') == lines
+
+
+def test_split_block_splits_fields():
+    block = {'type': 'section', 'text': field('title'), 'fields': [field(str(number)) for number in range(12)]
+             + [field('y' * (MAX_FIELD_CHARS + 1))]}
+    blocks = split_block(block)
+    assert blocks[0] == {'type': 'section', 'text': field('title')}
+    assert [len(block['fields']) for block in blocks[1:]] == [10, 4]
+    assert [piece['text'] for piece in blocks[2]['fields']] == ['10', '11', 'y' * MAX_FIELD_CHARS, 'y']
+
+
+def test_chunk_blocks_fits_in_one_message():
+    header, body, footer = [section('header')], [section(str(number)) for number in range(10)], [section('footer')]
+    assert chunk_blocks(body, header, footer) == [header + body + footer]
+    assert chunk_blocks([]) == []
+    assert chunk_blocks([], header, footer) == [header + footer]
+
+
+def test_chunk_blocks_at_block_limit():
+    header, body, footer = [section('header')], [section(str(number)) for number in range(120)], [section('footer')]
+    messages = chunk_blocks(body, header, footer)
+    assert [len(message) for message in messages] == [MAX_BLOCKS, MAX_BLOCKS, 22]
+    assert messages[0][0] == header[0] and messages[-1][-1] == footer[0]
+    assert [block for message in messages for block in message] == header + body + footer
+
+
+def test_chunk_blocks_at_character_limit():
+    body = [section('x' * MAX_SECTION_CHARS) for _ in range(40)]
+    messages = chunk_blocks(body)
+    assert len(messages) > 1
+    assert all(len(json.dumps(message)) <= SlackLimits.MAX_MESSAGE_CHARS.value for message in messages)
+    assert [block for message in messages for block in message] == body
+
+
+def test_chunk_blocks_moves_footer_that_does_not_fit():
+    body, footer = [section(str(number)) for number in range(MAX_BLOCKS - 1)], [section('a'), section('b')]
+    assert chunk_blocks(body, footer=footer) == [body, footer]
+
+
+class RecordingSession:
+    def __init__(self) -> None:
+        self.messages = []
+
+    def post(self, url: str, json: dict, timeout: float) -> 'RecordingSession':
+        self.messages.append(json)
+        return self
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def test_post_numbers_the_messages():
+    session = RecordingSession()
+    with SlackDelivery('https://hooks.slack.test', session, scheduler=RequestScheduler(None)) as slack:
+        assert slack.post([section(str(number)) for number in range(60)], text='Results') == 2
+        assert slack.post([section('one')], text='Results') == 1
+    assert [message['text'] for message in session.messages] == ['Results (1/2)', 'Results (2/2)', 'Results']
+    assert slack.messages == 3